@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+Sphinx Gallery build planner
+============================
+
+Shows which examples a Sphinx-Gallery build would execute and why, with
+its estimated execution time, without executing anything.
+
+"""
+# License: 3-clause BSD
+
+from __future__ import division, absolute_import, print_function
+
+from sphinx_galleria.planner import plan_cli
+
+
+if __name__ == '__main__':
+    plan_cli()
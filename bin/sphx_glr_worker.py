@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+Sphinx Gallery distributed build worker
+=======================================
+
+Pulls examples from the work queue of a Sphinx-Gallery build, generates
+them in a checkout of the documentation and pushes their outputs back.
+
+"""
+# License: 3-clause BSD
+
+from __future__ import division, absolute_import, print_function
+
+from sphinx_galleria.work_queue import worker_cli
+
+
+if __name__ == '__main__':
+    worker_cli()
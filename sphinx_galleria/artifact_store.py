@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Artifact store
+==============
+
+Content-addressed store of the outputs of executed examples, shared by all
+the builds of a machine. The outputs of an example are stored under the hash
+of all its inputs, so that switching branches or cleaning the build only
+copies them back instead of executing the example again.
+
+The inputs of an example are its file, the local modules it imports and its
+location in the documentation, which together give its *source key*. The
+data files read by the example are only known once it ran: they are listed
+per source key, and their content completes the source key into the full
+key of the outputs.
+
+The store is bounded in size: every access to an entry is appended to a
+small log, replayed into a compact index of the last access time and size
+of the entries when the store is cleaned up. The least recently used
+entries are evicted first, without walking the entries on disk.
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+
+from . import __version__
+from .hashing import hash_file
+from .locking import FileLock, atomic_path, atomic_write
+
+META_FNAME = 'meta.json'
+INDEX_FNAME = 'index.json'
+ACCESS_LOG_FNAME = 'access.log'
+
+
+def get_default_store_dir():
+    """Default location of the store, in the user cache directory"""
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'sphinx_galleria')
+
+
+def get_artifact_store(gallery_conf):
+    """Return the artifact store configured, None if it is disabled
+
+    A remote cache needs the store, the default one is used if none is
+    configured.
+    """
+    store_dir = gallery_conf.get('artifact_store')
+    if not store_dir and gallery_conf.get('remote_cache'):
+        store_dir = True
+    if not store_dir:
+        return None
+    if store_dir is True:
+        store_dir = get_default_store_dir()
+    return ArtifactStore(os.path.expanduser(store_dir))
+
+
+def _md5_update_file(md5, fname):
+    # Always the default algorithm, keys are shared between machines
+    file_hash = hash_file(os.path.abspath(fname))
+    md5.update(b'missing' if file_hash is None else file_hash.encode('utf-8'))
+
+
+def example_output_files(target_dir, fname):
+    """Files generated by an example, relative to its gallery directory"""
+    base = os.path.splitext(fname)[0]
+    names = [base + '.rst', base + '.ipynb', base + '_codeobj.pickle',
+             'images/thumb/sphx_glr_%s_thumb.png' % base]
+    image_dir = os.path.join(target_dir, 'images')
+    if os.path.isdir(image_dir):
+        pattern = re.compile(r'sphx_glr_%s_\d+\.png$' % re.escape(base))
+        names.extend('images/' + image for image in
+                     sorted(os.listdir(image_dir)) if pattern.match(image))
+    return [name for name in names
+            if os.path.isfile(os.path.join(target_dir, *name.split('/')))]
+
+
+def _is_pickle(name):
+    """Whether a file of an entry is pickled"""
+    return name.endswith('.pickle')
+
+
+def _entry_size(entry_dir):
+    """Size in bytes of the files of an entry"""
+    size = 0
+    for root, _, fnames in os.walk(entry_dir):
+        for fname in fnames:
+            size += os.path.getsize(os.path.join(root, fname))
+    return size
+
+
+class ArtifactStore(object):
+    """Outputs of executed examples, addressed by the hash of their inputs
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the store. Each entry is a sub-directory named after
+        the full key of the example, with a ``meta.json`` file describing it.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    @staticmethod
+    def source_key(example_md5, ref_fname):
+        """Hash the inputs of an example known before it runs
+
+        Parameters
+        ----------
+        example_md5 : str
+            Checksum of the example and of the local modules it imports.
+        ref_fname : str
+            Path of the example in the documentation, which is part of the
+            references and image paths of its rst.
+        """
+        md5 = hashlib.md5()
+        for value in (__version__, example_md5, ref_fname):
+            md5.update(value.encode('utf-8'))
+            md5.update(b'\0')
+        return md5.hexdigest()
+
+    @staticmethod
+    def full_key(source_key, data_files):
+        """Complete a source key with the content of the data files read"""
+        md5 = hashlib.md5(source_key.encode('utf-8'))
+        for fname in sorted(data_files):
+            md5.update(os.path.basename(fname).encode('utf-8'))
+            _md5_update_file(md5, fname)
+        return md5.hexdigest()
+
+    def _data_files_fname(self, source_key):
+        return os.path.join(self.store_dir, 'sources', source_key + '.json')
+
+    def read_source(self, source_key):
+        """Names of the data files read by an example, None if unknown"""
+        try:
+            with codecs.open(self._data_files_fname(source_key), 'r',
+                             encoding='utf-8') as fid:
+                return json.load(fid)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_source(self, source_key, names):
+        """Record the names of the data files read by an example"""
+        sources_dir = os.path.dirname(self._data_files_fname(source_key))
+        if not os.path.isdir(sources_dir):
+            os.makedirs(sources_dir)
+        with atomic_write(self._data_files_fname(source_key),
+                          encoding='utf-8') as fid:
+            json.dump(names, fid)
+
+    def lock(self, source_key):
+        """Lock held while the outputs of an example are computed
+
+        Another build needing the same outputs waits for them instead of
+        executing the example too.
+        """
+        return FileLock(self._lock_fname(source_key))
+
+    def _lock_fname(self, source_key):
+        return os.path.join(self.store_dir, 'locks', source_key + '.lock')
+
+    def has(self, key):
+        """Whether the outputs of a full key are in the store"""
+        return os.path.isfile(os.path.join(self.store_dir, key, META_FNAME))
+
+    def lookup(self, source_key, base_dir):
+        """Find the full key of the stored outputs of an example
+
+        Parameters
+        ----------
+        source_key : str
+            Key of the inputs of the example, see ``source_key``.
+        base_dir : str
+            Directory the data files of the example are relative to.
+
+        Returns
+        -------
+        key : str or None
+            Full key of the outputs, None if they are not in the store.
+        """
+        names = self.read_source(source_key)
+        if names is None:
+            return None
+        data_files = [os.path.normpath(os.path.join(base_dir, name))
+                      for name in names]
+        key = self.full_key(source_key, data_files)
+        return key if self.has(key) else None
+
+    def get(self, key, target_dir):
+        """Copy the stored outputs of an example to its gallery directory
+
+        Returns
+        -------
+        meta : dict or None
+            The metadata stored with the outputs, None if the entry is
+            missing or incomplete.
+        """
+        entry_dir = os.path.join(self.store_dir, key)
+        try:
+            with codecs.open(os.path.join(entry_dir, META_FNAME), 'r',
+                             encoding='utf-8') as fid:
+                meta = json.load(fid)
+        except (IOError, OSError, ValueError):
+            return None
+        if not all(os.path.isfile(os.path.join(entry_dir, *name.split('/')))
+                   for name in meta['files']):
+            return None
+        try:
+            for name in meta['files']:
+                dst = os.path.join(target_dir, *name.split('/'))
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                with atomic_path(dst) as tmp_fname:
+                    shutil.copyfile(os.path.join(entry_dir, *name.split('/')),
+                                    tmp_fname)
+        except (IOError, OSError):
+            # Evicted by another build while copying
+            return None
+        self._log_access(key)
+        return meta
+
+    def put(self, source_key, base_dir, data_files, target_dir, files, meta):
+        """Store the outputs of an example
+
+        Parameters
+        ----------
+        source_key : str
+            Key of the inputs of the example, see ``source_key``.
+        base_dir : str
+            Directory the data files of the example are relative to.
+        data_files : list of str
+            Absolute paths of the data files read by the example.
+        target_dir : str
+            The gallery directory of the example.
+        files : list of str
+            The outputs to store, relative to ``target_dir``.
+        meta : dict
+            Information to store with the outputs, e.g. the running time
+            of the example. The ``project`` directory and the path of the
+            ``example`` in it are used by ``prune_missing``.
+
+        Returns
+        -------
+        key : str
+            Full key of the outputs.
+        """
+        key = self.full_key(source_key, data_files)
+        tmp_dir = self._make_tmp_dir()
+        try:
+            for name in files:
+                dst = os.path.join(tmp_dir, *name.split('/'))
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                shutil.copyfile(os.path.join(target_dir, *name.split('/')),
+                                dst)
+            meta = dict(meta, files=list(files), source_key=source_key,
+                        size=_entry_size(tmp_dir))
+            with codecs.open(os.path.join(tmp_dir, META_FNAME), 'w',
+                             encoding='utf-8') as fid:
+                json.dump(meta, fid)
+            self._commit(key, tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._log_access(key, meta)
+
+        self.write_source(source_key, [
+            os.path.relpath(fname, base_dir).replace(os.sep, '/')
+            for fname in data_files])
+        return key
+
+    def _make_tmp_dir(self):
+        # Entries are filled in a temporary directory renamed at the end,
+        # so that other builds never see a partial entry
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        return tempfile.mkdtemp(prefix='.tmp', dir=self.store_dir)
+
+    def _commit(self, key, tmp_dir):
+        if self.has(key):
+            # Stored meanwhile by another build, with the same outputs
+            return
+        entry_dir = os.path.join(self.store_dir, key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Stored meanwhile by another build, with the same outputs
+            pass
+
+    def pack(self, key):
+        """Return the entry of a full key as a zip archive
+
+        Pickled files, i.e. the names used by the example, are left out,
+        see ``unpack``.
+        """
+        entry_dir = os.path.join(self.store_dir, key)
+        with codecs.open(os.path.join(entry_dir, META_FNAME), 'r',
+                         encoding='utf-8') as fid:
+            meta = json.load(fid)
+        meta['files'] = [name for name in meta['files']
+                         if not _is_pickle(name)]
+        data = BytesIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(META_FNAME, json.dumps(meta))
+            for name in meta['files']:
+                archive.write(os.path.join(entry_dir, *name.split('/')),
+                              name)
+        return data.getvalue()
+
+    def unpack(self, key, data):
+        """Add an entry from a zip archive made by ``pack``
+
+        Archives may come from a remote cache that others can write to:
+        their pickled files are dropped, loading them could run arbitrary
+        code. ``scan_used_functions`` finds the names used by the example
+        again from its code.
+        """
+        tmp_dir = self._make_tmp_dir()
+        try:
+            with zipfile.ZipFile(BytesIO(data)) as archive:
+                names = archive.namelist()
+                for name in names:
+                    # Archives may come from a remote cache, stay in the entry
+                    if name.startswith('/') or '..' in name.split('/'):
+                        raise ValueError('Invalid file name in archive: %s'
+                                         % name)
+                if META_FNAME not in names:
+                    raise ValueError('Archive without %s' % META_FNAME)
+                archive.extractall(tmp_dir, [name for name in names
+                                             if not _is_pickle(name)])
+            with codecs.open(os.path.join(tmp_dir, META_FNAME), 'r',
+                             encoding='utf-8') as fid:
+                meta = json.load(fid)
+            meta['files'] = [name for name in meta['files']
+                             if not _is_pickle(name)]
+            meta['size'] = _entry_size(tmp_dir)
+            with codecs.open(os.path.join(tmp_dir, META_FNAME), 'w',
+                             encoding='utf-8') as fid:
+                json.dump(meta, fid)
+            self._commit(key, tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._log_access(key, meta)
+
+    def _log_access(self, key, meta=None):
+        """Append an access to an entry to the log of the store
+
+        The metadata of the entry is logged when it is added. Lines are
+        appended in a single write, so that concurrent builds can log
+        accesses without locking.
+        """
+        record = [key, time.time()]
+        if meta is not None:
+            record += [meta.get('size'), meta.get('source_key'),
+                       meta.get('project'), meta.get('example')]
+        line = json.dumps(record) + '\n'
+        try:
+            fid = os.open(os.path.join(self.store_dir, ACCESS_LOG_FNAME),
+                          os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fid, line.encode('utf-8'))
+            finally:
+                os.close(fid)
+        except (IOError, OSError):
+            # The log only orders evictions, never fail the build for it
+            pass
+
+    def _build_index(self):
+        """Index the entries on disk, for stores without an index yet"""
+        index = {}
+        if not os.path.isdir(self.store_dir):
+            return index
+        for key in os.listdir(self.store_dir):
+            meta_fname = os.path.join(self.store_dir, key, META_FNAME)
+            try:
+                with codecs.open(meta_fname, 'r', encoding='utf-8') as fid:
+                    meta = json.load(fid)
+                atime = os.path.getmtime(meta_fname)
+            except (IOError, OSError, ValueError):
+                continue
+            size = meta.get('size')
+            if size is None:
+                size = _entry_size(os.path.join(self.store_dir, key))
+            index[key] = [atime, size, meta.get('source_key'),
+                          meta.get('project'), meta.get('example')]
+        return index
+
+    def load_index(self):
+        """Return the index of the store, with the logged accesses applied
+
+        The access log is merged into the index, which is written back.
+
+        Returns
+        -------
+        index : dict
+            ``[atime, size, source_key, project, example]`` by full key.
+        """
+        index_fname = os.path.join(self.store_dir, INDEX_FNAME)
+        try:
+            with codecs.open(index_fname, 'r', encoding='utf-8') as fid:
+                index = json.load(fid)
+        except (IOError, OSError, ValueError):
+            index = self._build_index()
+
+        # Take the log away first, accesses logged meanwhile go to a new one
+        log_fname = os.path.join(self.store_dir, ACCESS_LOG_FNAME)
+        replay_fname = '%s.%d' % (log_fname, os.getpid())
+        try:
+            os.rename(log_fname, replay_fname)
+        except OSError:
+            lines = []
+        else:
+            with codecs.open(replay_fname, 'r', encoding='utf-8') as fid:
+                lines = fid.readlines()
+            os.remove(replay_fname)
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Truncated line, e.g. from an interrupted build
+                continue
+            key, atime = record[:2]
+            if len(record) > 2:
+                index[key] = [atime] + record[2:]
+            elif key in index:
+                index[key][0] = max(index[key][0], atime)
+        for key in list(index):
+            if index[key][1] is None or \
+                    not os.path.isdir(os.path.join(self.store_dir, key)):
+                # Removed by hand
+                del index[key]
+        self._write_index(index)
+        return index
+
+    def _write_index(self, index):
+        if not os.path.isdir(self.store_dir):
+            return
+        with atomic_write(os.path.join(self.store_dir, INDEX_FNAME)) as fid:
+            json.dump(index, fid)
+
+    def _remove(self, keys, index):
+        """Remove entries, and the data files lists no entry uses anymore"""
+        source_keys = set(index[key][2] for key in keys)
+        for key in keys:
+            shutil.rmtree(os.path.join(self.store_dir, key),
+                          ignore_errors=True)
+            del index[key]
+        source_keys -= set(value[2] for value in index.values())
+        for source_key in source_keys:
+            if source_key is None:
+                continue
+            # The lock files are kept, removing one would let two builds
+            # lock the same example with different files
+            fname = self._data_files_fname(source_key)
+            if os.path.isfile(fname):
+                os.remove(fname)
+        self._write_index(index)
+
+    def evict(self, max_bytes):
+        """Remove the least recently used entries above a size budget
+
+        Parameters
+        ----------
+        max_bytes : int
+            Size of the store not to exceed.
+
+        Returns
+        -------
+        keys : list of str
+            Full keys of the evicted entries.
+        """
+        index = self.load_index()
+        total = sum(value[1] for value in index.values())
+        evicted = []
+        for key in sorted(index, key=lambda key: index[key][0]):
+            if total <= max_bytes:
+                break
+            total -= index[key][1]
+            evicted.append(key)
+        if evicted:
+            self._remove(evicted, index)
+        return evicted
+
+    def prune_missing(self, project_dir):
+        """Remove the entries of the examples deleted from a project
+
+        Parameters
+        ----------
+        project_dir : str
+            The Sphinx source directory of the project, the examples of
+            the entries are relative to it.
+
+        Returns
+        -------
+        keys : list of str
+            Full keys of the removed entries.
+        """
+        project_dir = os.path.abspath(project_dir)
+        index = self.load_index()
+        pruned = [key for key, value in index.items()
+                  if value[3] == project_dir and value[4] is not None and
+                  not os.path.isfile(os.path.join(project_dir,
+                                                  *value[4].split('/')))]
+        if pruned:
+            self._remove(pruned, index)
+        return pruned
@@ -27,6 +27,7 @@ except ImportError:
 
     escape = partial(escape, entities={'"': '&quot;'})
 
+from .locking import atomic_write
 from .py_source_parser import parse_source_file
 
 
@@ -130,13 +131,27 @@ def identify_names(filename):
     return example_code_obj
 
 
-def scan_used_functions(example_file, gallery_conf):
-    """save variables so we can later add links to the documentation"""
+def save_codeobj(example_file):
+    """Identify the names used in an example and save them to a pickle"""
     example_code_obj = identify_names(example_file)
     if example_code_obj:
         codeobj_fname = example_file[:-3] + '_codeobj.pickle'
-        with open(codeobj_fname, 'wb') as fid:
+        with atomic_write(codeobj_fname, 'wb') as fid:
             pickle.dump(example_code_obj, fid, pickle.HIGHEST_PROTOCOL)
+    return example_code_obj
+
+
+def scan_used_functions(example_file, gallery_conf):
+    """save variables so we can later add links to the documentation"""
+    # Reuse the names saved after the example was copied, e.g. restored
+    # from the artifact store
+    codeobj_fname = example_file[:-3] + '_codeobj.pickle'
+    if os.path.exists(codeobj_fname) and \
+            os.path.getmtime(codeobj_fname) >= os.path.getmtime(example_file):
+        with open(codeobj_fname, 'rb') as fid:
+            example_code_obj = pickle.load(fid)
+    else:
+        example_code_obj = save_codeobj(example_file)
 
     backrefs = set('{module_short}.{name}'.format(**entry)
                    for entry in example_code_obj.values()
@@ -184,26 +199,35 @@ def _thumbnail_div(full_dir, fname, snippet, is_backref=False):
 
 
 def write_backreferences(seen_backrefs, gallery_conf,
-                         target_dir, fname, snippet):
+                         target_dir, fname, snippet, backrefs=None):
     """Writes down back reference files, which include a thumbnail list
-    of examples using a certain module"""
+    of examples using a certain module
+
+    The names used by the example are scanned unless given in ``backrefs``.
+    Returns the names used, None if backreferences are disabled.
+    """
     if gallery_conf['backreferences_dir'] is None:
         return
 
     example_file = os.path.join(target_dir, fname)
     build_target_dir = os.path.relpath(target_dir, gallery_conf['src_dir'])
-    backrefs = scan_used_functions(example_file, gallery_conf)
-    for backref in backrefs:
+    if backrefs is None:
+        backrefs = scan_used_functions(example_file, gallery_conf)
+    for backref in sorted(backrefs):
         include_path = os.path.join(gallery_conf['src_dir'],
                                     gallery_conf['backreferences_dir'],
                                     '%s.examples' % backref)
-        seen = backref in seen_backrefs
-        with codecs.open(include_path, 'a' if seen else 'w',
-                         encoding='utf-8') as ex_file:
-            if not seen:
-                heading = '\n\nExamples using ``%s``' % backref
-                ex_file.write(heading + '\n')
-                ex_file.write('^' * len(heading) + '\n')
-            ex_file.write(_thumbnail_div(build_target_dir, fname, snippet,
-                                         is_backref=True))
-            seen_backrefs.add(backref)
+        if backref in seen_backrefs:
+            with codecs.open(include_path, 'r', encoding='utf-8') as ex_file:
+                content = ex_file.read()
+        else:
+            heading = '\n\nExamples using ``%s``' % backref
+            content = heading + '\n' + '^' * len(heading) + '\n'
+        content += _thumbnail_div(build_target_dir, fname, snippet,
+                                  is_backref=True)
+        # Rewritten rather than appended to, so that another build reading
+        # it never sees a partial file
+        with atomic_write(include_path, encoding='utf-8') as ex_file:
+            ex_file.write(content)
+        seen_backrefs.add(backref)
+    return backrefs
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Block-level execution cache
+===========================
+
+Snapshots taken after each code block of an example, so that a rebuild can
+resume execution from the first code block that changed.
+
+Each snapshot is keyed by the cumulative hash of the code blocks up to and
+including its block. It holds the rst output of the block and, when it can
+be pickled, the namespace of the example after the block ran.
+
+The code is hashed through its AST, so that editing comments or text blocks
+keeps the snapshots: the rst of the example is then assembled again around
+the outputs of the snapshots, without running any code.
+"""
+
+from __future__ import division, absolute_import, print_function
+import ast
+import hashlib
+import importlib
+import os
+import re
+import shutil
+import types
+
+# Try Python 2 first, otherwise load from Python 3
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .locking import atomic_write
+
+BLOCK_CACHE_DIR = 'sphx_glr_block_cache'
+# Figures in the rst output of a code block
+_IMAGE_PATTERN = re.compile(r'\.\. image:: /(\S+)')
+
+
+def normalize_code(code):
+    """Dump the AST of code, which ignores comments and formatting
+
+    Code that does not parse is returned as is.
+    """
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return code
+
+
+def cumulative_hashes(code_blocks, seed=''):
+    """Hash of every code block together with all the blocks preceding it
+
+    Parameters
+    ----------
+    code_blocks : list of str
+        The code blocks of an example.
+    seed : str
+        Hashed before the first block, e.g. the checksum of the files the
+        example depends on.
+    """
+    hashes = []
+    md5 = hashlib.md5(seed.encode('utf-8'))
+    for code in code_blocks:
+        md5.update(normalize_code(code).encode('utf-8'))
+        hashes.append(md5.hexdigest())
+        # Separate blocks, so that moving lines across blocks changes hashes
+        md5.update(b'\0')
+    return hashes
+
+
+def dump_namespace(namespace):
+    """Pickle the variables of an example namespace
+
+    Modules are stored by name and imported again on load. Returns None if
+    any other variable cannot be pickled, e.g. functions or classes defined
+    in the example itself.
+    """
+    modules = {}
+    variables = {}
+    for name, value in namespace.items():
+        if name.startswith('__') and name.endswith('__'):
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+        else:
+            variables[name] = value
+    try:
+        return pickle.dumps((modules, variables), pickle.HIGHEST_PROTOCOL)
+    except Exception:  # objects can fail to pickle in many ways
+        return None
+
+
+def load_namespace(data):
+    """Restore the variables pickled by dump_namespace"""
+    modules, variables = pickle.loads(data)
+    for name, module_name in modules.items():
+        variables[name] = importlib.import_module(module_name)
+    return variables
+
+
+class BlockCache(object):
+    """Snapshots of the code blocks of one example
+
+    Parameters
+    ----------
+    target_dir : str
+        The gallery directory of the example.
+    fname : str
+        File name of the example.
+    src_dir : str
+        Absolute path of the Sphinx documentation sources, that image paths
+        in the rst outputs are relative to.
+    """
+
+    def __init__(self, target_dir, fname, src_dir):
+        self.cache_dir = os.path.join(target_dir, BLOCK_CACHE_DIR,
+                                      os.path.splitext(fname)[0])
+        self.src_dir = src_dir
+
+    def _path(self, block_hash, kind):
+        return os.path.join(self.cache_dir,
+                            '{0}.{1}.pickle'.format(block_hash, kind))
+
+    def _images_exist(self, code_output):
+        images = _IMAGE_PATTERN.findall(code_output)
+        return all(os.path.exists(os.path.join(self.src_dir, image))
+                   for image in images)
+
+    def restore(self, hashes, resume=True, draft=False):
+        """Find the deepest snapshot to resume the example from
+
+        Parameters
+        ----------
+        hashes : list of str
+            Cumulative hashes of the code blocks of the example.
+        resume : bool
+            Whether execution can resume after any block. Otherwise the
+            snapshots are only used when no block changed.
+        draft : bool
+            Whether this is a draft build. Otherwise the snapshots whose
+            figures were saved by a draft build, at a low resolution, are
+            not used.
+
+        Returns
+        -------
+        outputs : list of dict
+            Outputs of the code blocks that do not need to run again, each
+            with the ``code_output``, ``time`` and ``fig_count`` after the
+            block, the ``compiler_flags`` of the example and whether it ran
+            in a ``draft`` build.
+        namespace : dict or None
+            Example variables after the last of these blocks, None if there
+            is nothing to resume from.
+        """
+        outputs = []
+        for block_hash in hashes:
+            try:
+                with open(self._path(block_hash, 'out'), 'rb') as fid:
+                    output = pickle.load(fid)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                break
+            if not self._images_exist(output['code_output']):
+                break
+            if output.get('draft') and not draft and \
+                    _IMAGE_PATTERN.search(output['code_output']):
+                break
+            outputs.append(output)
+        if not resume and len(outputs) < len(hashes):
+            return [], None
+
+        # Resume after the deepest block whose namespace was kept. If all
+        # the blocks are unchanged, there is nothing left to execute.
+        while outputs:
+            if len(outputs) == len(hashes):
+                return outputs, {}
+            ns_path = self._path(hashes[len(outputs) - 1], 'ns')
+            if os.path.exists(ns_path):
+                try:
+                    with open(ns_path, 'rb') as fid:
+                        return outputs, load_namespace(fid.read())
+                except Exception:  # e.g. a module is not importable anymore
+                    pass
+            outputs.pop()
+        return [], None
+
+    def save(self, block_hash, output, namespace=None):
+        """Store the snapshot taken after a code block
+
+        The namespace is not stored if it is None.
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with atomic_write(self._path(block_hash, 'out'), 'wb') as fid:
+            pickle.dump(output, fid, pickle.HIGHEST_PROTOCOL)
+        data = None if namespace is None else dump_namespace(namespace)
+        ns_path = self._path(block_hash, 'ns')
+        if data is not None:
+            with atomic_write(ns_path, 'wb') as fid:
+                fid.write(data)
+        elif os.path.exists(ns_path):
+            os.remove(ns_path)
+
+    def rekey(self, hashes, new_hashes):
+        """Move the snapshots of the given hashes to new hashes
+
+        Used when the data files read by the example, part of the seed of
+        the hashes, are only known once it ran.
+        """
+        for block_hash, new_hash in zip(hashes, new_hashes):
+            if block_hash == new_hash:
+                continue
+            for kind in ('out', 'ns'):
+                path = self._path(block_hash, kind)
+                if os.path.exists(path):
+                    os.rename(path, self._path(new_hash, kind))
+
+    def prune(self, hashes):
+        """Remove the snapshots not belonging to the given hashes"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        keep = set(hashes)
+        for fname in os.listdir(self.cache_dir):
+            if fname.split('.', 1)[0] not in keep:
+                os.remove(os.path.join(self.cache_dir, fname))
+
+    def clear(self):
+        """Remove all the snapshots of the example"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Example dependencies
+====================
+
+Find the local files an example depends on, so that editing them invalidates
+the cached outputs of the example. Imported modules are found statically,
+data files are recorded while the example runs.
+
+The imports found are kept for the process, checked with the modification
+times and sizes of the files and directories they were found in, so that
+the modules of large ``doc_module`` packages are only parsed once.
+"""
+
+from __future__ import division, absolute_import, print_function
+import ast
+import contextlib
+import os
+import sys
+import threading
+
+from .hashing import file_stat
+from .py_source_parser import parse_source_file
+
+# Set of files opened by the running example, None when not recording
+_opened_files = None
+# The thread executing the example, the only one whose files are recorded
+_recording_thread = None
+# Imported names by module file, with the stat of the file
+_module_imports = {}
+# Results of find_local_imports, with the paths and stats they depend on
+_local_imports = {}
+
+
+def _audit_open(event, args):
+    """Audit hook recording the files opened for reading"""
+    if _opened_files is None or event != 'open':
+        return
+    # Hashing and downloads run alongside the example in other threads
+    if threading.current_thread() is not _recording_thread:
+        return
+    path, mode, flags = args
+    if mode is not None:
+        if any(char in mode for char in 'wax+'):
+            return
+    elif flags & (os.O_WRONLY | os.O_RDWR):
+        return
+    if hasattr(os, 'fspath') and not isinstance(path, int):
+        path = os.fspath(path)
+    if isinstance(path, bytes):
+        path = path.decode(sys.getfilesystemencoding())
+    if isinstance(path, str):
+        _opened_files.add(os.path.abspath(path))
+
+
+# Audit hooks can not be removed, install a single one for the session
+if hasattr(sys, 'addaudithook'):
+    sys.addaudithook(_audit_open)
+
+
+@contextlib.contextmanager
+def record_opened_files(opened_files):
+    """Add the files opened for reading in the context to ``opened_files``
+
+    Only the files opened by the calling thread are recorded. Needs Python
+    3.8 or later, nothing is recorded otherwise or when ``opened_files`` is
+    None.
+    """
+    global _opened_files, _recording_thread
+    previous = _opened_files, _recording_thread
+    _opened_files = opened_files
+    _recording_thread = threading.current_thread()
+    try:
+        yield
+    finally:
+        _opened_files, _recording_thread = previous
+
+
+def filter_data_files(opened_files, src_file, gallery_conf):
+    """Select the data files of the project among the files opened
+
+    Only files of the project, i.e. under the common directory of the
+    Sphinx sources and of the example, are kept. Python modules, installed
+    packages and the files generated in gallery directories are ignored.
+
+    Returns
+    -------
+    data_files : list of str
+        Sorted absolute paths of the data files.
+    """
+    src_file = os.path.abspath(src_file)
+    example_dir = os.path.dirname(src_file)
+    project_dir = os.path.dirname(os.path.commonprefix(
+        [os.path.join(os.path.abspath(gallery_conf['src_dir']), ''),
+         os.path.join(example_dir, '')]))
+    if os.path.dirname(project_dir) == project_dir:
+        # Nothing in common but the root of the file system
+        project_dir = example_dir
+    gallery_dirs = gallery_conf.get('gallery_dirs', ())
+    if not isinstance(gallery_dirs, (list, tuple)):
+        gallery_dirs = [gallery_dirs]
+    output_dirs = [os.path.join(os.path.abspath(
+        os.path.join(gallery_conf['src_dir'], gallery_dir)), '')
+        for gallery_dir in gallery_dirs]
+
+    data_files = set()
+    for path in opened_files:
+        if not path.startswith(os.path.join(project_dir, '')) or \
+                path.endswith(('.py', '.pyc', '.pyo')) or \
+                'site-packages' in path or \
+                any(path.startswith(out_dir) for out_dir in output_dirs) or \
+                not os.path.isfile(path):
+            continue
+        data_files.add(path)
+    return sorted(data_files)
+
+
+def data_file_names(src_file, data_files):
+    """Names of data files relative to the directory of an example"""
+    base_dir = os.path.dirname(os.path.abspath(src_file))
+    return [os.path.relpath(path, base_dir).replace(os.sep, '/')
+            for path in data_files]
+
+
+def data_file_paths(src_file, names):
+    """Absolute paths of data files named relative to an example"""
+    base_dir = os.path.dirname(os.path.abspath(src_file))
+    return [os.path.normpath(os.path.join(base_dir, *name.split('/')))
+            for name in names]
+
+
+def _imported_names(node):
+    """Yield the module names imported in an AST with their relative level"""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Import):
+            for alias in child.names:
+                yield alias.name, 0
+        elif isinstance(child, ast.ImportFrom):
+            prefix = child.module + '.' if child.module else ''
+            if child.module:
+                yield child.module, child.level
+            # "from package import module" imports a submodule
+            for alias in child.names:
+                yield prefix + alias.name, child.level
+
+
+def find_module_files(module_name, search_path):
+    """Find the source files of a module without importing it
+
+    Parameters
+    ----------
+    module_name : str
+        Absolute dotted name of the module.
+    search_path : list of str
+        Directories to look for the top level package or module.
+
+    Returns
+    -------
+    files : list of str
+        The ``__init__.py`` of every package along the dotted name and the
+        module file. Empty if the module is not found as a source file.
+    """
+    files = []
+    paths = search_path
+    for part in module_name.split('.'):
+        for path in paths:
+            candidate = os.path.join(path, part)
+            if os.path.isfile(os.path.join(candidate, '__init__.py')):
+                files.append(os.path.join(candidate, '__init__.py'))
+                paths = [candidate]
+                break
+            if os.path.isfile(candidate + '.py'):
+                files.append(candidate + '.py')
+                paths = []
+                break
+        else:
+            break
+    return files
+
+
+def _module_imported_names(filename):
+    """Imported names of a module file, parsed once while it is unchanged"""
+    stat = file_stat(filename)
+    cached = _module_imports.get(filename)
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+    node, _ = parse_source_file(filename)
+    names = [] if node is None else list(_imported_names(node))
+    _module_imports[filename] = (stat, names)
+    return names
+
+
+def find_local_imports(src_file, gallery_conf):
+    """Find the local modules imported by an example, recursively
+
+    Local modules are the modules next to the example, and the modules of
+    the packages listed in ``doc_module``, unless ``impact_analysis`` finds
+    the ones the example uses instead. They are found statically from the
+    AST of the example, nothing is imported.
+
+    Returns
+    -------
+    dependencies : list of str
+        Sorted absolute paths of the local module files.
+    """
+    src_file = os.path.abspath(src_file)
+    doc_packages = _doc_packages(gallery_conf)
+    key = (src_file, tuple(sorted(doc_packages)),
+           tuple(os.path.abspath(path or os.curdir) for path in sys.path)
+           if doc_packages else ())
+    cached = _local_imports.get(key)
+    if cached is not None:
+        watched, stats, dependencies = cached
+        if [file_stat(path) for path in watched] == stats:
+            return list(dependencies)
+    dependencies = _find_local_imports(src_file, doc_packages)
+    # A module created in one of these directories can be imported too
+    watched = sorted(set([src_file] + dependencies).union(
+        os.path.dirname(path) for path in [src_file] + dependencies))
+    _local_imports[key] = (watched, [file_stat(path) for path in watched],
+                           dependencies)
+    return list(dependencies)
+
+
+def _doc_packages(gallery_conf):
+    """Top level packages of ``doc_module`` followed through imports"""
+    if gallery_conf.get('impact_analysis'):
+        return set()
+    doc_module = gallery_conf.get('doc_module', ())
+    if not isinstance(doc_module, (list, tuple)):
+        doc_module = (doc_module,)
+    return set(name.split('.')[0] for name in doc_module)
+
+
+def _find_local_imports(src_file, doc_packages):
+    # The modules next to the example are local, and the ones of doc_module
+    # as found along sys.path
+    dependencies = _follow_imports([src_file], [os.path.dirname(src_file)],
+                                   doc_packages)
+    dependencies.discard(src_file)
+    return sorted(dependencies)
+
+
+def find_package_imports(module_files, packages):
+    """Find the modules of packages imported by modules, recursively
+
+    Only the modules of the top level ``packages``, as found along
+    ``sys.path``, are followed, with the modules they import relatively.
+    Package ``__init__.py`` files are left out, as they usually import the
+    whole package.
+
+    Parameters
+    ----------
+    module_files : list of str
+        Absolute paths of the module files to start from.
+    packages : set of str
+        Names of the top level packages followed.
+
+    Returns
+    -------
+    files : list of str
+        Sorted absolute paths of the modules, ``module_files`` included.
+    """
+    return sorted(_follow_imports(module_files, [], packages,
+                                  with_packages=False))
+
+
+def _follow_imports(files, local_dirs, packages, with_packages=True):
+    """Files imported by files, recursively, and these files
+
+    Absolute imports are looked for in ``local_dirs``, and along
+    ``sys.path`` for the top level packages in ``packages``.
+    """
+    seen = set(files)
+    to_parse = list(files)
+    while to_parse:
+        filename = to_parse.pop()
+        local_dir = os.path.dirname(filename)
+        for name, level in _module_imported_names(filename):
+            if level:
+                # Relative import, from the package of the importing module
+                search_path = [local_dir]
+                for _ in range(level - 1):
+                    search_path = [os.path.dirname(search_path[0])]
+            else:
+                search_path = list(local_dirs)
+                if name.split('.')[0] in packages:
+                    search_path += [path or os.curdir for path in sys.path]
+            for module_file in find_module_files(name, search_path):
+                if not with_packages and \
+                        os.path.basename(module_file) == '__init__.py':
+                    continue
+                module_file = os.path.abspath(module_file)
+                if module_file not in seen:
+                    seen.add(module_file)
+                    to_parse.append(module_file)
+    return seen
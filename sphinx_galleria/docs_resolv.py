@@ -391,9 +391,12 @@ def embed_code_links(app, exception):
     if app.builder.name not in ['html', 'readthedocs']:
         return
 
-    logger.info('embedding documentation hyperlinks...', color='white')
-
     gallery_conf = app.config.sphinx_galleria_conf
+    # Draft builds keep the code as is
+    if gallery_conf.get('draft'):
+        return
+
+    logger.info('embedding documentation hyperlinks...', color='white')
 
     gallery_dirs = gallery_conf['gallery_dirs']
     if not isinstance(gallery_dirs, list):
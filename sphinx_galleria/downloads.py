@@ -27,6 +27,17 @@ CODE_DOWNLOAD = """
 
      :download:`Download Jupyter notebook: {1} <{1}>`\n"""
 
+# Draft builds do not write the notebooks
+CODE_DRAFT_DOWNLOAD = """
+\n.. only :: html
+
+ .. container:: sphx-glr-footer
+    :class: sphx-glr-footer-example
+
+\n  .. container:: sphx-glr-download
+
+     :download:`Download Python source code: {0} <{0}>`\n"""
+
 CODE_ZIP_DOWNLOAD = """
 \n.. only :: html
 
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Configuration and environment fingerprints
+==========================================
+
+Hashes of what, besides the example files, changes the outputs of the
+examples. They are part of the cache keys, grouped by the outputs they
+affect, so that a change only invalidates these outputs:
+
+* the execution of the examples depends on the Python version, on the
+  versions of the packages the examples import and on some configuration
+  keys,
+* the rst of the examples depends on other configuration keys,
+* the thumbnails only depend on their own configuration keys.
+"""
+
+from __future__ import division, absolute_import, print_function
+import hashlib
+import json
+import os
+import sys
+
+from .dependencies import _module_imported_names, find_module_files
+
+# Configuration keys changing the outputs of the code blocks
+EXECUTION_KEYS = ('find_mayavi_figures',)
+# Configuration keys changing the rst of the examples. The resolution of
+# the figures of draft builds is checked with the code block outputs.
+RST_KEYS = ('line_numbers', 'min_reported_time', 'binder', 'doc_module',
+            'backreferences_dir', 'draft')
+# Configuration keys only changing the thumbnails
+THUMBNAIL_KEYS = ('thumbnail_size', 'default_thumb_file')
+
+_package_versions = {}
+_packages_distributions = None
+
+
+def conf_fingerprint(gallery_conf, keys):
+    """Hash the values of some configuration keys"""
+    values = [(key, gallery_conf.get(key)) for key in keys]
+    data = json.dumps(values, sort_keys=True, default=repr)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def find_imported_packages(files):
+    """Top level names of the packages imported by files
+
+    Local modules, next to the first file, are not packages.
+    """
+    local_dir = os.path.dirname(os.path.abspath(files[0]))
+    names = set()
+    for filename in files:
+        for name, level in _module_imported_names(
+                os.path.abspath(filename)):
+            if not level:
+                names.add(name.split('.')[0])
+    return sorted(name for name in names
+                  if not find_module_files(name, [local_dir]))
+
+
+def _get_packages_distributions():
+    """Distributions providing each top level module, listed once"""
+    global _packages_distributions
+    if _packages_distributions is None:
+        try:
+            from importlib import metadata
+        except ImportError:
+            _packages_distributions = {}
+        else:
+            _packages_distributions = getattr(
+                metadata, 'packages_distributions', dict)()
+    return _packages_distributions
+
+
+def _find_version(name):
+    """Version of the distribution providing a top level module"""
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+    if metadata is not None:
+        for dist in _get_packages_distributions().get(name, [name]):
+            try:
+                return metadata.version(dist)
+            except metadata.PackageNotFoundError:
+                pass
+    module = sys.modules.get(name)
+    version = getattr(module, '__version__', None)
+    return version if isinstance(version, str) else None
+
+
+def get_package_versions(names):
+    """Versions of packages by top level module name
+
+    Modules without a known version, such as the modules of the standard
+    library, are left out. Versions are looked up once per process.
+    """
+    versions = {}
+    for name in names:
+        if name not in _package_versions:
+            _package_versions[name] = _find_version(name)
+        if _package_versions[name] is not None:
+            versions[name] = _package_versions[name]
+    return versions
+
+
+def get_version_cache():
+    """Package versions looked up by this process, see warm_version_cache
+
+    The distributions are listed first if they were not yet, so that the
+    worker processes do not list them each.
+    """
+    return dict(_package_versions), _get_packages_distributions()
+
+
+def warm_version_cache(cache):
+    """Reuse the package versions looked up by another process"""
+    global _packages_distributions
+    versions, distributions = cache
+    for name, version in versions.items():
+        _package_versions.setdefault(name, version)
+    if _packages_distributions is None:
+        _packages_distributions = distributions
+
+
+def execution_fingerprint(package_versions, gallery_conf):
+    """Hash the environment and configuration an example runs in"""
+    data = json.dumps([sys.version_info[:2], sorted(package_versions.items()),
+                       conf_fingerprint(gallery_conf, EXECUTION_KEYS)])
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
@@ -11,13 +11,20 @@ when building the documentation.
 
 
 from __future__ import division, print_function, absolute_import
-import codecs
 import copy
 import re
 import os
 
 from . import sphinx_compatibility, glr_path_static, __version__ as _sg_version
-from .gen_rst import generate_dir_rst, SPHX_GLR_SIG
+# generate_dir_rst is re-exported, it used to be imported from here
+from .gen_rst import (generate_dir_rst, prepare_dir_rst, run_examples,  # noqa
+                      finish_dir_rst, SPHX_GLR_SIG)
+from .parallel import ExampleTask, parse_memory_limit
+from .artifact_store import get_artifact_store
+from .locking import atomic_write
+from .sharding import (get_shard, run_shard, export_shard, get_merge_dirs,
+                       run_merged)
+from .impact import save_impact
 from .docs_resolv import embed_code_links
 from .downloads import generate_zipfiles
 from .sorting import NumberOfCodeLinesSortKey
@@ -47,8 +54,28 @@ DEFAULT_GALLERY_CONF = {
     'plot_gallery': 'True',
     'download_all_examples': True,
     'abort_on_example_error': False,
+    'parallel': False,
+    'preload_modules': (),
+    'example_timeout': None,
+    'example_memory_limit': None,
+    'block_cache': False,
+    'artifact_store': None,
+    'remote_cache': None,
+    'artifact_store_size': '5G',
+    'hash_algorithm': 'blake2b',
+    'shard': None,
+    'shard_dir': None,
+    'shard_merge': None,
+    'work_queue': None,
+    'work_queue_lease': 3600,
+    'execution_budget_seconds': None,
+    'changed_since': None,
+    'impact_analysis': False,
+    'draft': False,
     'failing_examples': {},
     'expected_failing_examples': set(),
+    'over_budget_examples': {},
+    'skipped_examples': {},
     'thumbnail_size': (400, 280),  # Default CSS does 0.4 scaling (160, 112)
     'min_reported_time': 0,
     'binder': {},
@@ -89,9 +116,14 @@ def parse_config(app):
     except TypeError:
         plot_gallery = bool(app.builder.config.plot_gallery)
 
+    try:
+        draft = eval(app.builder.config.draft)
+    except TypeError:
+        draft = bool(app.builder.config.draft)
+
     gallery_conf = copy.deepcopy(DEFAULT_GALLERY_CONF)
     gallery_conf.update(app.config.sphinx_galleria_conf)
-    gallery_conf.update(plot_gallery=plot_gallery)
+    gallery_conf.update(plot_gallery=plot_gallery, draft=bool(draft))
     gallery_conf.update(
         abort_on_example_error=app.builder.config.abort_on_example_error)
     gallery_conf['src_dir'] = app.builder.srcdir
@@ -192,6 +224,10 @@ def generate_gallery_rst(app):
     files = collect_gallery_files(examples_dirs)
     check_duplicate_filenames(files)
 
+    # Discover the examples of every gallery and subsection up front, so
+    # that they are all executed from a single queue
+    galleries = []
+    tasks = []
     for examples_dir, gallery_dir in workdirs:
 
         examples_dir = os.path.join(app.builder.srcdir, examples_dir)
@@ -205,41 +241,98 @@ def generate_gallery_rst(app):
 
         # Here we don't use an os.walk, but we recurse only twice: flat is
         # better than nested.
-
-        this_fhindex, this_computation_times = generate_dir_rst(
-            examples_dir, gallery_dir, gallery_conf, seen_backrefs)
-
-        computation_times += this_computation_times
-
+        sections = [(examples_dir, gallery_dir)]
+        for subsection in get_subsections(app.builder.srcdir, examples_dir,
+                                          gallery_conf['subsection_order']):
+            sections.append((os.path.join(examples_dir, subsection),
+                             os.path.join(gallery_dir, subsection)))
+
+        gallery_sections = []
+        for src_dir, target_dir in sections:
+            header, sorted_listdir = prepare_dir_rst(src_dir, target_dir,
+                                                     gallery_conf)
+            task_slice = slice(len(tasks), len(tasks) + len(sorted_listdir))
+            tasks.extend(ExampleTask(fname, target_dir, src_dir)
+                         for fname in sorted_listdir)
+            gallery_sections.append((header, target_dir, sorted_listdir,
+                                     task_slice))
+        galleries.append((gallery_dir, gallery_sections))
+
+    # The manifests of the gallery directories are loaded once and saved
+    # at the end of the build
+    manifests = {}
+    shard = get_shard(gallery_conf)
+    merge_dirs = get_merge_dirs(gallery_conf)
+    if shard is not None and merge_dirs:
+        raise ValueError('A build cannot both run a shard and merge shards, '
+                         'set only one of shard and shard_merge')
+    if shard is not None:
+        results, shard_tasks = run_shard(
+            tasks, shard, gallery_conf, 'generating gallery... ', manifests)
+    elif merge_dirs:
+        results = run_merged(tasks, merge_dirs, gallery_conf,
+                             'generating gallery... ', manifests)
+    else:
+        results = run_examples(tasks, gallery_conf, 'generating gallery... ',
+                               manifests)
+
+    # Render the gallery indexes once all the results are in
+    for gallery_dir, gallery_sections in galleries:
         # we create an index.rst with all examples
-        with codecs.open(os.path.join(gallery_dir, 'index.rst'), 'w',
-                         encoding='utf-8') as fhindex:
+        with atomic_write(os.path.join(gallery_dir, 'index.rst'),
+                          encoding='utf-8') as fhindex:
             # :orphan: to suppress "not included in TOCTREE" sphinx warnings
-            fhindex.write(":orphan:\n\n" + this_fhindex)
+            fhindex.write(":orphan:\n\n")
 
-            for subsection in get_subsections(app.builder.srcdir, examples_dir, gallery_conf['subsection_order']):
-                src_dir = os.path.join(examples_dir, subsection)
-                target_dir = os.path.join(gallery_dir, subsection)
-                this_fhindex, this_computation_times = generate_dir_rst(src_dir, target_dir, gallery_conf,
-                                                                        seen_backrefs)
+            for header, target_dir, sorted_listdir, task_slice in \
+                    gallery_sections:
+                this_fhindex, this_computation_times = finish_dir_rst(
+                    header, target_dir, sorted_listdir, results[task_slice],
+                    gallery_conf, seen_backrefs, manifests)
                 fhindex.write(this_fhindex)
                 computation_times += this_computation_times
 
-            if gallery_conf['download_all_examples']:
+            # Draft builds have no notebooks to zip
+            if gallery_conf['download_all_examples'] and \
+                    not gallery_conf['draft']:
                 download_fhindex = generate_zipfiles(gallery_dir)
                 fhindex.write(download_fhindex)
 
             fhindex.write(SPHX_GLR_SIG)
 
     if gallery_conf['plot_gallery']:
+        for manifest in manifests.values():
+            manifest.save()
+        if gallery_conf['impact_analysis']:
+            save_impact(tasks, manifests, gallery_conf['src_dir'])
         logger.info("computation time summary:", color='white')
+        over_budget = dict(
+            (os.path.basename(src_file), reason) for src_file, reason
+            in gallery_conf['over_budget_examples'].items())
         for time_elapsed, fname in sorted(computation_times, reverse=True):
-            if time_elapsed is not None:
+            if fname in over_budget:
+                logger.info("\t- %s: not run, over the execution budget "
+                            "(%s)", fname, over_budget[fname])
+            elif time_elapsed is not None:
                 if time_elapsed >= gallery_conf['min_reported_time']:
                     logger.info("\t- %s: %.2g sec", fname, time_elapsed)
             else:
                 logger.info("\t- %s: not run", fname)
 
+    if shard is not None:
+        shard_dir = gallery_conf['shard_dir'] or os.path.join(
+            app.builder.outdir, 'sphx_glr_shard_%d_of_%d' % shard)
+        export_shard(os.path.join(app.builder.srcdir, shard_dir), tasks,
+                     shard_tasks, results, gallery_conf, manifests, shard)
+
+    store = get_artifact_store(gallery_conf)
+    max_bytes = parse_memory_limit(gallery_conf['artifact_store_size'])
+    if store is not None and max_bytes is not None:
+        evicted = store.evict(max_bytes)
+        if evicted:
+            logger.info("evicted %d entries from the artifact store",
+                        len(evicted))
+
     # Copy the requirements files for binder
     binder_conf = check_binder_conf(gallery_conf.get('binder'))
     if len(binder_conf) > 0:
@@ -302,8 +395,11 @@ def sumarize_failing_examples(app, exception):
                              gallery_conf['failing_examples'][fail_example] +
                              '\n')
 
+    # The examples this build did not execute, e.g. those of other shards,
+    # cannot fail
     examples_not_expected_to_pass = expected_failing_examples.difference(
-        failing_examples)
+        failing_examples).difference(gallery_conf['skipped_examples'],
+                                     gallery_conf['over_budget_examples'])
     if examples_not_expected_to_pass:
         fail_msgs.append("Examples expected to fail, but not failling:\n" +
                          "Please remove these examples from\n" +
@@ -358,7 +454,7 @@ def setup(app):
     sphinx_compatibility._app = app
 
     app.add_config_value('sphinx_galleria_conf', DEFAULT_GALLERY_CONF, 'html')
-    for key in ['plot_gallery', 'abort_on_example_error']:
+    for key in ['plot_gallery', 'abort_on_example_error', 'draft']:
         app.add_config_value(key, get_default_config_value(key), 'html')
 
     app.add_stylesheet('gallery.css')
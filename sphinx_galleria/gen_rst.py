@@ -25,6 +25,7 @@ import subprocess
 import sys
 import traceback
 import codeop
+import functools
 from distutils.version import LooseVersion
 
 from .utils import replace_py_ipynb
@@ -78,12 +79,30 @@ import sphinx
 
 from . import glr_path_static
 from . import sphinx_compatibility
-from .backreferences import write_backreferences, _thumbnail_div
-from .downloads import CODE_DOWNLOAD
+from .backreferences import (write_backreferences, save_codeobj,
+                             scan_used_functions, _thumbnail_div)
+from .artifact_store import (ArtifactStore, get_artifact_store,
+                             example_output_files)
+from .remote_cache import get_remote_backend, RemoteSync
+from .fingerprint import (RST_KEYS, THUMBNAIL_KEYS, conf_fingerprint,
+                          execution_fingerprint, find_imported_packages,
+                          get_package_versions)
+from .block_cache import BlockCache, cumulative_hashes
+from .dependencies import (find_local_imports, filter_data_files,
+                           data_file_names, data_file_paths,
+                           record_opened_files)
+from .downloads import CODE_DOWNLOAD, CODE_DRAFT_DOWNLOAD
 from .py_source_parser import split_code_and_text_blocks
 
 from .notebook import jupyter_notebook, save_notebook
 from .binder import check_binder_conf, copy_binder_reqs, gen_binder_rst
+from .locking import atomic_path, atomic_write, path_lock
+from .hashing import file_stat, hash_file
+from .manifest import get_manifest, log_record
+from .parallel import ExampleTask, execute_examples
+from .work_queue import execute_distributed
+from .vcs import get_changed_files, is_changed_example
+from .impact import doc_packages, get_module_files
 
 try:
     basestring
@@ -185,6 +204,9 @@ SPHX_GLR_SIG = """\n
 
     `Gallery generated by Sphinx-Gallery <https://sphinx-gallery.readthedocs.io>`_\n"""
 
+# Resolution of the figures of draft builds
+DRAFT_DPI = 50
+
 
 def codestr2rst(codestr, lang='python', lineno=None):
     """Return reStructuredText code block from code string"""
@@ -235,29 +257,124 @@ def extract_intro_and_title(filename, docstring):
     return intro, title
 
 
-def get_md5sum(src_file):
-    """Returns md5sum of file"""
+def get_example_md5sum(src_file, dependencies=(), fingerprint='',
+                       algorithm=None, known_hashes=None):
+    """Returns the checksum of an example file combined with its dependencies
+
+    Without dependencies nor fingerprint this is the hash of the file
+    itself. Missing dependencies are hashed as such, so that removing a file
+    counts as a change. The fingerprint stands for the configuration and
+    environment of the example, see ``get_example_fingerprints``.
 
-    with open(src_file, 'rb') as src_data:
-        src_content = src_data.read()
+    Files are hashed with ``algorithm``, and files whose modification time
+    and size are recorded in ``known_hashes`` are not read, see
+    ``hashing.hash_file``.
+    """
+    src_hash = hash_file(os.path.abspath(src_file), algorithm, known_hashes)
+    if src_hash is None:
+        raise IOError('No such file: %s' % src_file)
+    if not dependencies and not fingerprint:
+        return src_hash
+
+    combined = hashlib.md5(src_hash.encode('utf-8'))
+    if dependencies:
+        combined.update(get_dependencies_md5sum(
+            os.path.dirname(src_file), dependencies, algorithm,
+            known_hashes).encode('utf-8'))
+    combined.update(fingerprint.encode('utf-8'))
+    return combined.hexdigest()
+
+
+def get_dependencies_md5sum(base_dir, dependencies, algorithm=None,
+                            known_hashes=None):
+    """Returns the checksum of the names and contents of dependency files
+
+    Names are relative to ``base_dir``. See ``get_example_md5sum`` for
+    ``algorithm`` and ``known_hashes``.
+    """
+    combined = hashlib.md5()
+    for dependency in sorted(dependencies):
+        name = os.path.relpath(dependency, base_dir).replace(os.sep, '/')
+        combined.update(name.encode('utf-8'))
+        file_hash = hash_file(os.path.abspath(dependency), algorithm,
+                              known_hashes)
+        combined.update(b'missing' if file_hash is None
+                        else file_hash.encode('utf-8'))
+    return combined.hexdigest()
 
-        src_md5 = hashlib.md5(src_content).hexdigest()
-    return src_md5
 
+def get_example_fingerprints(src_file, dependencies, gallery_conf):
+    """Fingerprints of what changes the outputs of an example besides files
 
-def md5sum_is_current(src_file):
-    """Checks whether src_file has the same md5 hash as the one on disk"""
+    Parameters
+    ----------
+    src_file : str
+        The example file.
+    dependencies : list of str
+        The local modules imported by the example.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery
 
-    src_md5 = get_md5sum(src_file)
+    Returns
+    -------
+    execution : str
+        Hash of the environment and configuration the example runs in,
+        including the versions of the packages it imports.
+    rst : str
+        Hash of the configuration used to write the rst of the example.
+    packages : list of str
+        Names of the packages imported by the example.
+    """
+    packages = find_imported_packages(
+        [src_file] + [fname for fname in dependencies
+                      if fname.endswith('.py')])
+    # With impact analysis, the modules of doc_module used are dependencies
+    packages = [package for package in packages
+                if package not in doc_packages(gallery_conf)]
+    execution = execution_fingerprint(get_package_versions(packages),
+                                      gallery_conf)
+    return execution, conf_fingerprint(gallery_conf, RST_KEYS), packages
 
-    src_md5_file = src_file + '.md5'
-    if os.path.exists(src_md5_file):
-        with open(src_md5_file, 'r') as file_checksum:
-            ref_md5 = file_checksum.read()
 
-        return src_md5 == ref_md5
+def log_example_md5(target_dir, fname, src_file, dependencies, data_files,
+                    fingerprint='', algorithm=None, known_hashes=None):
+    """Record the checksum of an example that built correctly
 
-    return False
+    The checksum and the data files read by the example are logged to the
+    manifest of its gallery directory, to check them in the next builds,
+    with the hashes of the files, see ``get_example_md5sum``.
+    """
+    known_hashes = {} if known_hashes is None else known_hashes
+    md5 = get_example_md5sum(src_file, dependencies + data_files,
+                             fingerprint, algorithm, known_hashes)
+    paths = sorted(path for path in map(os.path.abspath, [src_file] +
+                                        dependencies + data_files)
+                   if path in known_hashes)
+    log_record(target_dir, fname, md5=md5,
+               data_files=data_file_names(src_file, data_files),
+               hashes=dict(zip(data_file_names(src_file, paths),
+                               [known_hashes[path] for path in paths])))
+
+
+def example_md5_is_current(src_file, record, dependencies, fingerprint='',
+                           algorithm=None, known_hashes=None):
+    """Whether an example has the checksum of its manifest record
+
+    The data files recorded for the example are part of the checksum. The
+    files whose modification time and size are the ones recorded are not
+    read. The hashes of the files are added to ``known_hashes``.
+    """
+    if not record.get('md5'):
+        return False
+    data_files = data_file_paths(src_file, record.get('data_files', []))
+    if known_hashes is None:
+        known_hashes = {}
+    recorded = record.get('hashes', {})
+    known_hashes.update(zip(data_file_paths(src_file, list(recorded)),
+                            recorded.values()))
+    return record['md5'] == get_example_md5sum(
+        src_file, dependencies + data_files, fingerprint, algorithm,
+        known_hashes)
 
 
 def save_figures(image_path, fig_count, gallery_conf):
@@ -293,8 +410,12 @@ def save_figures(image_path, fig_count, gallery_conf):
             if to_rgba(fig_attr) != to_rgba(default_attr):
                 kwargs[attr] = fig_attr
 
+        if gallery_conf.get('draft'):
+            kwargs['dpi'] = DRAFT_DPI
+
         current_fig = image_path.format(fig_count + fig_num)
-        fig.savefig(current_fig, **kwargs)
+        with atomic_path(current_fig) as tmp_fname:
+            fig.savefig(tmp_fname, **kwargs)
         figure_list.append(current_fig)
 
     if gallery_conf.get('find_mayavi_figures', False):
@@ -306,9 +427,10 @@ def save_figures(image_path, fig_count, gallery_conf):
 
         for scene, mayavi_fig_num in zip(e.scenes, mayavi_fig_nums):
             current_fig = image_path.format(mayavi_fig_num)
-            mlab.savefig(current_fig, figure=scene)
-            # make sure the image is not too large
-            scale_image(current_fig, current_fig, 850, 999)
+            with atomic_path(current_fig) as tmp_fname:
+                mlab.savefig(tmp_fname, figure=scene)
+                # make sure the image is not too large
+                scale_image(tmp_fname, tmp_fname, 850, 999)
             figure_list.append(current_fig)
         mlab.close(all=True)
 
@@ -389,7 +511,8 @@ def scale_image(in_fname, out_fname, max_width, max_height):
     pos_insert = ((max_width - width_sc) // 2, (max_height - height_sc) // 2)
     thumb.paste(img, pos_insert)
 
-    thumb.save(out_fname)
+    with atomic_path(out_fname) as tmp_fname:
+        thumb.save(tmp_fname)
 
 
 def save_thumbnail(image_path_template, src_file, file_conf, gallery_conf):
@@ -419,20 +542,63 @@ def save_thumbnail(image_path_template, src_file, file_conf, gallery_conf):
         img = gallery_conf.get("default_thumb_file", img)
     else:
         return
-    scale_image(img, thumb_file, *gallery_conf["thumbnail_size"])
+    if gallery_conf.get('draft'):
+        # The browser scales it down
+        with atomic_path(thumb_file) as tmp_fname:
+            shutil.copyfile(img, tmp_fname)
+    else:
+        scale_image(img, thumb_file, *gallery_conf["thumbnail_size"])
 
 
-def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
-    """Generate the gallery reStructuredText for an example directory"""
+def regenerate_thumbnail(fname, target_dir, src_dir, gallery_conf):
+    """Generate the thumbnail of an example again from its figures"""
+    src_file = os.path.normpath(os.path.join(src_dir, fname))
+    file_conf, _ = split_code_and_text_blocks(src_file)
+    image_path_template = _image_path_template(target_dir, fname)
+    thumb_file = os.path.join(
+        os.path.dirname(image_path_template), 'thumb',
+        'sphx_glr_%s_thumb.png' % os.path.splitext(fname)[0])
+    if os.path.exists(thumb_file):
+        os.remove(thumb_file)
+    save_thumbnail(image_path_template, src_file, file_conf, gallery_conf)
+
 
+def _image_path_template(target_dir, fname):
+    """Path of the figures of an example, to format with their number"""
+    base_image_name = os.path.splitext(fname)[0]
+    image_fname = 'sphx_glr_' + base_image_name + '_{0:03}.png'
+    return os.path.join(target_dir, 'images', image_fname)
+
+
+def prepare_dir_rst(src_dir, target_dir, gallery_conf):
+    """Read the header of an example directory and list its examples
+
+    Returns
+    -------
+    fhindex : str
+        The README of the directory, which starts its gallery index.
+    sorted_listdir : list of str
+        File names of the examples, sorted with ``within_subsection_order``.
+    """
     with codecs.open(os.path.join(src_dir, 'README.txt'), 'r',
                      encoding='utf-8') as fid:
         fhindex = fid.read()
     # Add empty lines to avoid bug in issue #165
     fhindex += "\n\n"
 
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
+    # Create the image folders up front, the examples might be generated
+    # concurrently by several workers
+    thumb_dir = os.path.join(target_dir, 'images', 'thumb')
+    if not os.path.exists(thumb_dir):
+        os.makedirs(thumb_dir)
+    return fhindex, list_examples(src_dir, gallery_conf)
+
+
+def list_examples(src_dir, gallery_conf):
+    """File names of the examples of a directory
+
+    The files are sorted with ``within_subsection_order``.
+    """
     # get filenames
     listdir = [fname for fname in os.listdir(src_dir)
                if fname.endswith('.py')]
@@ -442,21 +608,321 @@ def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
                             os.path.normpath(os.path.join(src_dir, fname)))
                is None]
     # sort them
-    sorted_listdir = sorted(
-        listdir, key=gallery_conf['within_subsection_order'](src_dir))
+    return sorted(listdir,
+                  key=gallery_conf['within_subsection_order'](src_dir))
+
+
+def get_source_key(src_file, example_file, dependencies, gallery_conf,
+                   fingerprints=None):
+    """Key of the inputs of an example in the artifact store
+
+    ``fingerprints`` are computed with ``get_example_fingerprints`` unless
+    given.
+    """
+    if fingerprints is None:
+        fingerprints = get_example_fingerprints(src_file, dependencies,
+                                                gallery_conf)
+    # Stored entries hold the thumbnails too
+    fingerprint = (fingerprints[0] + fingerprints[1] +
+                   conf_fingerprint(gallery_conf, THUMBNAIL_KEYS))
+    ref_fname = os.path.relpath(example_file, gallery_conf['src_dir'])
+    return ArtifactStore.source_key(
+        get_example_md5sum(src_file, dependencies, fingerprint,
+                           gallery_conf.get('hash_algorithm')),
+        ref_fname.replace(os.path.sep, '_'))
+
+
+def example_is_unchanged(src_file, example_file, record, gallery_conf):
+    """Whether an example is unchanged since its manifest record
+
+    Only the modification times and sizes of the example and of its
+    dependencies are compared, with the configuration and the versions of
+    the packages it imports. Nothing is read.
+    """
+    if not record.get('stat') or record['stat'] != file_stat(src_file) or \
+            not os.path.exists(os.path.splitext(example_file)[0] + '.rst'):
+        return False
+    base_dir = os.path.dirname(src_file)
+    if not all(file_stat(os.path.join(base_dir, *name.split('/'))) == stat
+               for name, stat in record['dependencies'].items()):
+        return False
+    fingerprint = (execution_fingerprint(
+        get_package_versions(record['packages']), gallery_conf) +
+        conf_fingerprint(gallery_conf, RST_KEYS))
+    return record['fingerprint'] == fingerprint
+
+
+def record_example(src_file, intro, record, gallery_conf):
+    """Manifest record of an example that was just generated
+
+    The record holds what is needed to skip an unchanged example in the
+    next builds, besides the checksum and data files logged by
+    ``generate_file_rst`` and already in ``record``. Examples that failed or
+    were not executed are only given their status.
+    """
+    if src_file in gallery_conf['failing_examples']:
+        return {'stat': None, 'md5': None, 'status': 'failed'}
+    if not record.get('md5'):
+        return {'stat': None, 'status': 'not executed'}
+    base_dir = os.path.dirname(src_file)
+    dependencies = find_local_imports(src_file, gallery_conf)
+    execution, rst, packages = get_example_fingerprints(
+        src_file, dependencies, gallery_conf)
+    dependencies += data_file_paths(src_file, record.get('data_files', []))
+    _, script_blocks = split_code_and_text_blocks(src_file)
+    _, title = extract_intro_and_title(os.path.basename(src_file),
+                                       script_blocks[0][1])
+    return {'stat': file_stat(src_file),
+            'dependencies': dict(
+                (os.path.relpath(path, base_dir).replace(os.sep, '/'),
+                 file_stat(path)) for path in dependencies),
+            'packages': packages, 'fingerprint': execution + rst,
+            'thumbnail': conf_fingerprint(gallery_conf, THUMBNAIL_KEYS),
+            'intro': intro, 'title': title, 'status': 'ok',
+            'executed': time(),
+            # Scanned again when the gallery index is written
+            'backrefs': None}
+
+
+def run_examples(tasks, gallery_conf, summary, manifests=None):
+    """Generate the rst of examples, possibly in parallel
+
+    Examples unchanged since the last build, according to the manifest of
+    their gallery directory, are skipped without reading them. Only their
+    thumbnail is generated again if its configuration changed.
+
+    With ``execution_budget_seconds``, the examples whose file changed are
+    executed first, then the ones executed longest ago, and no example is
+    started once the budget is used up. The examples left keep the outputs
+    of their last build, or get their rst without outputs, and are listed
+    in ``over_budget_examples``.
+
+    Parameters
+    ----------
+    tasks : list of ExampleTask
+        The examples to generate.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery
+    summary : str
+        Message of the progress bar.
+    manifests : dict, optional
+        The manifests by gallery directory, loaded if needed. The records
+        of the examples are updated in them, the caller saves them once the
+        build is done. Without it, the manifests are saved right away.
+
+    Returns
+    -------
+    results : list of tuple
+        The ``(intro, time_elapsed)`` of each task, in the order of tasks.
+    """
+    save = manifests is None
+    if save:
+        manifests = {}
+    if gallery_conf['plot_gallery']:
+        # Listed once, before the examples are sent to workers
+        get_changed_files(gallery_conf)
+    results = [None] * len(tasks)
+    to_run = []
+    stale_thumbnails = []
+    thumbnail_fingerprint = conf_fingerprint(gallery_conf, THUMBNAIL_KEYS)
+    for index, task in enumerate(tasks):
+        manifest = get_manifest(manifests, task.target_dir)
+        record = manifest.get(task.fname)
+        example_file = os.path.join(task.target_dir, task.fname)
+        if example_is_unchanged(task.src_file, example_file, record,
+                                gallery_conf):
+            results[index] = (record['intro'], 0)
+        else:
+            to_run.append(index)
+            # Logged again by generate_file_rst if the example is skipped
+            if gallery_conf['plot_gallery']:
+                manifest.update(task.fname, skipped=None)
+        if record.get('stat') and \
+                record.get('thumbnail') != thumbnail_fingerprint:
+            stale_thumbnails.append(index)
+
+    if gallery_conf.get('execution_budget_seconds') is not None:
+        to_run.sort(key=lambda index: _execution_priority(
+            tasks[index], manifests[tasks[index].target_dir]))
+    run_results = _execute_tasks([tasks[index] for index in to_run],
+                                 gallery_conf, summary, manifests)
+    for manifest in manifests.values():
+        manifest.refresh()
+    for index, result in zip(to_run, run_results):
+        if result is None:
+            # Not started within the execution budget, executed again in
+            # the next build
+            results[index] = _run_over_budget(tasks[index], gallery_conf)
+            continue
+        results[index] = result
+        if not gallery_conf['plot_gallery']:
+            # Examples not executed keep the records of their last run
+            continue
+        task = tasks[index]
+        manifest = manifests[task.target_dir]
+        record = manifest.get(task.fname)
+        if record.get('skipped'):
+            gallery_conf['skipped_examples'][task.src_file] = \
+                record['skipped']
+        manifest.update(task.fname, **record_example(
+            task.src_file, result[0], record, gallery_conf))
+    for index in stale_thumbnails:
+        task = tasks[index]
+        if task.src_file not in gallery_conf['failing_examples']:
+            regenerate_thumbnail(task.fname, task.target_dir, task.src_dir,
+                                 gallery_conf)
+            manifests[task.target_dir].update(
+                task.fname, thumbnail=thumbnail_fingerprint)
+    if save and gallery_conf['plot_gallery']:
+        for manifest in manifests.values():
+            manifest.save()
+    return results
+
+
+def _execution_priority(task, manifest):
+    """Sort key of the examples to execute within a budget
+
+    Examples whose file changed come first, then the ones executed longest
+    ago.
+    """
+    record = manifest.get(task.fname)
+    return (record.get('stat') == file_stat(task.src_file),
+            record.get('executed') or 0)
+
+
+def _run_over_budget(task, gallery_conf):
+    """Generate an example not started within the execution budget
+
+    The outputs of its last build are kept if any, otherwise its rst is
+    written without executing it.
+    """
+    base_name = os.path.splitext(task.fname)[0]
+    if os.path.exists(os.path.join(task.target_dir, base_name + '.rst')):
+        _, script_blocks = split_code_and_text_blocks(task.src_file)
+        intro, _ = extract_intro_and_title(task.fname, script_blocks[0][1])
+        reason = 'stale outputs'
+    else:
+        intro, _ = generate_file_rst(task.fname, task.target_dir,
+                                     task.src_dir,
+                                     dict(gallery_conf, plot_gallery=False))
+        reason = 'placeholder'
+    gallery_conf['over_budget_examples'][task.src_file] = reason
+    return intro, 0
+
+
+def _execute_tasks(tasks, gallery_conf, summary, manifests=None):
+    """Run generate_file_rst on examples, possibly in parallel
+
+    With a remote cache, the outputs of the examples are downloaded in
+    background while the first examples run, and the outputs of the
+    examples executed are uploaded once they finished. With a work queue,
+    the examples are executed by its workers instead. The results of the
+    examples not started within ``execution_budget_seconds`` are None.
+    """
+    if not tasks:
+        return []
+    backend = get_remote_backend(gallery_conf)
+    remote = None
+    fetches = {}
+    # With a work queue, the workers use their own artifact store
+    distributed = bool(gallery_conf.get('work_queue')) and \
+        gallery_conf['plot_gallery']
+    if backend is not None and gallery_conf['plot_gallery'] and \
+            not distributed:
+        remote = RemoteSync(get_artifact_store(gallery_conf), backend)
+        for index, task in enumerate(tasks):
+            if not re.search(gallery_conf['filename_pattern'],
+                             task.src_file):
+                continue
+            # The keys are computed in the background threads too, not
+            # before the first example starts
+            fetches[index] = remote.fetch(
+                functools.partial(_task_source_key, task, gallery_conf),
+                os.path.dirname(task.src_file))
+
+    def before_run(index):
+        # Wait for the outputs of the example being downloaded, if any
+        if index in fetches:
+            fetches[index].wait()
+
+    results = [None] * len(tasks)
+    budget = (gallery_conf.get('execution_budget_seconds')
+              if gallery_conf['plot_gallery'] else None)
+    try:
+        if distributed:
+            executor = execute_distributed(tasks, gallery_conf, manifests,
+                                           budget)
+        else:
+            executor = execute_examples(tasks, gallery_conf,
+                                        generate_file_rst, before_run,
+                                        manifests, budget)
+        iterator = sphinx_compatibility.status_iterator(
+            executor, summary, length=len(tasks))
+        for index, result in iterator:
+            results[index] = result
+            if result is not None and index in fetches:
+                source_key, fetched = fetches[index].get()
+                if source_key is not None and not fetched:
+                    remote.upload(source_key,
+                                  os.path.dirname(tasks[index].src_file))
+    finally:
+        if remote is not None:
+            remote.close()
+    return results
+
+
+def _task_source_key(task, gallery_conf):
+    """Key of the inputs of an example in the artifact store"""
+    dependencies = find_local_imports(task.src_file, gallery_conf)
+    return get_source_key(task.src_file,
+                          os.path.join(task.target_dir, task.fname),
+                          dependencies, gallery_conf)
+
+
+def finish_dir_rst(fhindex, target_dir, sorted_listdir, results,
+                   gallery_conf, seen_backrefs, manifests=None):
+    """Assemble the gallery index of a directory from its example results
+
+    Parameters
+    ----------
+    fhindex : str
+        Header of the index, as returned by ``prepare_dir_rst``.
+    target_dir : str
+        The gallery directory.
+    sorted_listdir : list of str
+        File names of the examples in gallery order.
+    results : list of tuple
+        The ``(intro, time_elapsed)`` of each example of sorted_listdir.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery
+    seen_backrefs : set
+        Back references already written during this build.
+    manifests : dict, optional
+        The manifests by gallery directory, as given to ``run_examples``.
+        Without it, the manifest of the directory is saved right away.
+
+    Returns
+    -------
+    fhindex : str
+        The rst of the gallery index of the directory.
+    computation_times : list of tuple
+        The ``(time_elapsed, fname)`` of each example.
+    """
     entries_text = []
     computation_times = []
     build_target_dir = os.path.relpath(target_dir, gallery_conf['src_dir'])
-    iterator = sphinx_compatibility.status_iterator(
-        sorted_listdir,
-        'generating gallery for %s... ' % build_target_dir,
-        length=len(sorted_listdir))
-    for fname in iterator:
-        intro, time_elapsed = generate_file_rst(
-            fname,
-            target_dir,
-            src_dir,
-            gallery_conf)
+
+    # Keep the running times to schedule the slowest examples first in the
+    # next builds. Examples that were not executed report no time.
+    save = manifests is None
+    manifest = get_manifest(manifests, target_dir)
+    for fname, (_, time_elapsed) in zip(sorted_listdir, results):
+        if time_elapsed:
+            manifest.update(fname, runtime=time_elapsed)
+
+    # Assemble the entries in the sorted order, whatever order the
+    # examples finished in
+    for fname, (intro, time_elapsed) in zip(sorted_listdir, results):
         computation_times.append((time_elapsed, fname))
         this_entry = _thumbnail_div(build_target_dir, fname, intro) + """
 
@@ -467,8 +933,16 @@ def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
         entries_text.append(this_entry)
 
         if gallery_conf['backreferences_dir']:
-            write_backreferences(seen_backrefs, gallery_conf,
-                                 target_dir, fname, intro)
+            # The names used by unchanged examples are kept in the manifest
+            record = manifest.get(fname)
+            backrefs = write_backreferences(
+                seen_backrefs, gallery_conf, target_dir, fname, intro,
+                record.get('backrefs'))
+            if record.get('stat') and record.get('backrefs') is None:
+                manifest.update(fname, backrefs=sorted(backrefs))
+
+    if save and gallery_conf['plot_gallery']:
+        manifest.save()
 
     for entry_text in entries_text:
         fhindex += entry_text
@@ -480,6 +954,25 @@ def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
     return fhindex, computation_times
 
 
+def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
+    """Generate the gallery reStructuredText for an example directory"""
+    fhindex, sorted_listdir = prepare_dir_rst(src_dir, target_dir,
+                                              gallery_conf)
+    build_target_dir = os.path.relpath(target_dir, gallery_conf['src_dir'])
+    tasks = [ExampleTask(fname, target_dir, src_dir)
+             for fname in sorted_listdir]
+    manifests = {}
+    results = run_examples(tasks, gallery_conf,
+                           'generating gallery for %s... ' % build_target_dir,
+                           manifests)
+    fhindex, computation_times = finish_dir_rst(
+        fhindex, target_dir, sorted_listdir, results, gallery_conf,
+        seen_backrefs, manifests)
+    if gallery_conf['plot_gallery']:
+        manifests[target_dir].save()
+    return fhindex, computation_times
+
+
 def handle_exception(exc_info, src_file, block_vars, gallery_conf):
     etype, exc, tb = exc_info
     stack = traceback.extract_tb(tb)
@@ -538,7 +1031,8 @@ def execute_code_block(compiler, src_file, code_block, lineno, example_globals,
         t_start = time()
         # don't use unicode_literals at the top of this file or you get
         # nasty errors here on Py2.7
-        exec(compiler(code_ast, src_file, 'exec'), example_globals)
+        with record_opened_files(block_vars.get('opened_files')):
+            exec(compiler(code_ast, src_file, 'exec'), example_globals)
         time_elapsed = time() - t_start
     except Exception:
         sys.stdout.flush()
@@ -595,41 +1089,127 @@ def clean_modules():
     plt.rcdefaults()
 
 
-def generate_file_rst(fname, target_dir, src_dir, gallery_conf):
+def generate_file_rst(fname, target_dir, src_dir, gallery_conf,
+                      manifests=None):
     """Generate the rst file for a given example.
 
+    The example is built under a lock, so that concurrent builds sharing the
+    gallery directory or the artifact store wait for each other and reuse
+    the outputs instead of executing the example twice.
+
+    The record of the example is read from the manifest in ``manifests``,
+    by gallery directory, loaded once per build. Without it, the manifest
+    is loaded for this example only.
+
     Returns
     -------
     intro: str
         The introduction of the example
     time_elapsed : float
-        seconds required to run the script
+        seconds required to run the script, including the code blocks
+        reused from the block cache
     """
+    locks = [path_lock(os.path.join(target_dir, fname))]
+    locks[0].acquire()
+    try:
+        return _generate_file_rst(fname, target_dir, src_dir, gallery_conf,
+                                  locks, manifests)
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def _generate_file_rst(fname, target_dir, src_dir, gallery_conf, locks,
+                       manifests=None):
+    """Generate the rst file of an example, adding the locks taken"""
     binder_conf = check_binder_conf(gallery_conf.get('binder'))
     src_file = os.path.normpath(os.path.join(src_dir, fname))
     example_file = os.path.join(target_dir, fname)
-    shutil.copyfile(src_file, example_file)
     file_conf, script_blocks = split_code_and_text_blocks(src_file)
     intro, title = extract_intro_and_title(fname, script_blocks[0][1])
 
-    if md5sum_is_current(example_file):
+    # Local modules imported by the example and the data files it read
+    # during its last run invalidate its outputs too
+    dependencies = find_local_imports(src_file, gallery_conf)
+    # The configuration and the environment too, so that e.g. a change of
+    # line_numbers writes the rst again without running the code.
+    # The log is read again, another build may have just generated the
+    # example.
+    manifest = get_manifest(manifests, target_dir)
+    manifest.refresh()
+    record = manifest.get(fname)
+    data_files = data_file_paths(src_file, record.get('data_files', []))
+    fingerprints = get_example_fingerprints(src_file, dependencies,
+                                            gallery_conf)
+    fingerprint = fingerprints[0] + fingerprints[1]
+    # Files with the recorded modification time and size are not hashed
+    algorithm = gallery_conf.get('hash_algorithm')
+    known_hashes = {}
+    is_current = example_md5_is_current(src_file, record, dependencies,
+                                        fingerprint, algorithm, known_hashes)
+    if not is_current or not os.path.exists(example_file):
+        with atomic_path(example_file) as tmp_fname:
+            shutil.copyfile(src_file, tmp_fname)
+    if is_current:
+        log_record(target_dir, fname, md5=record['md5'],
+                   data_files=record['data_files'],
+                   hashes=record.get('hashes', {}))
         return intro, 0
+    if gallery_conf['plot_gallery']:
+        # Logged again once the example executed correctly
+        log_record(target_dir, fname, md5=None)
+
+    ref_fname = os.path.relpath(example_file, gallery_conf['src_dir'])
+    ref_fname = ref_fname.replace(os.path.sep, '_')
+
+    filename_pattern = gallery_conf.get('filename_pattern')
+    execute_script = re.search(filename_pattern, src_file) and gallery_conf[
+        'plot_gallery']
+
+    # Outputs of a previous build with the same inputs, maybe on another
+    # branch or in another checkout
+    store = get_artifact_store(gallery_conf) if execute_script else None
+    if store is not None:
+        source_key = get_source_key(src_file, example_file, dependencies,
+                                    gallery_conf, fingerprints)
+        # Held until the outputs are stored, another build in another
+        # gallery directory may be executing the example
+        locks.append(store.lock(source_key))
+        locks[-1].acquire()
+        key = store.lookup(source_key, os.path.dirname(src_file))
+        meta = store.get(key, target_dir) if key is not None else None
+        if meta is not None:
+            logger.debug('%s: outputs restored from the artifact store',
+                         src_file)
+            log_example_md5(target_dir, fname, src_file, dependencies,
+                            data_file_paths(src_file, meta['data_files']),
+                            fingerprint, algorithm, known_hashes)
+            return intro, 0
+
+    # With changed_since, only the examples changed on the branch are
+    # executed, the others keep the outputs of their last build
+    recorded = [os.path.join(src_dir, *name.split('/'))
+                for name in record.get('dependencies') or {}]
+    if execute_script and not is_changed_example(
+            src_file, dependencies + data_files + recorded, gallery_conf):
+        execute_script = False
+        # Collected by run_examples, the example cannot fail in this build
+        log_record(target_dir, fname,
+                   skipped='unchanged since %s' % gallery_conf['changed_since'])
+        if os.path.exists(os.path.splitext(example_file)[0] + '.rst'):
+            logger.debug('%s: unchanged since %s, outputs kept', src_file,
+                         gallery_conf['changed_since'])
+            return intro, 0
 
     image_dir = os.path.join(target_dir, 'images')
     if not os.path.exists(image_dir):
         os.makedirs(image_dir)
 
     base_image_name = os.path.splitext(fname)[0]
-    image_fname = 'sphx_glr_' + base_image_name + '_{0:03}.png'
-    image_path_template = os.path.join(image_dir, image_fname)
+    image_path_template = _image_path_template(target_dir, fname)
 
-    ref_fname = os.path.relpath(example_file, gallery_conf['src_dir'])
-    ref_fname = ref_fname.replace(os.path.sep, '_')
     example_rst = """\n\n.. _sphx_glr_{0}:\n\n""".format(ref_fname)
 
-    filename_pattern = gallery_conf.get('filename_pattern')
-    execute_script = re.search(filename_pattern, src_file) and gallery_conf[
-        'plot_gallery']
     example_globals = {
         # A lot of examples contains 'print(__doc__)' for example in
         # scikit-learn so that running the example prints some useful
@@ -650,7 +1230,8 @@ def generate_file_rst(fname, target_dir, src_dir, gallery_conf):
     is_example_notebook_like = len(script_blocks) > 2
     time_elapsed = 0
     block_vars = {'execute_script': execute_script, 'fig_count': 0,
-                  'image_path': image_path_template, 'src_file': src_file}
+                  'image_path': image_path_template, 'src_file': src_file,
+                  'opened_files': set()}
 
     argv_orig = sys.argv[:]
     if block_vars['execute_script']:
@@ -660,12 +1241,53 @@ def generate_file_rst(fname, target_dir, src_dir, gallery_conf):
         sys.argv[0] = src_file
         sys.argv[1:] = []
 
+    # Reuse the outputs of the code blocks when only text changed, or with
+    # the block cache resume from the deepest unchanged code block
+    code_blocks = [bcontent for blabel, bcontent, _ in script_blocks
+                   if blabel == 'code']
+    code_hashes = cumulative_hashes(
+        code_blocks,
+        get_dependencies_md5sum(os.path.dirname(src_file),
+                                dependencies + data_files, algorithm,
+                                known_hashes) + fingerprints[0])
+    block_cache = None
+    cached_outputs = []
+    keep_namespace = gallery_conf.get('block_cache')
+    if block_vars['execute_script']:
+        block_cache = BlockCache(target_dir, fname, gallery_conf['src_dir'])
+        cached_outputs, namespace = block_cache.restore(
+            code_hashes, resume=keep_namespace,
+            draft=gallery_conf.get('draft'))
+        if cached_outputs:
+            example_globals.update(namespace)
+            compiler.flags = cached_outputs[-1]['compiler_flags']
+            block_vars['fig_count'] = cached_outputs[-1]['fig_count']
+            logger.debug('%s: reusing the output of %d code block(s)',
+                         src_file, len(cached_outputs))
+            # The blocks not run again read the same files as last time
+            block_vars['opened_files'].update(data_files)
+
+    code_index = 0
+    cached_time = 0
     for blabel, bcontent, lineno in script_blocks:
         if blabel == 'code':
-            code_output, rtime = execute_code_block(compiler, src_file,
-                                                    bcontent, lineno,
-                                                    example_globals,
-                                                    block_vars, gallery_conf)
+            if code_index < len(cached_outputs):
+                code_output = cached_outputs[code_index]['code_output']
+                rtime = 0
+                cached_time += cached_outputs[code_index]['time']
+            else:
+                code_output, rtime = execute_code_block(
+                    compiler, src_file, bcontent, lineno, example_globals,
+                    block_vars, gallery_conf)
+                if block_cache is not None and block_vars['execute_script']:
+                    block_cache.save(
+                        code_hashes[code_index],
+                        {'code_output': code_output, 'time': rtime,
+                         'fig_count': block_vars['fig_count'],
+                         'compiler_flags': compiler.flags,
+                         'draft': bool(gallery_conf.get('draft'))},
+                        example_globals if keep_namespace else None)
+            code_index += 1
 
             time_elapsed += rtime
 
@@ -688,36 +1310,73 @@ def generate_file_rst(fname, target_dir, src_dir, gallery_conf):
 
     sys.argv = argv_orig
     clean_modules()
-
-    # Writes md5 checksum if example has build correctly
-    # not failed and was initially meant to run(no-plot shall not cache md5sum)
     if block_vars['execute_script']:
-        with open(example_file + '.md5', 'w') as file_checksum:
-            file_checksum.write(get_md5sum(example_file))
+        data_files = filter_data_files(block_vars['opened_files'], src_file,
+                                       gallery_conf)
+        if gallery_conf.get('impact_analysis'):
+            # The modules defining the objects of doc_module it uses are
+            # checked like the data files of the example
+            data_files = sorted(set(data_files).union(get_module_files(
+                scan_used_functions(example_file, gallery_conf))))
+    if block_cache is not None:
+        # The snapshots were saved before the data files read in this run
+        # were known, e.g. on its first run, key them with these files so
+        # that the next build of a text-only change finds them
+        run_hashes = cumulative_hashes(
+            code_blocks,
+            get_dependencies_md5sum(os.path.dirname(src_file),
+                                    dependencies + data_files, algorithm,
+                                    known_hashes) + fingerprints[0])
+        block_cache.rekey(code_hashes, run_hashes)
+        block_cache.prune(run_hashes)
 
     save_thumbnail(image_path_template, src_file, file_conf, gallery_conf)
 
-    time_m, time_s = divmod(time_elapsed, 60)
-    example_nb = jupyter_notebook(script_blocks)
-    save_notebook(example_nb, replace_py_ipynb(example_file))
-    with codecs.open(os.path.join(target_dir, base_image_name + '.rst'),
-                     mode='w', encoding='utf-8') as f:
-        if time_elapsed >= gallery_conf["min_reported_time"]:
+    # The running time reported includes the code blocks not run again
+    reported_time = time_elapsed + cached_time
+    time_m, time_s = divmod(reported_time, 60)
+    if not gallery_conf.get('draft'):
+        example_nb = jupyter_notebook(script_blocks)
+        save_notebook(example_nb, replace_py_ipynb(example_file))
+    with atomic_write(os.path.join(target_dir, base_image_name + '.rst'),
+                      encoding='utf-8') as f:
+        if reported_time >= gallery_conf["min_reported_time"]:
             example_rst += ("**Total running time of the script:**"
                             " ({0: .0f} minutes {1: .3f} seconds)\n\n".format(
                                 time_m, time_s))
-        # Generate a binder URL if specified
-        binder_badge_rst = ''
-        if len(binder_conf) > 0:
-            binder_badge_rst += gen_binder_rst(fname, binder_conf)
-
-        example_rst += CODE_DOWNLOAD.format(fname,
-                                            replace_py_ipynb(fname),
-                                            binder_badge_rst)
+        if gallery_conf.get('draft'):
+            # Without the notebook and its binder badge
+            example_rst += CODE_DRAFT_DOWNLOAD.format(fname)
+        else:
+            # Generate a binder URL if specified
+            binder_badge_rst = ''
+            if len(binder_conf) > 0:
+                binder_badge_rst += gen_binder_rst(fname, binder_conf)
+
+            example_rst += CODE_DOWNLOAD.format(fname,
+                                                replace_py_ipynb(fname),
+                                                binder_badge_rst)
         example_rst += SPHX_GLR_SIG
         f.write(example_rst)
 
+    # Log the md5 checksum if the example has built correctly, once its
+    # outputs are written. Examples that failed or were not meant to run
+    # (no-plot shall not cache md5sum) run again in the next build.
     if block_vars['execute_script']:
+        log_example_md5(target_dir, fname, src_file, dependencies,
+                        data_files, fingerprint, algorithm, known_hashes)
         logger.debug("%s ran in : %.2g seconds", src_file, time_elapsed)
-
-    return intro, time_elapsed
+        if store is not None:
+            save_codeobj(example_file)
+            store.put(source_key, os.path.dirname(src_file), data_files,
+                      target_dir, example_output_files(target_dir, fname),
+                      {'time_elapsed': reported_time,
+                       'data_files': data_file_names(src_file, data_files),
+                       'project': os.path.abspath(gallery_conf['src_dir']),
+                       'example': os.path.relpath(
+                           src_file, gallery_conf['src_dir']).replace(
+                               os.sep, '/')})
+
+    # Code blocks reused from the cache count, the running time schedules
+    # the example in the next builds
+    return intro, reported_time
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+File hashes
+===========
+
+Hash the content of the files an example depends on, without reading the
+files that did not change.
+
+A file with the same size and modification time, in nanoseconds, as when it
+was last hashed is considered unchanged and its hash is reused. Other files
+are hashed with BLAKE2, or with xxHash when ``hash_algorithm`` is
+``'xxhash'`` and the ``xxhash`` package is installed.
+"""
+
+from __future__ import division, absolute_import, print_function
+import hashlib
+import os
+import time
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_ALGORITHM = 'blake2b'
+_CHUNK_SIZE = 1 << 20
+# Files modified less than this many nanoseconds before they are hashed may
+# change again within the resolution of their modification time, their
+# hash is not reused
+_RACY_NS = 2 * 10 ** 9
+
+# Hashes computed by this process, [mtime_ns, size, hash] by algorithm and
+# absolute path
+_file_hashes = {}
+
+
+def get_hasher(algorithm=None):
+    """Return a new hash object of an algorithm
+
+    Parameters
+    ----------
+    algorithm : str or None
+        ``'blake2b'``, ``'xxhash'`` or ``'md5'``, None for the default.
+        BLAKE2 needs Python 3.6, MD5 is used on older versions.
+    """
+    algorithm = algorithm or DEFAULT_ALGORITHM
+    if algorithm == 'xxhash':
+        if xxhash is None:
+            raise ValueError("hash_algorithm 'xxhash' needs the xxhash "
+                             "package, install it with pip install xxhash")
+        return getattr(xxhash, 'xxh3_128', xxhash.xxh64)()
+    if algorithm == 'blake2b':
+        if hasattr(hashlib, 'blake2b'):
+            return hashlib.blake2b(digest_size=16)
+        return hashlib.md5()
+    if algorithm == 'md5':
+        return hashlib.md5()
+    raise ValueError("Unknown hash_algorithm %r, use 'blake2b', 'xxhash' "
+                     "or 'md5'" % (algorithm,))
+
+
+def file_stat(path):
+    """Modification time in nanoseconds and size of a file
+
+    Returns None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # Python 2
+        mtime_ns = int(stat.st_mtime * 1e9)
+    return [mtime_ns, stat.st_size]
+
+
+def hash_file(path, algorithm=None, known=None):
+    """Hash the content of a file, unless it did not change
+
+    Parameters
+    ----------
+    path : str
+        Absolute path of the file.
+    algorithm : str or None
+        See ``get_hasher``.
+    known : dict, optional
+        Hashes recorded by previous builds, ``[mtime_ns, size, hash]`` by
+        absolute path. The file is not read if its modification time and
+        size are the recorded ones. The hash computed is added to it.
+
+    Returns
+    -------
+    hash : str or None
+        Hexadecimal hash of the content, None if the file does not exist.
+    """
+    stat = file_stat(path)
+    if stat is None:
+        return None
+    cache = _file_hashes.setdefault(algorithm or DEFAULT_ALGORITHM, {})
+    for recorded in (cache.get(path), (known or {}).get(path)):
+        if recorded and list(recorded[:2]) == stat:
+            if known is not None:
+                known[path] = recorded
+            return recorded[2]
+    hasher = get_hasher(algorithm)
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    if int(time.time() * 1e9) - stat[0] > _RACY_NS:
+        cache[path] = stat + [digest]
+        if known is not None:
+            known[path] = cache[path]
+    return digest
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Impact of library changes
+=========================
+
+Find which examples a change of the documented library affects. With
+``impact_analysis`` enabled, the source files of the modules defining the
+objects of ``doc_module`` used by an example, as found for the back
+references, are recorded with its data files, along with the modules of
+the package they import. Editing one of these modules executes again the
+examples using the objects it defines or its helpers, and only them: the
+modules of ``doc_module`` are no longer followed through the imports of the
+examples, and the versions of its packages are left out of their
+fingerprint. Edits of package ``__init__.py`` files are not tracked.
+
+The mapping is inverted at the end of the build, from each module to the
+examples using it, and saved as ``sphx_glr_impact.json`` in the Sphinx
+source directory.
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import importlib
+import inspect
+import json
+import os
+
+from .dependencies import find_package_imports
+from .locking import atomic_write
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+IMPACT_FNAME = 'sphx_glr_impact.json'
+
+
+def doc_packages(gallery_conf):
+    """Top-level packages of ``doc_module`` tracked by impact analysis"""
+    if not gallery_conf.get('impact_analysis'):
+        return set()
+    doc_module = gallery_conf.get('doc_module') or ()
+    if isinstance(doc_module, basestring):
+        doc_module = (doc_module,)
+    return set(module.split('.')[0] for module in doc_module)
+
+
+def get_module_files(names):
+    """Source files of the modules defining objects
+
+    Parameters
+    ----------
+    names : iterable of str
+        Full names of objects, such as ``'ourlib.linear_model.Ridge'``, as
+        found for the back references.
+
+    Returns
+    -------
+    files : list of str
+        Sorted absolute paths of the Python files defining the objects, and
+        of the modules of their package they import, recursively. Objects
+        that are not classes or functions, such as constants, are
+        attributed to the module they are accessed from. Package
+        ``__init__.py`` files are left out, see ``find_package_imports``.
+    """
+    files = set()
+    packages = set()
+    for name in names:
+        module_name, _, attribute = name.rpartition('.')
+        try:
+            module = importlib.import_module(module_name)
+            obj = getattr(module, attribute)
+        except Exception:
+            # Libraries can raise anything on import
+            continue
+        try:
+            path = inspect.getsourcefile(obj)
+        except TypeError:
+            # Built-in, or an instance
+            path = None
+        if path is None:
+            path = getattr(module, '__file__', None)
+            if path is not None and path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+        if path is not None and path.endswith('.py') and \
+                os.path.isfile(path):
+            files.add(os.path.abspath(path))
+            packages.add(module_name.split('.')[0])
+    return find_package_imports(sorted(files), packages)
+
+
+def invert_dependencies(tasks, manifests, src_dir):
+    """Map the modules recorded for the examples to the examples using them
+
+    Parameters
+    ----------
+    tasks : list of ExampleTask
+        The examples of the galleries.
+    manifests : dict
+        The gallery manifests, by gallery directory.
+    src_dir : str
+        The Sphinx source directory, paths are relative to it.
+
+    Returns
+    -------
+    impact : dict
+        Sorted paths of the example files by path of the modules they
+        depend on, local modules included, ``'/'`` separated and relative
+        to src_dir.
+    """
+    impact = {}
+    for task in tasks:
+        manifest = manifests.get(task.target_dir)
+        record = manifest.get(task.fname) if manifest is not None else None
+        if not record:
+            continue
+        example = os.path.relpath(os.path.join(task.src_dir, task.fname),
+                                  src_dir).replace(os.sep, '/')
+        for name in record.get('dependencies') or {}:
+            if not name.endswith('.py'):
+                continue
+            module = os.path.normpath(os.path.join(task.src_dir,
+                                                   *name.split('/')))
+            module = os.path.relpath(module, src_dir).replace(os.sep, '/')
+            impact.setdefault(module, set()).add(example)
+    return dict((module, sorted(examples))
+                for module, examples in impact.items())
+
+
+def save_impact(tasks, manifests, src_dir):
+    """Write the inverted mapping of the modules to the examples"""
+    with atomic_write(os.path.join(src_dir, IMPACT_FNAME),
+                      encoding='utf-8') as fid:
+        json.dump(invert_dependencies(tasks, manifests, src_dir), fid,
+                  indent=1, sort_keys=True)
+
+
+def affected_examples(src_dir, changed_files):
+    """Examples using the modules changed, from the last build
+
+    Parameters
+    ----------
+    src_dir : str
+        The Sphinx source directory.
+    changed_files : iterable of str
+        Paths of the files changed.
+
+    Returns
+    -------
+    examples : list of str
+        Sorted paths of the example files affected, relative to src_dir.
+    """
+    with codecs.open(os.path.join(src_dir, IMPACT_FNAME), 'r',
+                     encoding='utf-8') as fid:
+        impact = json.load(fid)
+    examples = set()
+    for path in changed_files:
+        module = os.path.relpath(os.path.abspath(path), src_dir)
+        examples.update(impact.get(module.replace(os.sep, '/'), ()))
+    return sorted(examples)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Concurrent builds
+=================
+
+Several builds may share a gallery directory, e.g. html and latex builds of
+the same documentation running at the same time, or an artifact store.
+Files are written under a temporary name and renamed at the end, so that a
+build never reads a partially written file, and examples are executed under
+a lock, so that a build waits for another one executing the same example and
+reuses its outputs.
+
+Locks are held by the operating system on open files: they are released if
+the build holding them is killed. The lock files of the examples are kept in
+the temporary directory, out of the gallery directories.
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def _replace(src, dst):
+    """Rename a file, replacing the destination atomically"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # Python 2, rename only replaces on POSIX
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+@contextlib.contextmanager
+def atomic_path(fname):
+    """Yield a temporary path, renamed to ``fname`` if no error is raised
+
+    The temporary file is in the same directory, so that the rename is
+    atomic, and keeps the extension, for writers guessing the format from it
+    such as ``savefig``.
+    """
+    dirname, basename = os.path.split(fname)
+    tmp_fname = os.path.join(
+        dirname, '.tmp%s-%s' % (uuid.uuid4().hex[:8], basename))
+    try:
+        yield tmp_fname
+        _replace(tmp_fname, fname)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+
+@contextlib.contextmanager
+def atomic_write(fname, mode='w', encoding=None):
+    """Open a file for writing, it replaces ``fname`` once closed"""
+    with atomic_path(fname) as tmp_fname:
+        if encoding is None:
+            fid = open(tmp_fname, mode)
+        else:
+            fid = codecs.open(tmp_fname, mode, encoding=encoding)
+        with fid:
+            yield fid
+
+
+class FileLock(object):
+    """Exclusive lock between processes, on a lock file
+
+    Parameters
+    ----------
+    fname : str
+        The lock file, created if needed and never removed, as removing it
+        would let two processes lock different files of the same name.
+    poll_interval : float
+        Seconds between attempts to take the lock when it is not available.
+    """
+
+    def __init__(self, fname, poll_interval=0.1):
+        self.fname = fname
+        self.poll_interval = poll_interval
+        self._fid = None
+
+    def acquire(self):
+        """Wait for the lock and take it"""
+        dirname = os.path.dirname(self.fname)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Created meanwhile by another build
+                pass
+        fid = os.open(self.fname, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fid, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                while True:
+                    try:
+                        msvcrt.locking(fid, msvcrt.LK_NBLCK, 1)
+                        break
+                    except (IOError, OSError):
+                        time.sleep(self.poll_interval)
+        except BaseException:
+            os.close(fid)
+            raise
+        self._fid = fid
+
+    def release(self):
+        """Release the lock, if it is held"""
+        if self._fid is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fid, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(self._fid, 0, os.SEEK_SET)
+                msvcrt.locking(self._fid, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fid)
+            self._fid = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def path_lock(path):
+    """Lock of a path, with its lock file in the temporary directory
+
+    Builds sharing the path, under any name, get the same lock file.
+    """
+    key = hashlib.md5(os.path.realpath(path).encode('utf-8')).hexdigest()
+    return FileLock(os.path.join(tempfile.gettempdir(),
+                                 'sphinx_galleria_locks', key + '.lock'))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Gallery manifest
+================
+
+Records about the examples of a gallery directory that are kept between
+builds: the checksum of their inputs, the modification time and size of
+their files, how long they took to run and whether they built correctly.
+
+The manifest is a single file per gallery directory, loaded once per build
+and written atomically at its end. Workers generating examples, possibly in
+other builds running concurrently, append their records to a log next to
+it, which is merged into the manifest when it is saved.
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import json
+import os
+
+from .locking import atomic_write
+
+MANIFEST_FNAME = 'sphx_glr_manifest.json'
+LOG_SUFFIX = '.log'
+
+
+def log_record(target_dir, fname, **values):
+    """Append values of the record of an example to the manifest log
+
+    The line is appended in a single write, so that concurrent workers and
+    builds can log records without locking.
+    """
+    line = json.dumps([fname, values]) + '\n'
+    fid = os.open(os.path.join(target_dir, MANIFEST_FNAME + LOG_SUFFIX),
+                  os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fid, line.encode('utf-8'))
+    finally:
+        os.close(fid)
+
+
+def get_manifest(manifests, target_dir):
+    """Return the manifest of a gallery directory, loaded once
+
+    Parameters
+    ----------
+    manifests : dict or None
+        The manifests already loaded by gallery directory, the manifest is
+        added to it. With None the manifest is always loaded.
+    target_dir : str
+        The gallery directory.
+    """
+    if manifests is None:
+        return GalleryManifest(target_dir)
+    if target_dir not in manifests:
+        manifests[target_dir] = GalleryManifest(target_dir)
+    return manifests[target_dir]
+
+
+class GalleryManifest(object):
+    """Records of the examples of one gallery directory
+
+    The manifest is stored as a JSON file in the gallery directory, with one
+    entry per example file name.
+
+    Parameters
+    ----------
+    target_dir : str
+        The gallery directory where the generated example files are written.
+    """
+
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.fname = os.path.join(target_dir, MANIFEST_FNAME)
+        self.entries = {}
+        self.changed = False
+        # Inode and length of the part of the log already applied
+        self._log_position = (None, 0)
+        if os.path.exists(self.fname):
+            try:
+                with codecs.open(self.fname, 'r', encoding='utf-8') as fid:
+                    self.entries = json.load(fid)
+            except ValueError:
+                # Corrupted manifest, start from scratch
+                self.entries = {}
+        self.refresh()
+
+    def get(self, fname):
+        """Return the record of an example, empty if it is unknown"""
+        return self.entries.get(fname, {})
+
+    def update(self, fname, **values):
+        """Update the record of an example with the given values"""
+        record = self.entries.setdefault(fname, {})
+        if any(record.get(key) != value for key, value in values.items()):
+            record.update(values)
+            self.changed = True
+
+    def _replay(self, log_fname):
+        try:
+            with open(log_fname, 'rb') as fid:
+                inode = os.fstat(fid.fileno()).st_ino
+                start = 0
+                if inode == self._log_position[0]:
+                    start = self._log_position[1]
+                    fid.seek(start)
+                data = fid.read()
+        except (IOError, OSError):
+            return
+        # Only complete lines, the last one may be being written
+        end = data.rfind(b'\n') + 1
+        self._log_position = (inode, start + end)
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                fname, values = json.loads(line)
+            except ValueError:
+                # Truncated line, e.g. from an interrupted build
+                continue
+            self.update(fname, **values)
+
+    def refresh(self):
+        """Apply the records logged since the log was last read"""
+        self._replay(self.fname + LOG_SUFFIX)
+
+    def save(self):
+        """Write the manifest to the gallery directory, if it changed
+
+        The log is merged into the manifest. It is taken away first, so
+        that the records logged meanwhile go to a new log.
+        """
+        log_fname = self.fname + LOG_SUFFIX
+        merged_fname = '%s.%d' % (log_fname, os.getpid())
+        try:
+            os.rename(log_fname, merged_fname)
+        except OSError:
+            merged_fname = None
+        else:
+            self._replay(merged_fname)
+        if self.changed:
+            if not os.path.exists(self.target_dir):
+                os.makedirs(self.target_dir)
+            with atomic_write(self.fname, encoding='utf-8') as fid:
+                json.dump(self.entries, fid, indent=1, sort_keys=True)
+            self.changed = False
+        if merged_fname is not None:
+            os.remove(merged_fname)
@@ -16,6 +16,7 @@ import json
 import re
 import sys
 
+from .locking import atomic_write
 from .py_source_parser import split_code_and_text_blocks
 from .utils import replace_py_ipynb
 
@@ -168,7 +169,7 @@ def fill_notebook(work_notebook, script_blocks):
 
 def save_notebook(work_notebook, write_file):
     """Saves the Jupyter work_notebook to write_file"""
-    with open(write_file, 'w') as out_nb:
+    with atomic_write(write_file) as out_nb:
         json.dump(work_notebook, out_nb, indent=2)
 
 
@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Parallel execution of examples
+==============================
+
+Run the examples of a gallery in a pool of worker processes. Each worker
+executes examples one after another, as a serial build does: the working
+directory, ``sys.argv`` and the matplotlib state are restored after every
+example, and the modules and caches loaded by a worker are reused by the
+next examples. The workers are forked from a warm forkserver process when
+the platform supports it.
+
+Running examples in worker processes also allows to bound the time and the
+memory each of them can use, see ``example_timeout`` and
+``example_memory_limit``. A worker killed by a limit is replaced.
+"""
+
+from __future__ import division, absolute_import, print_function
+import collections
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from . import sphinx_compatibility
+from .fingerprint import get_version_cache, warm_version_cache
+from .hashing import file_stat
+from .manifest import get_manifest
+from .py_source_parser import split_code_and_text_blocks
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+logger = sphinx_compatibility.getLogger('sphinx-gallery')
+
+
+class ExampleTask(collections.namedtuple('ExampleTask',
+                                         ['fname', 'target_dir', 'src_dir'])):
+    """An example to run, given as the arguments of generate_file_rst"""
+    __slots__ = ()
+
+    @property
+    def src_file(self):
+        return os.path.normpath(os.path.join(self.src_dir, self.fname))
+
+
+# Settings of gallery_conf that examples can override
+_LIMIT_KEYS = ('example_timeout', 'example_memory_limit')
+
+# Keys of gallery_conf only used by the parent process, they can hold
+# arbitrary callables that are not always picklable.
+_PARENT_ONLY_KEYS = ('within_subsection_order', 'subsection_order')
+
+
+def get_n_jobs(gallery_conf):
+    """Return the number of worker processes requested by ``parallel``
+
+    ``True`` uses all available cores and negative values count backwards
+    from the number of cores, as in joblib (``-1`` is all cores).
+    """
+    parallel = gallery_conf.get('parallel', False)
+    if parallel is True:
+        return multiprocessing.cpu_count()
+    if not parallel:
+        return 1
+    n_jobs = int(parallel)
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def _get_context(gallery_conf):
+    """Get the multiprocessing context used to start the workers
+
+    Where available, workers are forked from a forkserver process that has
+    already imported ``gen_rst`` (hence matplotlib with the agg backend and
+    its font cache) and the modules listed in ``preload_modules``. Starting
+    a worker then only costs a fork. The forkserver does not see the
+    changes made to ``sys.path`` at runtime, e.g. in ``conf.py``, the
+    workers import the modules it could not find, see ``_worker``.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' in methods:
+        ctx = multiprocessing.get_context('forkserver')
+        preload = ['sphinx_galleria.gen_rst', 'sphinx_galleria.parallel']
+        preload.extend(gallery_conf.get('preload_modules', ()))
+        # Only effective if the forkserver has not been started yet
+        ctx.set_forkserver_preload(preload)
+        return ctx
+    return multiprocessing.get_context('fork' if 'fork' in methods
+                                       else 'spawn')
+
+
+def _worker_conf(gallery_conf):
+    """Copy of gallery_conf that is sent to the worker processes"""
+    conf = dict((key, value) for key, value in gallery_conf.items()
+                if key not in _PARENT_ONLY_KEYS)
+    conf['failing_examples'] = {}
+    return conf
+
+
+def parse_memory_limit(value):
+    """Convert a memory limit such as ``'2G'`` or ``512000`` to bytes"""
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+        value = value.strip().upper().rstrip('B')
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def get_example_limits(task, gallery_conf, manifests=None):
+    """Get the time and memory limits of an example
+
+    The ``example_timeout`` and ``example_memory_limit`` settings of
+    gallery_conf can be overridden in the example file with
+    ``# sphinx_galleria_example_timeout = <seconds>`` and
+    ``# sphinx_galleria_example_memory_limit = <size>``.
+
+    With the manifests loaded by gallery directory, the overrides are kept
+    in the record of the example with the modification time and size of
+    its file, which is only parsed again when it changed.
+
+    Returns
+    -------
+    timeout : float or None
+        Wall-clock limit in seconds.
+    memory_limit : int or None
+        Address space limit in bytes.
+    """
+    stat = file_stat(task.src_file)
+    manifest = overrides = None
+    if manifests is not None:
+        manifest = get_manifest(manifests, task.target_dir)
+        cached = manifest.get(task.fname).get('limits')
+        if cached is not None and cached[0] == stat:
+            overrides = cached[1]
+    if overrides is None:
+        file_conf, _ = split_code_and_text_blocks(task.src_file)
+        overrides = dict((key, file_conf[key]) for key in _LIMIT_KEYS
+                         if key in file_conf)
+        if manifest is not None:
+            manifest.update(task.fname, limits=[stat, overrides])
+    timeout = overrides.get('example_timeout',
+                            gallery_conf.get('example_timeout'))
+    memory_limit = overrides.get('example_memory_limit',
+                                 gallery_conf.get('example_memory_limit'))
+    return timeout or None, parse_memory_limit(memory_limit) or None
+
+
+def _set_memory_limit(memory_limit):
+    """Limit the address space of the current process
+
+    Returns the previous limits, to restore them with ``setrlimit``.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        memory_limit = min(memory_limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+    return soft, hard
+
+
+def estimate_runtimes(tasks, manifests=None):
+    """Estimate how long each example will take to run
+
+    The running times recorded in the gallery manifests by previous builds
+    are used when available. Other examples get an estimate from their
+    amount of code, as measured by ``NumberOfCodeLinesSortKey``, scaled by
+    the average time per character of code of the examples with a record.
+    The manifests already loaded can be given by gallery directory.
+
+    Returns
+    -------
+    estimates : list of float
+        Expected running time of each task, in seconds when any history is
+        available.
+    """
+    # Local import, sorting depends on gen_rst which depends on this module
+    from .sorting import NumberOfCodeLinesSortKey
+    if manifests is None:
+        manifests = {}
+    runtimes, code_sizes = [], []
+    for task in tasks:
+        record = get_manifest(manifests, task.target_dir).get(task.fname)
+        runtimes.append(record.get('runtime'))
+        code_sizes.append(NumberOfCodeLinesSortKey(task.src_dir)(task.fname))
+
+    known_time = sum(runtime for runtime in runtimes if runtime is not None)
+    known_code = sum(code_size for runtime, code_size
+                     in zip(runtimes, code_sizes) if runtime is not None)
+    rate = known_time / known_code if known_code else 1.
+    return [code_size * rate if runtime is None else runtime
+            for runtime, code_size in zip(runtimes, code_sizes)]
+
+
+def lpt_order(estimates):
+    """Indices sorted longest processing time first"""
+    return sorted(range(len(estimates)), key=lambda index: -estimates[index])
+
+
+def _worker(conn, run, gallery_conf, sys_path, version_cache):
+    """Execute the examples sent by the main process until it sends None
+
+    The worker is given the ``sys.path`` of the main process, which the
+    forkserver does not inherit, and the package versions it looked up.
+    The modules of ``preload_modules`` that cannot be imported are reported
+    back. The manifests are loaded once per worker.
+
+    The worker exits after an example exceeded its memory limit or raised
+    an error outside of its code.
+    """
+    sys.path[:] = sys_path
+    warm_version_cache(version_cache)
+    for name in gallery_conf.get('preload_modules', ()):
+        try:
+            __import__(name)
+        except ImportError as error:
+            conn.send(('warning', 'preload_modules: {0} could not be '
+                       'imported: {1}'.format(name, error)))
+    manifests = {}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            message = None
+        if message is None:
+            break
+        task, memory_limit = message
+        if not _run_example(conn, run, task, gallery_conf, memory_limit,
+                            manifests):
+            break
+    conn.close()
+
+
+def _run_example(conn, run, task, gallery_conf, memory_limit, manifests):
+    """Execute one example inside a worker process and send back the result
+
+    Returns whether the worker can execute other examples.
+    """
+    gallery_conf['failing_examples'] = {}
+    limits = None
+    try:
+        if memory_limit is not None:
+            limits = _set_memory_limit(memory_limit)
+        intro, time_elapsed = run(task.fname, task.target_dir, task.src_dir,
+                                  gallery_conf, manifests)
+    except MemoryError:
+        conn.send(('limit', 'Example exceeded the memory limit of {0} bytes'
+                   .format(memory_limit)))
+        return False
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+        return False
+    finally:
+        if limits is not None:
+            resource.setrlimit(resource.RLIMIT_AS, limits)
+    failing_examples = gallery_conf['failing_examples']
+    tb = failing_examples.get(task.src_file, '')
+    if memory_limit is not None and 'MemoryError' in tb:
+        failing_examples[task.src_file] = (
+            'Example exceeded the memory limit of {0} bytes\n{1}'
+            .format(memory_limit, tb))
+    conn.send(('done', (intro, time_elapsed), failing_examples))
+    return True
+
+
+def _start_worker(ctx, run, worker_conf, version_cache):
+    """Start a worker process, return it with the end of its pipe"""
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=_worker,
+                          args=(child_conn, run, worker_conf,
+                                list(sys.path), version_cache))
+    process.start()
+    child_conn.close()
+    return process, parent_conn
+
+
+def _run_unexecuted(run, task, gallery_conf, reason, manifests=None):
+    """Record a failed example and generate its rst without executing it"""
+    logger.warning('%s failed to execute correctly: %s', task.src_file,
+                   reason)
+    if gallery_conf['abort_on_example_error']:
+        raise RuntimeError('{0}: {1}'.format(task.src_file, reason))
+    gallery_conf['failing_examples'][task.src_file] = reason
+    no_plot_conf = dict(gallery_conf, plot_gallery=False)
+    intro, _ = run(task.fname, task.target_dir, task.src_dir, no_plot_conf,
+                   manifests)
+    return intro, 0
+
+
+def _stop_process(process):
+    """Terminate a worker, killing it if it does not exit promptly"""
+    process.terminate()
+    process.join(1)
+    if process.is_alive() and hasattr(process, 'kill'):
+        process.kill()
+    process.join()
+
+
+def execute_examples(tasks, gallery_conf, run, before_run=None,
+                     manifests=None, budget=None):
+    """Execute examples and yield their results as they complete
+
+    Parameters
+    ----------
+    tasks : list of ExampleTask
+        The examples to execute.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery. Failing examples
+        reported by the workers are merged into ``failing_examples``.
+        Examples with a time or memory limit are always run in a worker
+        process, even when ``parallel`` is disabled.
+    run : callable
+        Function generating the rst of one example, called as
+        ``run(fname, target_dir, src_dir, gallery_conf, manifests)``, in
+        worker processes without ``manifests``. It must return the example
+        intro and its running time.
+    before_run : callable, optional
+        Called in the main process with the index of each task before it
+        starts, e.g. to wait for its outputs to be downloaded.
+    manifests : dict, optional
+        The gallery manifests already loaded, by gallery directory, passed
+        on to ``run`` in this process.
+    budget : float, optional
+        Seconds after which no example is started anymore. Examples are
+        then started in the order of tasks, instead of slowest first.
+
+    Yields
+    ------
+    index : int
+        Position of the finished example in ``tasks``.
+    result : tuple or None
+        The ``(intro, time_elapsed)`` returned by ``run``, None for the
+        examples not started within the budget.
+    """
+    start = time.time()
+
+    def over_budget():
+        return budget is not None and time.time() - start >= budget
+
+    n_jobs = min(get_n_jobs(gallery_conf), len(tasks))
+    # Examples that are not executed have no limits
+    limits = [get_example_limits(task, gallery_conf, manifests)
+              if gallery_conf['plot_gallery'] else (None, None)
+              for task in tasks]
+    use_limits = any(timeout or memory for timeout, memory in limits)
+    if (n_jobs > 1 or use_limits) and \
+            not hasattr(multiprocessing, 'get_context'):
+        logger.warning('Parallel example execution and example limits '
+                       'require Python 3, examples will be run serially '
+                       'without limits.')
+        n_jobs, use_limits = 1, False
+    n_jobs = max(n_jobs, 1)
+    if resource is None and any(memory for _, memory in limits):
+        logger.warning('example_memory_limit is not supported on this '
+                       'platform and will be ignored.')
+        limits = [(timeout, None) for timeout, _ in limits]
+    if n_jobs <= 1 and not use_limits:
+        for index, task in enumerate(tasks):
+            if over_budget():
+                yield index, None
+                continue
+            if before_run is not None:
+                before_run(index)
+            yield index, run(task.fname, task.target_dir, task.src_dir,
+                             gallery_conf, manifests)
+        return
+
+    from multiprocessing.connection import wait
+    ctx = _get_context(gallery_conf)
+    worker_conf = _worker_conf(gallery_conf)
+    version_cache = None
+    # Start the slowest examples first so that a long example dispatched
+    # last does not dominate the total build time
+    order = (range(len(tasks)) if budget is not None else
+             lpt_order(estimate_runtimes(tasks, manifests)))
+    pending = collections.deque((index, tasks[index]) for index in order)
+    # Workers are reused until they are stopped or an example breaks them
+    idle = []
+    running = {}
+    warnings = set()
+    try:
+        while pending or running:
+            while pending and over_budget():
+                yield pending.popleft()[0], None
+            if not running and not pending:
+                # Nothing was started before the budget was used up
+                break
+            while pending and len(running) < n_jobs:
+                index, task = pending.popleft()
+                if before_run is not None:
+                    before_run(index)
+                timeout, memory_limit = limits[index]
+                if not idle:
+                    if version_cache is None:
+                        version_cache = get_version_cache()
+                    idle.append(_start_worker(ctx, run, worker_conf,
+                                              version_cache))
+                process, conn = idle.pop()
+                conn.send((task, memory_limit))
+                deadline = time.time() + timeout if timeout else None
+                running[conn] = (index, task, process, deadline)
+
+            deadlines = [deadline for _, _, _, deadline in running.values()
+                         if deadline is not None]
+            wait_time = (max(min(deadlines) - time.time(), 0)
+                         if deadlines else None)
+            ready = wait(list(running), wait_time)
+
+            for conn in ready:
+                index, task, process, _ = running[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, IOError, OSError):
+                    # The pipe of a worker is a socket, which may be reset
+                    message = None
+                if message is not None and message[0] == 'warning':
+                    # Reported once, not by every worker
+                    if message[1] not in warnings:
+                        warnings.add(message[1])
+                        logger.warning(message[1])
+                    continue
+                del running[conn]
+                if message is not None and message[0] == 'done':
+                    idle.append((process, conn))
+                else:
+                    conn.close()
+                    process.join()
+
+                if message is None:
+                    reason = ('Worker process died unexpectedly with exit '
+                              'code {0}'.format(process.exitcode))
+                    if limits[index][1] is not None:
+                        reason += (', it might have exceeded the memory '
+                                   'limit of {0} bytes'
+                                   .format(limits[index][1]))
+                    result = _run_unexecuted(run, task, gallery_conf, reason,
+                                             manifests)
+                elif message[0] == 'limit':
+                    result = _run_unexecuted(run, task, gallery_conf,
+                                             message[1], manifests)
+                elif message[0] == 'error':
+                    raise RuntimeError('Error while generating {0}:\n{1}'
+                                       .format(task.src_file, message[1]))
+                else:
+                    result = message[1]
+                    gallery_conf['failing_examples'].update(message[2])
+                yield index, result
+
+            now = time.time()
+            for conn, (index, task, process, deadline) in \
+                    list(running.items()):
+                if deadline is None or now < deadline:
+                    continue
+                del running[conn]
+                _stop_process(process)
+                conn.close()
+                reason = ('Example exceeded the time limit of {0} seconds '
+                          'and was terminated'.format(limits[index][0]))
+                yield index, _run_unexecuted(run, task, gallery_conf, reason,
+                                             manifests)
+    finally:
+        for conn, (_, _, process, _) in running.items():
+            _stop_process(process)
+            conn.close()
+        for process, conn in idle:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                # Already exited
+                pass
+            conn.close()
+        for process, _ in idle:
+            process.join()
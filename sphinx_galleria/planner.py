@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Dry-run build planner
+=====================
+
+Tell what a build would do without executing anything: which examples are
+reused from the cache and which are executed, and why, with the expected
+wall time of the build. The examples are discovered as in a build and
+checked against the gallery manifests, the artifact store and
+``changed_since`` in the same order, then scheduled on the workers of
+``parallel`` with the running times recorded by previous builds.
+"""
+
+from __future__ import division, absolute_import, print_function
+import argparse
+import codecs
+import collections
+import copy
+import heapq
+import os
+import re
+import sys
+
+from .artifact_store import get_artifact_store
+from .dependencies import data_file_paths, find_local_imports
+from .gen_gallery import DEFAULT_GALLERY_CONF, get_subsections
+from .gen_rst import (example_is_unchanged, example_md5_is_current,
+                      get_example_fingerprints, get_source_key,
+                      list_examples, _execution_priority)
+from .hashing import file_stat
+from .manifest import get_manifest
+from .parallel import ExampleTask, estimate_runtimes, get_n_jobs, lpt_order
+from .vcs import is_changed_example
+
+# Status of the examples in a plan
+CACHED = 'cached'
+RESTORED = 'restored'
+KEPT = 'kept'
+EXECUTED = 'executed'
+OVER_BUDGET = 'over budget'
+NOT_EXECUTED = 'not executed'
+
+
+class ExamplePlan(collections.namedtuple(
+        'ExamplePlan', ['task', 'status', 'reason', 'estimate'])):
+    """What a build would do with an example
+
+    ``status`` is one of ``'cached'`` (unchanged since the last build),
+    ``'restored'`` (from the artifact store), ``'kept'`` (outputs of the
+    last build kept by ``changed_since``), ``'executed'``, ``'over budget'``
+    and ``'not executed'`` (rst written without running the code).
+    ``estimate`` is the expected running time in seconds of the examples
+    executed, 0 for the others.
+    """
+    __slots__ = ()
+
+
+def discover_examples(gallery_conf):
+    """List the examples of the galleries, as a build would
+
+    Returns
+    -------
+    tasks : list of ExampleTask
+        The examples, in the order of the galleries and subsections.
+    """
+    src_dir = gallery_conf['src_dir']
+    examples_dirs = gallery_conf['examples_dirs']
+    gallery_dirs = gallery_conf['gallery_dirs']
+    if not isinstance(examples_dirs, list):
+        examples_dirs = [examples_dirs]
+    if not isinstance(gallery_dirs, list):
+        gallery_dirs = [gallery_dirs]
+
+    tasks = []
+    for examples_dir, gallery_dir in zip(examples_dirs, gallery_dirs):
+        examples_dir = os.path.join(src_dir, examples_dir)
+        gallery_dir = os.path.join(src_dir, gallery_dir)
+        sections = [(examples_dir, gallery_dir)]
+        for subsection in get_subsections(src_dir, examples_dir,
+                                          gallery_conf['subsection_order']):
+            sections.append((os.path.join(examples_dir, subsection),
+                             os.path.join(gallery_dir, subsection)))
+        for section_dir, target_dir in sections:
+            tasks.extend(ExampleTask(fname, target_dir, section_dir)
+                         for fname in list_examples(section_dir,
+                                                    gallery_conf))
+    return tasks
+
+
+def _execution_reason(task, record, dependencies, fingerprint):
+    """Why an example whose checksum is not current is executed"""
+    if not record:
+        return 'never built'
+    if record.get('status') == 'failed':
+        return 'failed in the last build'
+    if not record.get('md5'):
+        return 'not executed in the last build'
+    if record.get('stat') != file_stat(task.src_file):
+        return 'example changed'
+    recorded = record.get('dependencies') or {}
+    for name in sorted(recorded):
+        path = os.path.join(task.src_dir, *name.split('/'))
+        if file_stat(path) != recorded[name]:
+            return 'dependency changed: %s' % name
+    for path in dependencies:
+        name = os.path.relpath(path, task.src_dir).replace(os.sep, '/')
+        if name not in recorded:
+            return 'new dependency: %s' % name
+    if record.get('fingerprint') != fingerprint:
+        return 'package versions or configuration changed'
+    return 'checksum changed'
+
+
+def plan_example(task, record, gallery_conf, store=None):
+    """Decide what a build would do with an example, without running it
+
+    The checks are the ones of ``run_examples`` and ``generate_file_rst``:
+    the modification times recorded in the manifest, then the checksum of
+    the example, the artifact store and ``changed_since``. Files whose
+    modification time and size are recorded are not read.
+
+    Returns
+    -------
+    status : str
+        See ``ExamplePlan``, ``'executed'`` for the examples to run.
+    reason : str
+        Human readable explanation of the status.
+    """
+    example_file = os.path.join(task.target_dir, task.fname)
+    rst_file = os.path.splitext(example_file)[0] + '.rst'
+    if example_is_unchanged(task.src_file, example_file, record,
+                            gallery_conf):
+        return CACHED, 'unchanged since the last build'
+
+    dependencies = find_local_imports(task.src_file, gallery_conf)
+    fingerprints = get_example_fingerprints(task.src_file, dependencies,
+                                            gallery_conf)
+    fingerprint = fingerprints[0] + fingerprints[1]
+    if example_md5_is_current(task.src_file, record, dependencies,
+                              fingerprint, gallery_conf.get('hash_algorithm')):
+        return CACHED, 'same checksum as in the last build'
+
+    if not gallery_conf['plot_gallery']:
+        return NOT_EXECUTED, 'plot_gallery is disabled'
+    if not re.search(gallery_conf['filename_pattern'], task.src_file):
+        return NOT_EXECUTED, 'does not match filename_pattern'
+    if store is not None:
+        source_key = get_source_key(task.src_file, example_file,
+                                    dependencies, gallery_conf, fingerprints)
+        if store.lookup(source_key, task.src_dir) is not None:
+            return RESTORED, 'outputs in the artifact store'
+
+    data_files = data_file_paths(task.src_file,
+                                 record.get('data_files', []))
+    recorded = [os.path.join(task.src_dir, *name.split('/'))
+                for name in record.get('dependencies') or {}]
+    if not is_changed_example(task.src_file,
+                              dependencies + data_files + recorded,
+                              gallery_conf):
+        if os.path.exists(rst_file):
+            return KEPT, 'unchanged since %s' % gallery_conf['changed_since']
+        return NOT_EXECUTED, 'unchanged since %s, no previous outputs' % (
+            gallery_conf['changed_since'])
+    return EXECUTED, _execution_reason(task, record, dependencies,
+                                       fingerprint)
+
+
+def simulate_schedule(estimates, order, n_jobs, budget=None):
+    """Expected wall time of executing examples on parallel workers
+
+    Each example starts on the first worker free, in the given order. With
+    a budget, the examples that would start after it are not executed.
+
+    Returns
+    -------
+    wall_time : float
+        Expected time until the last example finishes.
+    started : list of bool
+        Whether each example starts within the budget.
+    """
+    workers = [0.] * max(n_jobs, 1)
+    started = [False] * len(estimates)
+    for index in order:
+        start = heapq.heappop(workers)
+        if budget is not None and start >= budget:
+            heapq.heappush(workers, start)
+            continue
+        started[index] = True
+        heapq.heappush(workers, start + estimates[index])
+    return max(workers), started
+
+
+def plan_examples(tasks, gallery_conf, manifests=None, n_jobs=None):
+    """Plan the build of examples without executing them
+
+    Parameters
+    ----------
+    tasks : list of ExampleTask
+        The examples to build.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery, it is not modified.
+    manifests : dict, optional
+        The gallery manifests already loaded, by gallery directory.
+    n_jobs : int, optional
+        Number of examples executed at once, from ``parallel`` by default.
+
+    Returns
+    -------
+    plans : list of ExamplePlan
+        What a build would do with each task, in the order of tasks.
+    wall_time : float
+        Expected time to execute the examples, in seconds.
+    """
+    gallery_conf = copy.copy(gallery_conf)
+    if manifests is None:
+        manifests = {}
+    store = get_artifact_store(gallery_conf)
+    statuses = [plan_example(task,
+                             get_manifest(manifests, task.target_dir).get(
+                                 task.fname), gallery_conf, store)
+                for task in tasks]
+    estimates = estimate_runtimes(tasks, manifests)
+
+    to_run = [index for index, (status, _) in enumerate(statuses)
+              if status == EXECUTED]
+    if n_jobs is None:
+        n_jobs = get_n_jobs(gallery_conf)
+    budget = gallery_conf.get('execution_budget_seconds')
+    if budget is not None:
+        # Started by priority, see run_examples
+        to_run.sort(key=lambda index: _execution_priority(
+            tasks[index], manifests[tasks[index].target_dir]))
+        order = range(len(to_run))
+    else:
+        order = lpt_order([estimates[index] for index in to_run])
+    wall_time, started = simulate_schedule(
+        [estimates[index] for index in to_run], order, n_jobs, budget)
+    for index, is_started in zip(to_run, started):
+        if not is_started:
+            statuses[index] = (OVER_BUDGET, 'would start after %ss' % budget)
+
+    plans = []
+    for index, (task, (status, reason)) in enumerate(zip(tasks, statuses)):
+        estimate = estimates[index] if status == EXECUTED else 0.
+        plans.append(ExamplePlan(task, status, reason, estimate))
+    return plans, wall_time
+
+
+def format_plan(plans, wall_time, n_jobs, src_dir):
+    """Report of a build plan, one line per example and a summary"""
+    lines = []
+    for plan in plans:
+        example = os.path.relpath(plan.task.src_file, src_dir)
+        line = '%-12s %s: %s' % (plan.status, example, plan.reason)
+        if plan.status == EXECUTED:
+            line += ' (~%.1f s)' % plan.estimate
+        lines.append(line)
+    counts = collections.Counter(plan.status for plan in plans)
+    lines.append('')
+    lines.append(', '.join('%d %s' % (counts[status], status) for status in
+                           (CACHED, RESTORED, KEPT, EXECUTED, OVER_BUDGET,
+                            NOT_EXECUTED) if counts[status]) or
+                 'no examples')
+    lines.append('Estimated execution time: %.1f s with %d job%s' % (
+        wall_time, n_jobs, '' if n_jobs == 1 else 's'))
+    return '\n'.join(lines)
+
+
+def read_gallery_conf(src_dir):
+    """Configuration of Sphinx-Gallery from the conf.py of a documentation
+
+    conf.py is executed as Sphinx does, from its directory.
+    """
+    src_dir = os.path.abspath(src_dir)
+    conf_file = os.path.join(src_dir, 'conf.py')
+    namespace = {'__file__': conf_file, '__name__': '__config__'}
+    cwd = os.getcwd()
+    sys.path.insert(0, src_dir)
+    try:
+        os.chdir(src_dir)
+        with codecs.open(conf_file, 'r', encoding='utf-8') as fid:
+            code = compile(fid.read(), conf_file, 'exec')
+        exec(code, namespace)
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(src_dir)
+    gallery_conf = copy.deepcopy(DEFAULT_GALLERY_CONF)
+    gallery_conf.update(namespace.get('sphinx_galleria_conf', {}))
+    plot_gallery = namespace.get('plot_gallery', 'True')
+    try:
+        plot_gallery = eval(plot_gallery)
+    except TypeError:
+        plot_gallery = bool(plot_gallery)
+    draft = namespace.get('draft', gallery_conf['draft'])
+    try:
+        draft = eval(draft)
+    except TypeError:
+        draft = bool(draft)
+    gallery_conf.update(plot_gallery=plot_gallery, draft=bool(draft),
+                        src_dir=src_dir)
+    return gallery_conf
+
+
+def plan_cli(args=None, namespace=None):
+    """Print the plan of a build from the command line
+
+    Takes the same arguments as ArgumentParser.parse_args
+    """
+    parser = argparse.ArgumentParser(
+        description='Show what a Sphinx-Gallery build would execute')
+    parser.add_argument('src_dir', nargs='?', default='.',
+                        help='Sphinx source directory of the documentation '
+                        '(the directory of conf.py)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of examples executed at once, from the '
+                        'parallel configuration by default')
+    parser.add_argument('--changed-since', default=None,
+                        help='Plan the build with this changed_since '
+                        'revision')
+    parser.add_argument('--draft', action='store_true',
+                        help='Plan a draft build')
+    args = parser.parse_args(args, namespace)
+
+    gallery_conf = read_gallery_conf(args.src_dir)
+    if args.draft:
+        gallery_conf['draft'] = True
+    if args.changed_since is not None:
+        gallery_conf['changed_since'] = args.changed_since
+    n_jobs = args.jobs if args.jobs is not None else get_n_jobs(gallery_conf)
+    plans, wall_time = plan_examples(discover_examples(gallery_conf),
+                                     gallery_conf, n_jobs=n_jobs)
+    print(format_plan(plans, wall_time, n_jobs, gallery_conf['src_dir']))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Remote cache
+============
+
+Share the entries of the artifact store with other machines, e.g. between
+continuous integration jobs and developer machines.
+
+A remote cache only needs to get and put files by name. Entries are
+transferred as zip archives named ``entries/<key>.zip``, next to the lists
+of data files ``sources/<source_key>.json`` of the artifact store. Any HTTP
+server answering ``GET`` and ``PUT`` requests on these paths, or a shared
+directory, can be used.
+
+Transfers run in background threads: entries are downloaded while other
+examples execute and uploaded after their example finished. Pickled files
+are never transferred, unpickling data from a shared cache could run
+arbitrary code: the names used by the examples are found again locally.
+"""
+
+from __future__ import division, absolute_import, print_function
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+# Try Python 3 first, otherwise load from Python 2
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+from . import sphinx_compatibility
+from .locking import atomic_write
+
+logger = sphinx_compatibility.getLogger('sphinx-gallery')
+
+
+def get_remote_backend(gallery_conf):
+    """Return the remote cache configured, None if there is none
+
+    ``remote_cache`` is either the URL of an HTTP server or the path of a
+    directory.
+    """
+    location = gallery_conf.get('remote_cache')
+    if not location:
+        return None
+    if location.startswith(('http://', 'https://')):
+        return HTTPBackend(location)
+    if location.startswith('file://'):
+        location = location[len('file://'):]
+    return DirectoryBackend(os.path.expanduser(location))
+
+
+class DirectoryBackend(object):
+    """Remote cache in a directory, e.g. on a shared file system"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, name):
+        """Return the content of a file, None if it does not exist"""
+        try:
+            with open(os.path.join(self.root, *name.split('/')), 'rb') as fid:
+                return fid.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, name, data):
+        """Write a file, replacing it atomically"""
+        fname = os.path.join(self.root, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(fname)):
+            try:
+                os.makedirs(os.path.dirname(fname))
+            except OSError:
+                # Created meanwhile by another writer
+                pass
+        with atomic_write(fname, 'wb') as fid:
+            fid.write(data)
+
+
+class HTTPBackend(object):
+    """Remote cache on an HTTP server accepting GET and PUT requests"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/') + '/'
+        self.timeout = timeout
+
+    def get(self, name):
+        """Return the content of a file, None if it is not available"""
+        try:
+            response = urlopen(self.url + name, timeout=self.timeout)
+            try:
+                return response.read()
+            finally:
+                response.close()
+        except HTTPError as exc:
+            if exc.code != 404:
+                logger.warning('Remote cache: GET %s failed: %s', name, exc)
+        except (URLError, IOError, OSError) as exc:
+            logger.warning('Remote cache: GET %s failed: %s', name, exc)
+        return None
+
+    def put(self, name, data):
+        """Upload a file"""
+        request = Request(self.url + name, data=data)
+        request.get_method = lambda: 'PUT'
+        request.add_header('Content-Type', 'application/octet-stream')
+        try:
+            urlopen(request, timeout=self.timeout).close()
+        except (URLError, IOError, OSError) as exc:
+            logger.warning('Remote cache: PUT %s failed: %s', name, exc)
+
+
+class RemoteSync(object):
+    """Background transfers between the artifact store and a remote cache
+
+    Parameters
+    ----------
+    store : ArtifactStore
+        The local artifact store.
+    backend : DirectoryBackend or HTTPBackend
+        The remote cache.
+    n_threads : int
+        Number of concurrent transfers.
+    """
+
+    def __init__(self, store, backend, n_threads=4):
+        self.store = store
+        self.backend = backend
+        self.pool = ThreadPool(n_threads)
+
+    def fetch(self, get_source_key, base_dir):
+        """Download the entry of an example, unless it is in the store
+
+        Parameters
+        ----------
+        get_source_key : callable
+            Returns the key of the inputs of the example. It is called in
+            the background thread, computing it hashes the example and its
+            dependencies.
+        base_dir : str
+            Directory the data files of the example are relative to.
+
+        Returns
+        -------
+        result : AsyncResult
+            Its ``get`` method waits for the download and returns the source
+            key and whether the entry is now in the store.
+        """
+        return self.pool.apply_async(self._fetch, (get_source_key, base_dir))
+
+    def _fetch(self, get_source_key, base_dir):
+        source_key = None
+        try:
+            source_key = get_source_key()
+            if self.store.lookup(source_key, base_dir) is not None:
+                return source_key, True
+            data = self.backend.get('sources/%s.json' % source_key)
+            if data is None:
+                return source_key, False
+            names = json.loads(data.decode('utf-8'))
+            key = self.store.full_key(source_key, [
+                os.path.normpath(os.path.join(base_dir, name))
+                for name in names])
+            data = self.backend.get('entries/%s.zip' % key)
+            if data is None:
+                return source_key, False
+            self.store.unpack(key, data)
+            self.store.write_source(source_key, names)
+            return source_key, True
+        except Exception as exc:  # never fail the build for the cache
+            logger.warning('Remote cache: could not fetch %s: %s',
+                           source_key, exc)
+            return source_key, False
+
+    def upload(self, source_key, base_dir):
+        """Upload the entry of an example from the store, in background"""
+        return self.pool.apply_async(self._upload, (source_key, base_dir))
+
+    def _upload(self, source_key, base_dir):
+        try:
+            key = self.store.lookup(source_key, base_dir)
+            if key is None:
+                return False
+            self.backend.put('entries/%s.zip' % key, self.store.pack(key))
+            # The list of data files last, once the entry can be found
+            self.backend.put('sources/%s.json' % source_key, json.dumps(
+                self.store.read_source(source_key)).encode('utf-8'))
+            return True
+        except Exception as exc:  # never fail the build for the cache
+            logger.warning('Remote cache: could not upload %s: %s',
+                           source_key, exc)
+            return False
+
+    def close(self):
+        """Wait for the pending transfers"""
+        self.pool.close()
+        self.pool.join()
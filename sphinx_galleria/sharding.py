@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Sharded execution
+=================
+
+Split the execution of the examples between several machines, e.g. the
+nodes of a continuous integration job. With ``shard`` set to ``'i/N'``, or
+the ``SPHINX_GALLERIA_SHARD`` environment variable, the examples of all the
+galleries are split into ``N`` shards of about the same running time, using
+the running times recorded in the gallery manifests, and a build only
+executes the examples of shard ``i``. The other examples are added to the
+gallery without being executed.
+
+The outputs of the examples of the shard, their manifest records, running
+times and failures are then exported to a shard directory. The shard
+directories of all the nodes are merged into the gallery directories of a
+final build, with ``shard_merge`` or the ``SPHINX_GALLERIA_SHARD_MERGE``
+environment variable. The outputs of an example are only merged if its
+inputs in the final build are the ones it was executed with. The final
+build writes the gallery indexes, back references and downloads, and
+reports the running times and failures of the merged examples, without
+executing them again.
+
+All the nodes must compute the same split: they have to start from the
+same gallery manifests, e.g. none or the ones of the same previous build.
+"""
+
+from __future__ import division, absolute_import, print_function
+import filecmp
+import glob
+import json
+import os
+import shutil
+
+from . import sphinx_compatibility
+from .artifact_store import example_output_files
+from .dependencies import find_local_imports
+from .gen_rst import (example_md5_is_current, get_example_fingerprints,
+                      record_example, run_examples)
+from .locking import atomic_path, atomic_write
+from .manifest import get_manifest
+from .parallel import estimate_runtimes, lpt_order
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+SHARD_ENV = 'SPHINX_GALLERIA_SHARD'
+MERGE_ENV = 'SPHINX_GALLERIA_SHARD_MERGE'
+SHARD_INFO_FNAME = 'sphx_glr_shard.json'
+
+logger = sphinx_compatibility.getLogger('sphinx-gallery')
+
+
+def parse_shard(value):
+    """Convert a shard setting such as ``'2/4'`` to ``(2, 4)``
+
+    Shards are numbered from 1. None or an empty value disables sharding.
+    """
+    if not value:
+        return None
+    if isinstance(value, basestring):
+        parts = value.split('/')
+    else:
+        parts = list(value)
+    try:
+        index, count = [int(part) for part in parts]
+    except (TypeError, ValueError):
+        raise ValueError("shard must be given as 'i/N', got %r" % (value,))
+    if not 1 <= index <= count:
+        raise ValueError('shard %d/%d does not exist, shards are numbered '
+                         'from 1 to %d' % (index, count, count))
+    return index, count
+
+
+def get_shard(gallery_conf):
+    """Return the shard ``(i, N)`` this build runs, None to run them all
+
+    The ``SPHINX_GALLERIA_SHARD`` environment variable takes precedence over
+    the ``shard`` configuration.
+    """
+    return parse_shard(os.environ.get(SHARD_ENV) or
+                       gallery_conf.get('shard'))
+
+
+def assign_shards(estimates, count):
+    """Split tasks into shards of about the same total running time
+
+    Tasks are assigned longest first to the shard with the least work, the
+    split only depends on the estimates and their order.
+
+    Returns
+    -------
+    shards : list of int
+        The shard of each task, numbered from 1.
+    """
+    loads = [0.] * count
+    shards = [None] * len(estimates)
+    for index in lpt_order(estimates):
+        shard = loads.index(min(loads))
+        loads[shard] += estimates[index]
+        shards[index] = shard + 1
+    return shards
+
+
+def shard_indices(tasks, shard, manifests=None):
+    """Indices of the tasks of a shard
+
+    Parameters
+    ----------
+    tasks : list of ExampleTask
+        All the examples of the build.
+    shard : tuple
+        The shard ``(i, N)``.
+    manifests : dict, optional
+        The gallery manifests already loaded, by gallery directory.
+    """
+    index, count = shard
+    shards = assign_shards(estimate_runtimes(tasks, manifests), count)
+    return [task_index for task_index, task_shard in enumerate(shards)
+            if task_shard == index]
+
+
+def run_shard(tasks, shard, gallery_conf, summary, manifests):
+    """Execute the examples of a shard, the others are only parsed
+
+    The records of the examples of other shards are left untouched in the
+    manifests, and they are listed in ``skipped_examples``.
+
+    Returns
+    -------
+    results : list of tuple
+        The ``(intro, time_elapsed)`` of each task, in the order of tasks.
+    indices : list of int
+        Indices of the tasks of the shard.
+    """
+    indices = shard_indices(tasks, shard, manifests)
+    logger.info('running shard %d/%d: %d of %d examples', shard[0], shard[1],
+                len(indices), len(tasks))
+    others = sorted(set(range(len(tasks))) - set(indices))
+    results = [None] * len(tasks)
+    shard_results = run_examples([tasks[index] for index in indices],
+                                 gallery_conf, summary, manifests)
+    other_results = run_examples([tasks[index] for index in others],
+                                 dict(gallery_conf, plot_gallery=False),
+                                 summary, manifests)
+    for index in others:
+        gallery_conf['skipped_examples'][tasks[index].src_file] = \
+            'in another shard'
+    for index, result in zip(indices + others,
+                             shard_results + other_results):
+        results[index] = result
+    return results, indices
+
+
+def _relpath(path, start):
+    return os.path.relpath(path, start).replace(os.sep, '/')
+
+
+def export_shard(shard_dir, tasks, indices, results, gallery_conf,
+                 manifests, shard=None):
+    """Copy the outputs of the examples of a shard to a shard directory
+
+    The files generated by each example (rst, notebook, figures, thumbnail,
+    names used and the copy of the example) are copied under their path
+    relative to the Sphinx source directory. ``sphx_glr_shard.json`` lists
+    them with the manifest record, running time and failure of each
+    example.
+
+    Parameters
+    ----------
+    shard_dir : str
+        Directory the shard is exported to.
+    tasks : list of ExampleTask
+        All the examples of the build.
+    indices : list of int
+        Indices of the tasks of the shard.
+    results : list of tuple
+        The ``(intro, time_elapsed)`` of each task.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery
+    manifests : dict
+        The gallery manifests, by gallery directory.
+    shard : tuple, optional
+        The shard ``(i, N)``, recorded in the shard directory.
+    """
+    src_dir = gallery_conf['src_dir']
+    failing_examples = gallery_conf['failing_examples']
+    examples = []
+    for index in indices:
+        task = tasks[index]
+        names = [task.fname] + example_output_files(task.target_dir,
+                                                    task.fname)
+        gallery_dir = _relpath(task.target_dir, src_dir)
+        for name in names:
+            dst = os.path.join(shard_dir, gallery_dir, *name.split('/'))
+            if not os.path.exists(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            with atomic_path(dst) as tmp_fname:
+                shutil.copyfile(
+                    os.path.join(task.target_dir, *name.split('/')),
+                    tmp_fname)
+        intro, time_elapsed = results[index]
+        examples.append({
+            'gallery_dir': gallery_dir, 'fname': task.fname,
+            'src_file': _relpath(task.src_file, src_dir), 'files': names,
+            'intro': intro, 'time_elapsed': time_elapsed,
+            'record': manifests[task.target_dir].get(task.fname),
+            'failure': failing_examples.get(task.src_file)})
+    with atomic_write(os.path.join(shard_dir, SHARD_INFO_FNAME),
+                      encoding='utf-8') as fid:
+        json.dump({'shard': shard, 'examples': examples}, fid, indent=1,
+                  sort_keys=True)
+    logger.info('exported %d examples to %s', len(examples), shard_dir)
+
+
+def get_merge_dirs(gallery_conf):
+    """Return the shard directories to merge into this build
+
+    ``shard_merge`` is a path or a list of paths, relative to the Sphinx
+    source directory, which can contain wildcards. The
+    ``SPHINX_GALLERIA_SHARD_MERGE`` environment variable, with paths
+    separated by ``os.pathsep``, takes precedence.
+    """
+    patterns = os.environ.get(MERGE_ENV)
+    if patterns:
+        patterns = patterns.split(os.pathsep)
+    else:
+        patterns = gallery_conf.get('shard_merge') or []
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+    shard_dirs = []
+    for pattern in patterns:
+        pattern = os.path.join(gallery_conf['src_dir'], pattern)
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise ValueError('No shard directory matches %s' % pattern)
+        shard_dirs.extend(matches)
+    return shard_dirs
+
+
+def _read_shard(shard_dir):
+    """Read the description of an exported shard"""
+    info_fname = os.path.join(shard_dir, SHARD_INFO_FNAME)
+    if not os.path.isfile(info_fname):
+        raise ValueError('%s is not a shard directory, it has no %s'
+                         % (shard_dir, SHARD_INFO_FNAME))
+    with open(info_fname, 'rb') as fid:
+        return json.loads(fid.read().decode('utf-8'))
+
+
+def _is_same_example(shard_dir, example, task, gallery_conf):
+    """Whether an exported example was executed with the inputs of task"""
+    src_file = task.src_file
+    if not example['record'].get('md5'):
+        # Failed or not executed, only the copy of the example can be
+        # compared
+        copy = os.path.join(shard_dir, example['gallery_dir'],
+                            example['fname'])
+        return filecmp.cmp(copy, src_file, shallow=False)
+    dependencies = find_local_imports(src_file, gallery_conf)
+    execution, rst, _ = get_example_fingerprints(src_file, dependencies,
+                                                 gallery_conf)
+    return example_md5_is_current(src_file, example['record'], dependencies,
+                                  execution + rst,
+                                  gallery_conf.get('hash_algorithm'))
+
+
+def merge_shards(shard_dirs, tasks, gallery_conf, manifests):
+    """Merge the outputs of exported shards into the gallery directories
+
+    The files of the examples are copied to their gallery directory and
+    their manifest records are updated for this build, so that they are up
+    to date in the next builds too. Their failures are added to
+    ``failing_examples``. Examples whose inputs changed since they were
+    executed are not merged, nor the copies of an example from other shards
+    than the first one.
+
+    Parameters
+    ----------
+    shard_dirs : list of str
+        The shard directories, see ``export_shard``.
+    tasks : list of ExampleTask
+        All the examples of the build.
+    gallery_conf : dict
+        Contains the configuration of Sphinx-Gallery
+    manifests : dict
+        The gallery manifests, by gallery directory.
+
+    Returns
+    -------
+    results : dict
+        The ``(intro, time_elapsed)`` of the examples merged, by index in
+        tasks.
+    """
+    src_dir = gallery_conf['src_dir']
+    task_indices = dict(
+        ((_relpath(task.target_dir, src_dir), task.fname), index)
+        for index, task in enumerate(tasks))
+    results = {}
+    for shard_dir in shard_dirs:
+        for example in _read_shard(shard_dir)['examples']:
+            index = task_indices.get((example['gallery_dir'],
+                                      example['fname']))
+            if index is None:
+                logger.warning('%s: %s/%s is not an example of this build, '
+                               'it is not merged', shard_dir,
+                               example['gallery_dir'], example['fname'])
+                continue
+            task = tasks[index]
+            if index in results:
+                logger.warning('%s: %s is in several shards, only the first '
+                               'one is merged', shard_dir, task.src_file)
+                continue
+            if not _is_same_example(shard_dir, example, task, gallery_conf):
+                logger.warning('%s: %s changed since it was executed, it is '
+                               'not merged', shard_dir, task.src_file)
+                continue
+            for name in example['files']:
+                dst = os.path.join(task.target_dir, *name.split('/'))
+                if not os.path.exists(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                with atomic_path(dst) as tmp_fname:
+                    shutil.copyfile(
+                        os.path.join(shard_dir, example['gallery_dir'],
+                                     *name.split('/')), tmp_fname)
+            if example['failure'] is not None:
+                gallery_conf['failing_examples'][task.src_file] = \
+                    example['failure']
+            # With the modification times and sizes of the files of this
+            # build, the names used are the ones found by the shard
+            record = dict(example['record'])
+            backrefs = record.get('backrefs')
+            record.update(record_example(task.src_file, example['intro'],
+                                         record, gallery_conf))
+            record['backrefs'] = backrefs
+            get_manifest(manifests, task.target_dir).update(task.fname,
+                                                            **record)
+            results[index] = (example['intro'], example['time_elapsed'])
+    return results
+
+
+def run_merged(tasks, shard_dirs, gallery_conf, summary, manifests):
+    """Merge exported shards and generate the examples missing from them
+
+    Returns
+    -------
+    results : list of tuple
+        The ``(intro, time_elapsed)`` of each task, in the order of tasks.
+    """
+    merged = merge_shards(shard_dirs, tasks, gallery_conf, manifests)
+    logger.info('merged %d of %d examples from %d shard directories',
+                len(merged), len(tasks), len(shard_dirs))
+    others = [index for index in range(len(tasks)) if index not in merged]
+    other_results = run_examples([tasks[index] for index in others],
+                                 gallery_conf, summary, manifests)
+    merged.update(zip(others, other_results))
+    return [merged[index] for index in range(len(tasks))]
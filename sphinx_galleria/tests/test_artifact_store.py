@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the artifact store of example outputs
+==========================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import io
+import json
+import os
+import shutil
+import zipfile
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.manifest import GalleryManifest
+from sphinx_galleria.artifact_store import (ArtifactStore,
+                                            get_artifact_store,
+                                            get_default_store_dir)
+
+
+def test_get_artifact_store(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.strpath)
+    assert get_default_store_dir() == tmpdir.join('sphinx_galleria').strpath
+    assert get_artifact_store({}) is None
+    assert get_artifact_store({'artifact_store': None}) is None
+    store = get_artifact_store({'artifact_store': True})
+    assert store.store_dir == get_default_store_dir()
+    store = get_artifact_store({'artifact_store': tmpdir.strpath})
+    assert store.store_dir == tmpdir.strpath
+
+
+def test_restore_from_store(tmpdir, fakesphinxapp):
+    """A clean build copies the outputs back instead of running again"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    target_dir = doc.join('auto_examples').strpath
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'],
+                        artifact_store=tmpdir.join('store').strpath)
+    examples.join('data.txt').write('1')
+    examples.join('plot_store.py').write(
+        '"""Title"""\n'
+        'import matplotlib.pyplot as plt\n'
+        'plt.plot([int(open("data.txt").read())])\n'
+        'open("runs.txt", "a").write("x")\n')
+
+    def build():
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(os.path.join(target_dir, 'images', 'thumb'))
+        sg.generate_file_rst('plot_store.py', target_dir, examples.strpath,
+                             gallery_conf)
+        return len(examples.join('runs.txt').read())
+
+    outputs = ['plot_store.rst', 'plot_store.ipynb',
+               'plot_store_codeobj.pickle',
+               'images/sphx_glr_plot_store_001.png',
+               'images/thumb/sphx_glr_plot_store_thumb.png']
+    assert build() == 1
+    assert sorted(sg.example_output_files(target_dir, 'plot_store.py')) == \
+        sorted(outputs)
+    with open(os.path.join(target_dir, 'plot_store.rst')) as fid:
+        rst = fid.read()
+
+    assert build() == 1
+    for name in outputs:
+        assert os.path.isfile(os.path.join(target_dir, name))
+    with open(os.path.join(target_dir, 'plot_store.rst')) as fid:
+        assert fid.read() == rst
+    # The data files read are restored as dependencies of the example
+    assert GalleryManifest(target_dir).get('plot_store.py')[
+        'data_files'] == ['data.txt']
+
+    # Each version of the data has its own outputs
+    examples.join('data.txt').write('2')
+    assert build() == 2
+    examples.join('data.txt').write('1')
+    assert build() == 2
+    store = ArtifactStore(tmpdir.join('store').strpath)
+    assert len([name for name in os.listdir(store.store_dir)
+                if store.has(name)]) == 2
+
+
+def _put_example(store, project, name, size):
+    """Store fake outputs of size bytes for an example of a project"""
+    example = project.join(name)
+    example.write('"""Title"""\n')
+    target_dir = project.join('auto_examples')
+    target_dir.ensure(dir=True)
+    target_dir.join(name + '.rst').write('x' * size)
+    source_key = store.source_key(example.strpath, name)
+    return store.put(source_key, project.strpath, [],
+                     target_dir.strpath, [name + '.rst'],
+                     {'project': project.strpath, 'example': name})
+
+
+def test_pack_without_pickles(tmpdir):
+    """Archives shared with other machines never carry pickled files"""
+    store = ArtifactStore(tmpdir.join('store').strpath)
+    target_dir = tmpdir.mkdir('out')
+    target_dir.join('plot_a.rst').write('rst')
+    target_dir.join('plot_a_codeobj.pickle').write('pickled')
+    key = store.put('source', tmpdir.strpath, [], target_dir.strpath,
+                    ['plot_a.rst', 'plot_a_codeobj.pickle'], {})
+    data = store.pack(key)
+    assert sorted(zipfile.ZipFile(io.BytesIO(data)).namelist()) == [
+        'meta.json', 'plot_a.rst']
+
+    # Nor are they unpacked from the archives of a remote cache
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as fid:
+        fid.writestr('meta.json', json.dumps(
+            {'files': ['plot_a.rst', 'plot_a_codeobj.pickle']}))
+        fid.writestr('plot_a.rst', 'rst')
+        fid.writestr('plot_a_codeobj.pickle', 'evil')
+    other = ArtifactStore(tmpdir.join('other').strpath)
+    other.unpack(key, archive.getvalue())
+    restored = tmpdir.mkdir('restored')
+    assert other.get(key, restored.strpath)['files'] == ['plot_a.rst']
+    assert restored.listdir() == [restored.join('plot_a.rst')]
+
+
+def test_evict_least_recently_used(tmpdir):
+    store = ArtifactStore(tmpdir.join('store').strpath)
+    project = tmpdir.mkdir('doc')
+    keys = [_put_example(store, project, 'plot_%d.py' % ii, 1000)
+            for ii in range(4)]
+    # Using the first entry makes the second the least recently used
+    assert store.get(keys[0], tmpdir.mkdir('out').strpath) is not None
+    entry_size = store.load_index()[keys[0]][1]
+    assert entry_size >= 1000
+
+    source_key = store.source_key(project.join('plot_1.py').strpath,
+                                  'plot_1.py')
+    with store.lock(source_key):
+        assert store.evict(3 * entry_size) == [keys[1]]
+    assert not store.has(keys[1])
+    assert not os.path.exists(store._data_files_fname(source_key))
+    # Lock files are never removed
+    assert os.path.exists(store._lock_fname(source_key))
+    assert store.evict(3 * entry_size) == []
+    assert sorted(store.load_index()) == sorted(
+        [keys[0], keys[2], keys[3]])
+
+    # The index is rebuilt from the entries if it is lost
+    os.remove(os.path.join(store.store_dir, 'index.json'))
+    assert len(store.evict(entry_size)) == 2
+    assert len([name for name in os.listdir(store.store_dir)
+                if store.has(name)]) == 1
+
+
+def test_get_evicted_while_copying(tmpdir, monkeypatch):
+    """An entry evicted by another build while it is copied is missing"""
+    store = ArtifactStore(tmpdir.join('store').strpath)
+    key = _put_example(store, tmpdir.mkdir('doc'), 'plot_a.py', 10)
+    copyfile = shutil.copyfile
+
+    def evict_and_copy(src, dst):
+        store.evict(0)
+        return copyfile(src, dst)
+
+    monkeypatch.setattr(shutil, 'copyfile', evict_and_copy)
+    assert store.get(key, tmpdir.mkdir('out').strpath) is None
+
+
+def test_prune_missing(tmpdir):
+    store = ArtifactStore(tmpdir.join('store').strpath)
+    project = tmpdir.mkdir('doc')
+    other = tmpdir.mkdir('other')
+    kept = _put_example(store, project, 'plot_kept.py', 10)
+    removed = _put_example(store, project, 'plot_removed.py', 10)
+    other_key = _put_example(store, other, 'plot_removed.py', 10)
+    project.join('plot_removed.py').remove()
+    other.join('plot_removed.py').remove()
+
+    assert store.prune_missing(project.strpath) == [removed]
+    assert store.has(kept) and store.has(other_key)
+    assert not store.has(removed)
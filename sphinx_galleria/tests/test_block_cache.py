@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the block-level execution cache
+====================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import copy
+import os
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.block_cache import (BlockCache, cumulative_hashes,
+                                        dump_namespace, load_namespace)
+
+SEPARATOR = '#' * 79
+
+
+def test_cumulative_hashes():
+    hashes = cumulative_hashes(['a = 1\n', 'b = 2\n'])
+    assert len(set(hashes)) == 2
+    assert cumulative_hashes(['a = 1\n', 'b = 3\n'])[0] == hashes[0]
+    assert cumulative_hashes(['a = 0\n', 'b = 2\n'])[1] != hashes[1]
+
+
+def test_namespace_roundtrip():
+    data = dump_namespace({'os': os, 'x': [1, 2], '__builtins__': {}})
+    assert load_namespace(data) == {'os': os, 'x': [1, 2]}
+
+    # Functions defined in examples cannot be pickled
+    ns = {}
+    exec('def f():\n    pass\n', ns)
+    assert dump_namespace(ns) is None
+
+
+@pytest.fixture
+def gallery_conf(tmpdir):
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(examples_dir=tmpdir.mkdir('src').strpath,
+                        gallery_dir=tmpdir.mkdir('out').strpath,
+                        filename_pattern='plot', block_cache=True)
+    gallery_conf['src_dir'] = gallery_conf['gallery_dir']
+    return gallery_conf
+
+
+def _build(gallery_conf, last_block):
+    src_dir = gallery_conf['examples_dir']
+    code = [u'"""Cached blocks"""',
+            u'open("runs.txt", "a").write("x")',
+            u'data = [1, 2, 3]',
+            SEPARATOR, u'# Second block', u'',
+            u'total = sum(data)',
+            SEPARATOR, u'# Last block', u'',
+            last_block, u'']
+    with codecs.open(os.path.join(src_dir, 'plot_blocks.py'), 'w',
+                     encoding='utf-8') as fid:
+        fid.write(u'\n'.join(code))
+    sg.generate_file_rst('plot_blocks.py', gallery_conf['gallery_dir'],
+                         src_dir, gallery_conf)
+    with codecs.open(os.path.join(gallery_conf['gallery_dir'],
+                                  'plot_blocks.rst'),
+                     encoding='utf-8') as fid:
+        rst = fid.read()
+    with open(os.path.join(src_dir, 'runs.txt')) as fid:
+        runs = len(fid.read())
+    return rst, runs
+
+
+def test_resume_from_changed_block(gallery_conf):
+    rst, runs = _build(gallery_conf, 'print(total)')
+    assert runs == 1
+    assert '    6' in rst
+
+    # Only the last block changed, the first one is not run again
+    rst, runs = _build(gallery_conf, 'print(total * 10)')
+    assert runs == 1
+    assert '    60' in rst
+
+    # Without the cache everything runs again
+    gallery_conf['block_cache'] = False
+    rst, runs = _build(gallery_conf, 'print(total * 100)')
+    assert runs == 2
+    assert '    600' in rst
+
+    cache = BlockCache(gallery_conf['gallery_dir'], 'plot_blocks.py',
+                       gallery_conf['src_dir'])
+    assert cache.restore(['unknown']) == ([], None)
+
+
+def test_resumed_running_time(gallery_conf):
+    """The running time of a resumed example includes the cached blocks"""
+    src_dir = gallery_conf['examples_dir']
+    for last_block in ('print(1)', 'print(2)'):
+        with codecs.open(os.path.join(src_dir, 'plot_slow.py'), 'w',
+                         encoding='utf-8') as fid:
+            fid.write(u'\n'.join([u'"""Slow"""', u'import time',
+                                   u'time.sleep(0.2)', SEPARATOR,
+                                   u'# Last block', u'', last_block, u'']))
+        _, time_elapsed = sg.generate_file_rst(
+            'plot_slow.py', gallery_conf['gallery_dir'], src_dir,
+            gallery_conf)
+        assert time_elapsed >= 0.2
+
+
+def test_text_only_change(gallery_conf):
+    """Editing text and comments assembles the rst without running code"""
+    gallery_conf['block_cache'] = False
+    rst, runs = _build(gallery_conf, 'print(total)')
+    assert runs == 1
+
+    rst, runs = _build(gallery_conf, 'print(total)  # Show the total')
+    assert runs == 1
+    assert '    6' in rst
+    assert '# Show the total' in rst
+
+    rst, runs = _build(gallery_conf, 'print(total + 1)')
+    assert runs == 2
+    assert '    7' in rst
+
+
+def test_text_only_change_with_data(gallery_conf):
+    """The data files read on the first run key the saved snapshots"""
+    gallery_conf['block_cache'] = False
+    src_dir = gallery_conf['examples_dir']
+    with open(os.path.join(src_dir, 'data.txt'), 'w') as fid:
+        fid.write('6')
+    rst, runs = _build(gallery_conf, 'print(open("data.txt").read())')
+    assert runs == 1
+
+    rst, runs = _build(gallery_conf,
+                       'print(open("data.txt").read())  # The data')
+    assert runs == 1
+    assert '# The data' in rst
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the detection of example dependencies
+==========================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import os
+import sys
+import threading
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import dependencies, gen_gallery
+from sphinx_galleria.dependencies import (find_local_imports,
+                                          record_opened_files)
+from sphinx_galleria.manifest import GalleryManifest
+
+
+def test_find_local_imports(tmpdir, monkeypatch):
+    examples = tmpdir.mkdir('examples')
+    examples.join('plot_a.py').write('"""Title"""\n'
+                                     'import os\n'
+                                     'import numpy as np\n'
+                                     'import helper\n'
+                                     'from pkg import sub\n'
+                                     'from mylib import func\n')
+    examples.join('helper.py').write('import helper2\n')
+    examples.join('helper2.py').write('x = 1\n')
+    examples.join('unused.py').write('x = 1\n')
+    examples.mkdir('pkg').join('__init__.py').write('')
+    examples.join('pkg', 'sub.py').write('')
+    lib = tmpdir.mkdir('lib').mkdir('mylib')
+    lib.join('__init__.py').write('from . import core\n')
+    lib.join('core.py').write('from .utils import func\n')
+    lib.join('utils.py').write('from .. import other\n')
+    lib.join('other.py').write('')
+    monkeypatch.setattr(sys, 'path', sys.path + [tmpdir.join('lib').strpath])
+
+    src_file = examples.join('plot_a.py').strpath
+    deps = find_local_imports(src_file, {'doc_module': ()})
+    assert deps == sorted(examples.join(name).strpath for name in
+                          ['helper.py', 'helper2.py', 'pkg/__init__.py',
+                           'pkg/sub.py'])
+
+    # Modules of the documented package count as local too
+    deps = find_local_imports(src_file, {'doc_module': ('mylib',)})
+    assert lib.join('core.py').strpath in deps
+    assert lib.join('utils.py').strpath in deps
+    assert lib.join('__init__.py').strpath in deps
+    assert lib.join('other.py').strpath not in deps
+
+    # Editing a helper invalidates the checksum of the example
+    md5 = sg.get_example_md5sum(src_file, deps)
+    assert md5 != sg.hash_file(src_file)
+    assert sg.get_example_md5sum(src_file) == sg.hash_file(src_file)
+    examples.join('helper2.py').write('x = 2\n')
+    assert sg.get_example_md5sum(src_file, deps) != md5
+    record = {'md5': sg.get_example_md5sum(src_file, deps)}
+    assert sg.example_md5_is_current(src_file, record, deps)
+    assert not sg.example_md5_is_current(src_file, record, [])
+
+
+def test_find_local_imports_cached(tmpdir, monkeypatch):
+    """Modules are parsed again only when they or their directory change"""
+    examples = tmpdir.mkdir('examples')
+    src_file = examples.join('plot_a.py')
+    src_file.write('"""Title"""\nimport helper\n')
+    examples.join('helper.py').write('x = 1\n')
+    parsed = []
+    parse_source_file = dependencies.parse_source_file
+
+    def parse(filename):
+        parsed.append(os.path.basename(filename))
+        return parse_source_file(filename)
+
+    monkeypatch.setattr(dependencies, 'parse_source_file', parse)
+    deps = find_local_imports(src_file.strpath, {})
+    assert deps == [examples.join('helper.py').strpath]
+    assert sorted(parsed) == ['helper.py', 'plot_a.py']
+    assert find_local_imports(src_file.strpath, {}) == deps
+    assert len(parsed) == 2
+
+    # A new import of a new module
+    examples.join('helper.py').write('import helper2  # new\n')
+    examples.join('helper2.py').write('x = 2\n')
+    assert find_local_imports(src_file.strpath, {}) == [
+        examples.join(name).strpath for name in ('helper.py', 'helper2.py')]
+    # The example itself is unchanged
+    assert parsed.count('plot_a.py') == 1
+
+
+@pytest.mark.skipif(not hasattr(sys, 'addaudithook'),
+                    reason='recording opened files needs Python 3.8')
+def test_data_dependencies(tmpdir, fakesphinxapp):
+    """Examples run again when a data file they read changes"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    target_dir = doc.mkdir('auto_examples').strpath
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'])
+    doc.mkdir('data').join('values.txt').write('1 2 3')
+    examples.join('plot_data.py').write(
+        '"""Title"""\n'
+        'import os\n'
+        'if os.path.exists("../data/values.txt"):\n'
+        '    values = open("../data/values.txt").read()\n'
+        'open("runs.txt", "a").write("x")\n'
+        'with open(os.path.join("..", "auto_examples", "out.txt"), "w"):\n'
+        '    pass\n')
+
+    def runs():
+        return len(examples.join('runs.txt').read())
+
+    sg.generate_file_rst('plot_data.py', target_dir, examples.strpath,
+                         gallery_conf)
+    assert runs() == 1
+    # Only the data read are recorded, not the files written
+    record = GalleryManifest(target_dir).get('plot_data.py')
+    assert record['data_files'] == ['../data/values.txt']
+
+    sg.generate_file_rst('plot_data.py', target_dir, examples.strpath,
+                         gallery_conf)
+    assert runs() == 1
+    doc.join('data', 'values.txt').write('4 5 6')
+    sg.generate_file_rst('plot_data.py', target_dir, examples.strpath,
+                         gallery_conf)
+    assert runs() == 2
+    # Removing a recorded input counts as a change too
+    doc.join('data', 'values.txt').remove()
+    sg.generate_file_rst('plot_data.py', target_dir, examples.strpath,
+                         gallery_conf)
+    assert runs() == 3
+
+
+@pytest.mark.skipif(not hasattr(sys, 'addaudithook'),
+                    reason='recording opened files needs Python 3.8')
+def test_record_opened_files_thread(tmpdir):
+    """Files opened by other threads are not data files of the example"""
+    for name in ('mine.txt', 'other.txt'):
+        tmpdir.join(name).write(name)
+    opened_files = set()
+    with record_opened_files(opened_files):
+        thread = threading.Thread(
+            target=lambda: open(tmpdir.join('other.txt').strpath).close())
+        thread.start()
+        thread.join()
+        open(tmpdir.join('mine.txt').strpath).close()
+    assert opened_files == set([tmpdir.join('mine.txt').strpath])
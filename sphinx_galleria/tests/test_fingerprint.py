@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the configuration and environment fingerprints
+===================================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import os
+
+import numpy as np
+from PIL import Image
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import fingerprint, gen_gallery
+from sphinx_galleria.fingerprint import (conf_fingerprint,
+                                         find_imported_packages,
+                                         get_package_versions)
+
+
+def test_conf_fingerprint():
+    conf = {'thumbnail_size': (400, 280), 'line_numbers': False}
+    reference = conf_fingerprint(conf, ['thumbnail_size'])
+    assert conf_fingerprint(dict(conf, line_numbers=True),
+                            ['thumbnail_size']) == reference
+    assert conf_fingerprint(dict(conf, thumbnail_size=(200, 140)),
+                            ['thumbnail_size']) != reference
+
+
+def test_package_versions(tmpdir):
+    tmpdir.join('plot_a.py').write('import os\nimport numpy as np\n'
+                                   'from matplotlib import pyplot\n'
+                                   'import helper\n')
+    tmpdir.join('helper.py').write('import PIL.Image\n')
+    files = [tmpdir.join('plot_a.py').strpath, tmpdir.join('helper.py').strpath]
+    names = find_imported_packages(files)
+    assert names == ['PIL', 'matplotlib', 'numpy', 'os']
+    versions = get_package_versions(names)
+    assert versions['numpy'] == np.__version__
+    assert 'os' not in versions
+
+
+def test_warm_version_cache(monkeypatch):
+    """Workers reuse the versions looked up by the main process"""
+    get_package_versions(['numpy'])
+    cache = fingerprint.get_version_cache()
+    assert cache[0]['numpy'] == np.__version__
+    monkeypatch.setattr(fingerprint, '_package_versions', {})
+    monkeypatch.setattr(fingerprint, '_packages_distributions', None)
+    fingerprint.warm_version_cache(cache)
+    monkeypatch.setattr(fingerprint, '_find_version', None)
+    assert get_package_versions(['numpy']) == {'numpy': np.__version__}
+    assert fingerprint._packages_distributions is cache[1]
+
+
+def test_invalidate_affected_outputs(tmpdir, fakesphinxapp, monkeypatch):
+    """Each kind of change only generates again the outputs it affects"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    examples.join('README.txt').write('Gallery\n=======\n')
+    examples.join('plot_conf.py').write(
+        '"""Title"""\n'
+        'import numpy as np\n'
+        'import matplotlib.pyplot as plt\n'
+        'plt.plot(np.arange(3))\n'
+        'open("runs.txt", "a").write("x")\n')
+    target_dir = doc.join('auto_examples').strpath
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot')
+    thumb = os.path.join(target_dir, 'images', 'thumb',
+                         'sphx_glr_plot_conf_thumb.png')
+
+    def build():
+        sg.generate_dir_rst(examples.strpath, target_dir, gallery_conf,
+                            set())
+        with open(os.path.join(target_dir, 'plot_conf.rst')) as fid:
+            rst = fid.read()
+        return len(examples.join('runs.txt').read()), rst
+
+    runs, rst = build()
+    assert runs == 1
+    assert Image.open(thumb).size == (400, 280)
+
+    # Thumbnails are made again, the rst is not written again
+    rst_mtime = os.path.getmtime(os.path.join(target_dir, 'plot_conf.rst'))
+    gallery_conf['thumbnail_size'] = (200, 140)
+    assert build() == (1, rst)
+    assert Image.open(thumb).size == (200, 140)
+    assert os.path.getmtime(
+        os.path.join(target_dir, 'plot_conf.rst')) == rst_mtime
+
+    # The rst is written again around the previous outputs
+    gallery_conf['line_numbers'] = True
+    runs, rst = build()
+    assert runs == 1
+    assert ':lineno-start:' in rst
+
+    # A new version of an imported package runs the example again
+    monkeypatch.setitem(fingerprint._package_versions, 'numpy', '0.0.1')
+    runs, _ = build()
+    assert runs == 2
+    runs, _ = build()
+    assert runs == 2
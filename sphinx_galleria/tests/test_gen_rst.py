@@ -163,18 +163,16 @@ def test_md5sums():
     with tempfile.NamedTemporaryFile('wb', delete=False) as f:
         f.write(b'Local test\n')
     try:
-        file_md5 = sg.get_md5sum(f.name)
+        file_md5 = sg.get_example_md5sum(f.name, algorithm='md5')
         # verify correct md5sum
         assert 'ea8a570e9f3afc0a7c3f2a17a48b8047' == file_md5
         # False because is a new file
-        assert not sg.md5sum_is_current(f.name)
-        # Write md5sum to file to check is current
-        with open(f.name + '.md5', 'w') as file_checksum:
-            file_checksum.write(file_md5)
-        try:
-            assert sg.md5sum_is_current(f.name)
-        finally:
-            os.remove(f.name + '.md5')
+        assert not sg.example_md5_is_current(f.name, {}, [],
+                                          algorithm='md5')
+        # Record the md5sum in the manifest to check is current
+        record = {'md5': file_md5}
+        assert sg.example_md5_is_current(f.name, record, [],
+                                         algorithm='md5')
     finally:
         os.remove(f.name)
 
@@ -262,6 +260,61 @@ def test_pattern_matching(gallery_conf, log_collector):
             assert code_output not in rst
 
 
+def test_draft(gallery_conf):
+    """Test draft builds: low resolution figures and no notebooks"""
+    from PIL import Image
+    with codecs.open(os.path.join(gallery_conf['examples_dir'], 'plot_0.py'),
+                     mode='w', encoding='utf-8') as f:
+        f.write('"""Draft"""\nimport matplotlib.pyplot as plt\n'
+                'plt.plot([1, 2])\nopen("runs.txt", "a").write("0")\n')
+    with codecs.open(os.path.join(gallery_conf['examples_dir'], 'plot_1.py'),
+                     mode='w', encoding='utf-8') as f:
+        f.write('"""No figure"""\nopen("runs.txt", "a").write("1")\n')
+    runs = os.path.join(gallery_conf['examples_dir'], 'runs.txt')
+    gallery_dir = gallery_conf['gallery_dir']
+    figure = os.path.join(gallery_dir, 'images', 'sphx_glr_plot_0_001.png')
+    thumb = os.path.join(gallery_dir, 'images', 'thumb',
+                         'sphx_glr_plot_0_thumb.png')
+    notebook = os.path.join(gallery_dir, 'plot_0.ipynb')
+
+    gallery_conf.update(draft=True)
+    sg.generate_file_rst('plot_0.py', gallery_dir,
+                         gallery_conf['examples_dir'], gallery_conf)
+    assert Image.open(figure).size == (320, 240)
+    # Not scaled
+    assert Image.open(thumb).size == (320, 240)
+    assert not os.path.exists(notebook)
+    with codecs.open(os.path.join(gallery_dir, 'plot_0.rst'), mode='r',
+                     encoding='utf-8') as f:
+        rst = f.read()
+    assert 'Download Python source code: plot_0.py' in rst
+    assert 'ipynb' not in rst
+
+    gallery_conf.update(draft=False)
+    for fname in ['plot_0.py', 'plot_1.py']:
+        sg.generate_file_rst(fname, gallery_dir,
+                             gallery_conf['examples_dir'], gallery_conf)
+    assert Image.open(figure).size == (640, 480)
+    assert Image.open(thumb).size == tuple(gallery_conf['thumbnail_size'])
+    assert os.path.exists(notebook)
+
+    # Only the examples with draft figures are executed again, the other
+    # outputs are written again around the outputs of the code blocks
+    gallery_conf.update(draft=True)
+    for fname in ['plot_0.py', 'plot_1.py']:
+        sg.generate_file_rst(fname, gallery_dir,
+                             gallery_conf['examples_dir'], gallery_conf)
+    gallery_conf.update(draft=False)
+    sg.generate_file_rst('plot_1.py', gallery_dir,
+                         gallery_conf['examples_dir'], gallery_conf)
+    with open(runs) as f:
+        assert f.read() == '001'
+    assert Image.open(figure).size == (640, 480)
+    with codecs.open(os.path.join(gallery_dir, 'plot_1.rst'), mode='r',
+                     encoding='utf-8') as f:
+        assert 'ipynb' in f.read()
+
+
 @pytest.mark.parametrize('test_str', [
     '# sphinx_galleria_thumbnail_number= 2',
     '# sphinx_galleria_thumbnail_number=2',
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the hashes of the example files
+====================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import hashlib
+import os
+
+import pytest
+
+from sphinx_galleria import hashing
+from sphinx_galleria.hashing import file_stat, get_hasher, hash_file
+
+
+def test_get_hasher():
+    assert get_hasher().name == get_hasher('blake2b').name
+    assert get_hasher('md5').name == 'md5'
+    with pytest.raises(ValueError):
+        get_hasher('sha0')
+
+
+def test_xxhash():
+    pytest.importorskip('xxhash')
+    assert len(get_hasher('xxhash').hexdigest()) >= 16
+
+
+def test_hash_file(tmpdir, monkeypatch):
+    fname = tmpdir.join('data.txt')
+    fname.write('123')
+    path = fname.strpath
+    assert hash_file(tmpdir.join('missing.txt').strpath) is None
+    assert hash_file(path, 'md5') == hashlib.md5(b'123').hexdigest()
+    assert hash_file(path) != hash_file(path, 'md5')
+
+    # A file modified less than 2 seconds ago is always read, its
+    # modification time may not change when it is written again
+    known = {}
+    digest = hash_file(path, known=known)
+    assert known == {}
+
+    # Older files with the recorded modification time and size are not read
+    old = 1000000000
+    os.utime(path, (old, old))
+    stat = file_stat(path)
+    assert stat == [old * 10 ** 9, 3]
+    monkeypatch.setattr(hashing, '_file_hashes', {})
+    known = {path: stat + ['recorded']}
+    assert hash_file(path, known=known) == 'recorded'
+    # Nor with the hashes of the process
+    assert hash_file(path) == digest
+    assert hashing._file_hashes['blake2b'][path] == stat + [digest]
+    fname.write('456')
+    os.utime(path, (old, old))
+    assert hash_file(path) == digest
+    os.utime(path, (old + 1, old + 1))
+    assert hash_file(path) != digest
+    assert hash_file(path, known=known) != 'recorded'
+    assert known[path][:2] == file_stat(path)
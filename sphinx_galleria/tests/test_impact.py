@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the impact analysis of library changes
+===========================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import json
+import sys
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.impact import (IMPACT_FNAME, affected_examples,
+                                    get_module_files, save_impact)
+from sphinx_galleria.manifest import get_manifest
+from sphinx_galleria.parallel import ExampleTask
+
+
+def test_impact_analysis(tmpdir, monkeypatch):
+    lib = tmpdir.mkdir('ourlib')
+    lib.join('__init__.py').write('from .ridge import Ridge\n')
+    lib.join('ridge.py').write('from ._base import check\n\n\n'
+                               'class Ridge(object):\n    pass\n')
+    lib.join('_base.py').write('from ourlib import _validation\n\n\n'
+                               'def check():\n    pass\n')
+    lib.join('_validation.py').write('import os\n')
+    lib.join('lasso.py').write('def lasso():\n    pass\n')
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    for name in list(sys.modules):
+        if name.split('.')[0] == 'ourlib':
+            monkeypatch.delitem(sys.modules, name)
+
+    # With the modules of the package they import, without its __init__.py
+    assert get_module_files(['ourlib.Ridge', 'ourlib.lasso.lasso',
+                             'ourlib.unknown', 'missing.name']) == [
+        lib.join(fname).strpath for fname in
+        ('_base.py', '_validation.py', 'lasso.py', 'ridge.py')]
+
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    examples.join('plot_ridge.py').write(
+        '"""Ridge"""\nimport ourlib\nourlib.Ridge()\n'
+        'open("runs.txt", "a").write("ridge ")\n')
+    examples.join('plot_lasso.py').write(
+        '"""Lasso"""\nfrom ourlib.lasso import lasso\nlasso()\n'
+        'open("runs.txt", "a").write("lasso ")\n')
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'], doc_module=('ourlib',),
+                        impact_analysis=True)
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in ('plot_lasso.py', 'plot_ridge.py')]
+    sg.run_examples(tasks, gallery_conf, 'impact ')
+    assert sorted(examples.join('runs.txt').read().split()) == [
+        'lasso', 'ridge']
+    examples.join('runs.txt').remove()
+
+    # Only the example using the module changed is executed again
+    lib.join('ridge.py').write('from ._base import check\n\n\n'
+                               'class Ridge(object):\n    alpha = 1\n')
+    sg.run_examples(tasks, gallery_conf, 'impact ')
+    assert examples.join('runs.txt').read().split() == ['ridge']
+    examples.join('runs.txt').remove()
+
+    # Helpers imported indirectly by the module too
+    lib.join('_validation.py').write('import sys\n')
+    manifests = {}
+    sg.run_examples(tasks, gallery_conf, 'impact ', manifests)
+    assert examples.join('runs.txt').read().split() == ['ridge']
+
+    save_impact(tasks, manifests, doc.strpath)
+    impact = json.loads(doc.join(IMPACT_FNAME).read())
+    assert impact['../ourlib/ridge.py'] == ['examples/plot_ridge.py']
+    assert impact['../ourlib/_base.py'] == ['examples/plot_ridge.py']
+    assert impact['../ourlib/lasso.py'] == ['examples/plot_lasso.py']
+    assert affected_examples(doc.strpath, [lib.join('lasso.py').strpath,
+                                           lib.join('other.py').strpath]) \
+        == ['examples/plot_lasso.py']
+    assert get_manifest(manifests, target_dir.strpath).get(
+        'plot_ridge.py')['packages'] == []
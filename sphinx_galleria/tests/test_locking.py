@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the safety of concurrent builds
+====================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import multiprocessing
+import time
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.locking import FileLock, atomic_write, path_lock
+
+
+def test_atomic_write(tmpdir):
+    fname = tmpdir.join('out.txt')
+    fname.write('old')
+    with pytest.raises(RuntimeError):
+        with atomic_write(fname.strpath) as fid:
+            fid.write('partial')
+            raise RuntimeError
+    # The file is untouched and no temporary file is left
+    assert fname.read() == 'old'
+    assert tmpdir.listdir() == [fname]
+    with atomic_write(fname.strpath, encoding='utf-8') as fid:
+        fid.write(u'new')
+        assert fname.read() == 'old'
+    assert fname.read() == 'new'
+    assert tmpdir.listdir() == [fname]
+
+
+def _hold_lock(fname, started):
+    with FileLock(fname):
+        started.set()
+        time.sleep(0.5)
+
+
+def test_file_lock(tmpdir):
+    fname = tmpdir.join('locks', 'example.lock').strpath
+    started = multiprocessing.Event()
+    process = multiprocessing.Process(target=_hold_lock,
+                                      args=(fname, started))
+    process.start()
+    try:
+        assert started.wait(10)
+        t0 = time.time()
+        with FileLock(fname):
+            # Only taken once the other process released it
+            assert time.time() - t0 > 0.2
+    finally:
+        process.join()
+
+
+def _build(fname, target_dir, src_dir, gallery_conf):
+    sg.generate_file_rst(fname, target_dir, src_dir, gallery_conf)
+
+
+def test_path_lock(tmpdir):
+    target_dir = tmpdir.mkdir('auto_examples')
+    link = tmpdir.join('link')
+    link.mksymlinkto(target_dir)
+    lock = path_lock(target_dir.join('plot_a.py').strpath)
+    assert lock.fname == path_lock(link.join('plot_a.py').strpath).fname
+    assert lock.fname != path_lock(target_dir.join('plot_b.py').strpath).fname
+    assert not lock.fname.startswith(tmpdir.strpath)
+
+
+def test_concurrent_builds(tmpdir):
+    """Builds sharing a gallery directory execute an example once"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'])
+    examples.join('plot_shared.py').write(
+        '"""Title"""\n'
+        'import time\n'
+        'open("runs.txt", "a").write("x")\n'
+        'time.sleep(0.5)\n')
+
+    processes = [multiprocessing.Process(
+        target=_build, args=('plot_shared.py', target_dir.strpath,
+                             examples.strpath, gallery_conf))
+        for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    assert examples.join('runs.txt').read() == 'x'
+    assert 'Title' in target_dir.join('plot_shared.rst').read()
+    # The lock files are not left in the gallery directory
+    assert not target_dir.listdir(lambda path: path.ext == '.lock')
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the gallery manifest
+=========================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import os
+import time
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import backreferences, gen_gallery
+from sphinx_galleria.manifest import (GalleryManifest, MANIFEST_FNAME,
+                                      log_record)
+
+
+def test_manifest_roundtrip(tmpdir):
+    target_dir = tmpdir.join('gallery').strpath
+    manifest = GalleryManifest(target_dir)
+    assert manifest.get('plot_a.py') == {}
+    manifest.update('plot_a.py', runtime=1.5)
+    manifest.update('plot_a.py', status='ok')
+    manifest.save()
+    assert os.path.isfile(os.path.join(target_dir, MANIFEST_FNAME))
+
+    manifest = GalleryManifest(target_dir)
+    assert manifest.get('plot_a.py') == {'runtime': 1.5, 'status': 'ok'}
+
+    # A corrupted manifest is ignored
+    tmpdir.join('gallery', MANIFEST_FNAME).write('{not json')
+    assert GalleryManifest(target_dir).entries == {}
+
+
+def test_manifest_log(tmpdir):
+    """Records logged by workers are merged when the manifest is saved"""
+    target_dir = tmpdir.mkdir('gallery').strpath
+    manifest = GalleryManifest(target_dir)
+    manifest.update('plot_a.py', runtime=1.5)
+    log_record(target_dir, 'plot_a.py', md5='abc')
+    log_record(target_dir, 'plot_b.py', md5='def')
+    assert manifest.get('plot_a.py') == {'runtime': 1.5}
+    manifest.refresh()
+    assert manifest.get('plot_a.py') == {'runtime': 1.5, 'md5': 'abc'}
+    # Lines already applied are not applied again
+    manifest.update('plot_b.py', md5=None)
+    log_record(target_dir, 'plot_c.py', md5='ghi')
+    # A line being written is left for later
+    with open(os.path.join(target_dir, MANIFEST_FNAME + '.log'), 'a') as fid:
+        fid.write('["plot_d.py", {"md5"')
+    manifest.refresh()
+    assert manifest.get('plot_b.py') == {'md5': None}
+    assert manifest.get('plot_c.py') == {'md5': 'ghi'}
+    assert manifest.get('plot_d.py') == {}
+
+    manifest.save()
+    assert os.listdir(target_dir) == [MANIFEST_FNAME]
+    assert GalleryManifest(target_dir).entries == manifest.entries
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError('unchanged examples must not be read')
+
+
+def test_unchanged_fast_path(tmpdir, fakesphinxapp, monkeypatch):
+    """A rebuild without changes does not read the examples"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    examples.join('README.txt').write('Gallery\n=======\n')
+    examples.join('shared.py').write('VALUE = 1\n')
+    for index in range(100):
+        examples.join('plot_%03d.py' % index).write(
+            '"""Example {0}"""\nimport os\nos.getcwd()\n'
+            .format(index))
+    examples.join('plot_shared.py').write(
+        '"""Helper example"""\nimport shared\n'
+        'open("runs.txt", "a").write("x")\n')
+    monkeypatch.syspath_prepend(examples.strpath)
+    doc.mkdir('gen_modules')
+    target_dir = doc.join('auto_examples').strpath
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        backreferences_dir='gen_modules', doc_module='os',
+                        ignore_pattern=r'[\\/]shared\.py')
+
+    def build():
+        return sg.generate_dir_rst(examples.strpath, target_dir,
+                                   gallery_conf, set())
+
+    fhindex, _ = build()
+    record = GalleryManifest(target_dir).get('plot_000.py')
+    assert record['intro'] == record['title'] == 'Example 0'
+    assert record['status'] == 'ok'
+    assert record['data_files'] == []
+    src_file = examples.join('plot_000.py').strpath
+    assert record['md5'] == sg.get_example_md5sum(
+        src_file, sg.find_local_imports(src_file, gallery_conf),
+        record['fingerprint'])
+    # A single manifest, no file per example besides its outputs
+    assert not [fname for fname in os.listdir(target_dir)
+                if fname.endswith(('.md5', '.deps', '.log'))]
+    assert record['backrefs'] == ["os.getcwd"]
+    assert GalleryManifest(target_dir).get('plot_shared.py')[
+        'dependencies'] == {'shared.py': sg.file_stat(
+            examples.join('shared.py').strpath)}
+
+    generate_file_rst = sg.generate_file_rst
+    split_blocks = sg.split_code_and_text_blocks
+    scan = backreferences.scan_used_functions
+    monkeypatch.setattr(sg, 'generate_file_rst', _fail)
+    monkeypatch.setattr(sg, 'split_code_and_text_blocks', _fail)
+    monkeypatch.setattr(backreferences, 'scan_used_functions', _fail)
+    start = time.time()
+    assert build()[0] == fhindex
+    assert time.time() - start < 1
+    assert doc.join('gen_modules', 'os.getcwd.examples').check()
+    monkeypatch.setattr(sg, 'generate_file_rst', generate_file_rst)
+    monkeypatch.setattr(sg, 'split_code_and_text_blocks', split_blocks)
+    monkeypatch.setattr(backreferences, 'scan_used_functions', scan)
+
+    # Changing a dependency runs its examples again, and only them
+    examples.join('shared.py').write('VALUE = 22\n')
+    build()
+    assert examples.join('runs.txt').read() == 'xx'
+
+
+def test_manifest_loaded_once(tmpdir, fakesphinxapp, monkeypatch):
+    """Examples generated again read the manifest loaded by the build"""
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    examples.join('README.txt').write('Gallery\n=======\n')
+    for index in range(5):
+        examples.join('plot_%d.py' % index).write(
+            '"""Example {0}"""\nopen("runs.txt", "a").write("x")\n'
+            .format(index))
+    target_dir = doc.join('auto_examples').strpath
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot')
+    sg.generate_dir_rst(examples.strpath, target_dir, gallery_conf, set())
+    assert examples.join('runs.txt').read() == 'xxxxx'
+
+    loaded = []
+    init = GalleryManifest.__init__
+
+    def counting_init(self, target_dir):
+        loaded.append(target_dir)
+        init(self, target_dir)
+
+    monkeypatch.setattr(GalleryManifest, '__init__', counting_init)
+    # Touched examples are generated again, their checksum is unchanged
+    for index in range(5):
+        path = examples.join('plot_%d.py' % index)
+        path.write(path.read())
+        os.utime(path.strpath, (1, 1))
+    sg.generate_dir_rst(examples.strpath, target_dir, gallery_conf, set())
+    assert loaded == [target_dir]
+    assert examples.join('runs.txt').read() == 'xxxxx'
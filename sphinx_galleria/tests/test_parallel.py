@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the parallel execution of examples
+=======================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import codecs
+import copy
+import os
+import sys
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery, parallel
+from sphinx_galleria.manifest import GalleryManifest
+
+needs_py3 = pytest.mark.skipif(sys.version_info < (3, 4),
+                               reason='parallel execution needs Python 3')
+
+
+def _write_example(src_dir, fname, code):
+    """Write a minimal example with a one line docstring"""
+    with codecs.open(os.path.join(src_dir, fname), 'w',
+                     encoding='utf-8') as fid:
+        fid.write(u'"""{0} title"""\n{1}\n'.format(fname[:-3], code))
+
+
+@pytest.fixture
+def gallery_conf(tmpdir):
+    # Plain strings, the configuration is pickled to start the workers
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(examples_dir=tmpdir.mkdir('src').strpath,
+                        gallery_dir=tmpdir.mkdir('out').strpath,
+                        filename_pattern='plot')
+    gallery_conf['src_dir'] = gallery_conf['gallery_dir']
+    return gallery_conf
+
+
+class _Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _gallery_app(tmpdir, **conf):
+    """Minimal application to run generate_gallery_rst on two galleries"""
+    srcdir = tmpdir.mkdir('doc').strpath
+    for gallery in ['examples', 'tutorials']:
+        for sub_dir in ['', 'sub']:
+            src_dir = os.path.join(srcdir, gallery, sub_dir)
+            if not os.path.exists(src_dir):
+                os.makedirs(src_dir)
+            with codecs.open(os.path.join(src_dir, 'README.txt'), 'w',
+                             encoding='utf-8') as fid:
+                fid.write(u'{0}\n====\n'.format(gallery))
+            _write_example(src_dir, 'plot_%s%s.py' % (gallery, sub_dir),
+                           'print(1)')
+    conf.setdefault('examples_dirs', ['examples', 'tutorials'])
+    conf.setdefault('gallery_dirs', [os.path.join(srcdir, 'auto_examples'),
+                                     os.path.join(srcdir, 'auto_tutorials')])
+    config = _Namespace(plot_gallery='True', abort_on_example_error=False,
+                        draft=conf.get('draft', False),
+                        sphinx_galleria_conf=conf, html_static_path=[])
+    builder = _Namespace(srcdir=srcdir, outdir=tmpdir.mkdir('build').strpath,
+                         config=config)
+    return _Namespace(builder=builder, config=config, srcdir=srcdir)
+
+
+def test_get_n_jobs():
+    n_cpu = parallel.multiprocessing.cpu_count()
+    assert parallel.get_n_jobs({}) == 1
+    assert parallel.get_n_jobs({'parallel': False}) == 1
+    assert parallel.get_n_jobs({'parallel': 3}) == 3
+    assert parallel.get_n_jobs({'parallel': True}) == n_cpu
+    assert parallel.get_n_jobs({'parallel': -1}) == n_cpu
+    assert parallel.get_n_jobs({'parallel': -n_cpu - 5}) == 1
+
+
+@needs_py3
+def test_forkserver_preload(monkeypatch):
+    """Workers are forked from a server with the preloaded modules"""
+    if 'forkserver' not in parallel.multiprocessing.get_all_start_methods():
+        raise pytest.skip('forkserver start method not available')
+    preloads = []
+    ctx = parallel.multiprocessing.get_context('forkserver')
+    monkeypatch.setattr(type(ctx), 'set_forkserver_preload',
+                        lambda self, modules: preloads.append(modules))
+    ctx = parallel._get_context({'preload_modules': ['numpy']})
+    assert ctx.get_start_method() == 'forkserver'
+    assert preloads == [['sphinx_galleria.gen_rst',
+                         'sphinx_galleria.parallel', 'numpy']]
+
+
+@needs_py3
+def test_parallel_gen_dir_rst(gallery_conf, fakesphinxapp):
+    """Examples run in workers are assembled in the sorted order"""
+    src_dir = gallery_conf['examples_dir']
+    with codecs.open(os.path.join(src_dir, 'README.txt'), 'w',
+                     encoding='utf-8') as fid:
+        fid.write(u'Gallery\n=======\n')
+    _write_example(src_dir, 'plot_a.py', 'import sys\nsys.argv.append("x")')
+    _write_example(src_dir, 'plot_b.py', 'import time\ntime.sleep(0.5)\n' +
+                   'print(1)\n' * 20)
+    _write_example(src_dir, 'plot_fail.py', 'raise ValueError("boom")')
+    gallery_conf['parallel'] = 3
+    argv = sys.argv[:]
+
+    fhindex, times = sg.generate_dir_rst(src_dir, gallery_conf['gallery_dir'],
+                                         gallery_conf, set())
+
+    sorted_fnames = ['plot_fail.py', 'plot_a.py', 'plot_b.py']
+    assert [fname for _, fname in times] == sorted_fnames
+    positions = [fhindex.index('sphx_glr_%s_thumb.png' % fname[:-3])
+                 for fname in sorted_fnames]
+    assert positions == sorted(positions)
+    # Failures in the workers are reported back, state does not leak
+    failing = os.path.normpath(os.path.join(src_dir, 'plot_fail.py'))
+    assert list(gallery_conf['failing_examples']) == [failing]
+    assert 'boom' in gallery_conf['failing_examples'][failing]
+    assert sys.argv == argv
+    for fname in sorted_fnames:
+        assert os.path.isfile(os.path.join(gallery_conf['gallery_dir'],
+                                           fname[:-3] + '.rst'))
+    # Running times are kept for the scheduling of the next builds
+    manifest = GalleryManifest(gallery_conf['gallery_dir'])
+    assert manifest.get('plot_b.py')['runtime'] >= 0.5
+
+
+@needs_py3
+def test_workers_reused(gallery_conf, fakesphinxapp, tmpdir, monkeypatch):
+    """Workers execute several examples and import the preloaded modules
+    found along the sys.path of the build"""
+    src_dir = gallery_conf['examples_dir']
+    tmpdir.mkdir('modules').join('galleria_preloaded.py').write('x = 1\n')
+    monkeypatch.syspath_prepend(tmpdir.join('modules').strpath)
+    warnings = []
+    monkeypatch.setattr(parallel.logger, 'warning',
+                        lambda msg, *args: warnings.append(msg % args))
+    for index in range(6):
+        _write_example(src_dir, 'plot_%d.py' % index,
+                       'import os, sys\n'
+                       'with open("pids.txt", "a") as fid:\n'
+                       '    fid.write("%d %d\\n" % (os.getpid(), '
+                       '"galleria_preloaded" in sys.modules))')
+    gallery_conf.update(parallel=2, preload_modules=[
+        'galleria_preloaded', 'galleria_not_a_module'])
+    tasks = [parallel.ExampleTask('plot_%d.py' % index,
+                                  gallery_conf['gallery_dir'], src_dir)
+             for index in range(6)]
+
+    results = dict(parallel.execute_examples(tasks, gallery_conf,
+                                             sg.generate_file_rst))
+
+    assert sorted(results) == list(range(6))
+    with open(os.path.join(src_dir, 'pids.txt')) as fid:
+        runs = [line.split() for line in fid]
+    assert len(runs) == 6
+    assert len(set(pid for pid, _ in runs)) <= 2
+    assert all(preloaded == '1' for _, preloaded in runs)
+    assert len(warnings) == 1
+    assert 'galleria_not_a_module' in warnings[0]
+
+
+def test_lpt_scheduling(gallery_conf):
+    """Slowest examples are scheduled first, with code size as fallback"""
+    src_dir, target_dir = (gallery_conf['examples_dir'],
+                           gallery_conf['gallery_dir'])
+    _write_example(src_dir, 'plot_short.py', 'a = 1')
+    _write_example(src_dir, 'plot_long.py', 'a = 1\n' * 10)
+    _write_example(src_dir, 'plot_new.py', 'a = 1\n' * 10)
+    tasks = [parallel.ExampleTask(fname, target_dir, src_dir)
+             for fname in ['plot_short.py', 'plot_long.py', 'plot_new.py']]
+
+    # Without history the amount of code decides
+    estimates = parallel.estimate_runtimes(tasks)
+    assert estimates[1] == estimates[2] > 5 * estimates[0] > 0
+    assert parallel.lpt_order(estimates) == [1, 2, 0]
+
+    # Recorded running times take precedence, examples without history are
+    # estimated from the time per character of code of the others
+    manifest = GalleryManifest(target_dir)
+    manifest.update('plot_short.py', runtime=1000.)
+    manifest.update('plot_long.py', runtime=1.)
+    manifest.save()
+    estimates = parallel.estimate_runtimes(tasks)
+    assert estimates[:2] == [1000., 1.]
+    assert 1. < estimates[2] < 1000.
+    assert parallel.lpt_order(estimates) == [0, 2, 1]
+
+
+def test_parse_memory_limit():
+    assert parallel.parse_memory_limit(None) is None
+    assert parallel.parse_memory_limit(1000) == 1000
+    assert parallel.parse_memory_limit('512M') == 512 * 2 ** 20
+    assert parallel.parse_memory_limit('1.5GB') == int(1.5 * 2 ** 30)
+
+
+def test_example_limits_cached(gallery_conf, monkeypatch):
+    """The limits of an example are parsed again only when it changed"""
+    src_dir = gallery_conf['examples_dir']
+    _write_example(src_dir, 'plot_slow.py',
+                   '# sphinx_galleria_example_timeout = 10\nprint(1)')
+    task = parallel.ExampleTask('plot_slow.py', gallery_conf['gallery_dir'],
+                                src_dir)
+    manifests = {}
+    assert parallel.get_example_limits(task, gallery_conf, manifests) == \
+        (10, None)
+    manifests[task.target_dir].save()
+
+    def _fail(*args, **kwargs):
+        raise AssertionError('unchanged examples must not be parsed')
+
+    split_blocks = parallel.split_code_and_text_blocks
+    monkeypatch.setattr(parallel, 'split_code_and_text_blocks', _fail)
+    gallery_conf['example_memory_limit'] = '1G'
+    assert parallel.get_example_limits(task, gallery_conf, {}) == \
+        (10, 2 ** 30)
+    monkeypatch.setattr(parallel, 'split_code_and_text_blocks', split_blocks)
+    _write_example(src_dir, 'plot_slow.py',
+                   '# sphinx_galleria_example_timeout = 200\nprint(1)')
+    assert parallel.get_example_limits(task, gallery_conf, manifests) == \
+        (200, 2 ** 30)
+
+
+@needs_py3
+def test_example_limits(gallery_conf, fakesphinxapp):
+    """Examples exceeding their limits are killed and reported failing"""
+    src_dir = gallery_conf['examples_dir']
+    _write_example(src_dir, 'plot_slow.py',
+                   '# sphinx_galleria_example_timeout = 1\n'
+                   'import time\ntime.sleep(60)')
+    _write_example(src_dir, 'plot_greedy.py',
+                   'x = bytearray(8 * 2 ** 30)')
+    _write_example(src_dir, 'plot_ok.py', 'print("fine")')
+    gallery_conf['example_memory_limit'] = '4G'
+    tasks = [parallel.ExampleTask(fname, gallery_conf['gallery_dir'],
+                                  src_dir)
+             for fname in ['plot_slow.py', 'plot_greedy.py', 'plot_ok.py']]
+    assert parallel.get_example_limits(tasks[0], gallery_conf) == \
+        (1, 4 * 2 ** 30)
+
+    results = dict(parallel.execute_examples(tasks, gallery_conf,
+                                             sg.generate_file_rst))
+
+    assert sorted(results) == [0, 1, 2]
+    failing = gallery_conf['failing_examples']
+    assert sorted(failing) == sorted([tasks[0].src_file, tasks[1].src_file])
+    assert 'time limit of 1 seconds' in failing[tasks[0].src_file]
+    assert 'memory limit' in failing[tasks[1].src_file]
+    for task in tasks:
+        assert os.path.isfile(os.path.join(gallery_conf['gallery_dir'],
+                                           task.fname[:-3] + '.rst'))
+
+
+def test_single_queue(tmpdir, monkeypatch):
+    """All galleries and subsections are executed from a single queue"""
+    app = _gallery_app(tmpdir)
+    calls = []
+
+    def run_examples(tasks, gallery_conf, summary, manifests=None):
+        calls.append([task.fname for task in tasks])
+        return [(task.fname, 1.) for task in tasks]
+
+    monkeypatch.setattr(gen_gallery, 'run_examples', run_examples)
+    gen_gallery.generate_gallery_rst(app)
+
+    assert calls == [['plot_examples.py', 'plot_examplessub.py',
+                      'plot_tutorials.py', 'plot_tutorialssub.py']]
+    for gallery in ['examples', 'tutorials']:
+        with codecs.open(os.path.join(app.srcdir, 'auto_' + gallery,
+                                      'index.rst'),
+                         encoding='utf-8') as fid:
+            index = fid.read()
+        assert index.index('plot_%s_thumb' % gallery) < \
+            index.index('plot_%ssub_thumb' % gallery)
+
+
+def test_execution_budget(gallery_conf, fakesphinxapp):
+    """Changed examples run first, the others are not started past budget"""
+    src_dir, target_dir = (gallery_conf['examples_dir'],
+                           gallery_conf['gallery_dir'])
+    runs = os.path.join(src_dir, 'runs.txt')
+    code = 'import time\nopen("runs.txt", "a").write("{0} ")\ntime.sleep(0.3)'
+    for name in ['a', 'b']:
+        _write_example(src_dir, 'plot_%s.py' % name, code.format(name))
+
+    def build(*fnames):
+        tasks = [parallel.ExampleTask(fname, target_dir, src_dir)
+                 for fname in fnames]
+        return sg.run_examples(tasks, gallery_conf, 'budget ')
+
+    build('plot_a.py', 'plot_b.py')
+    assert gallery_conf['over_budget_examples'] == {}
+
+    # The new example is executed first, the changed one keeps its outputs
+    gallery_conf['execution_budget_seconds'] = 0.1
+    _write_example(src_dir, 'plot_b.py', code.format('b2'))
+    _write_example(src_dir, 'plot_c.py', code.format('c'))
+    results = build('plot_a.py', 'plot_b.py', 'plot_c.py')
+    assert open(runs).read().split() == ['a', 'b', 'c']
+    assert [intro for intro, _ in results] == [
+        'plot_a title', 'plot_b title', 'plot_c title']
+    b_file = os.path.join(src_dir, 'plot_b.py')
+    assert gallery_conf['over_budget_examples'] == {b_file: 'stale outputs'}
+    with codecs.open(os.path.join(target_dir, 'plot_b.rst'),
+                     encoding='utf-8') as fid:
+        assert '"b "' in fid.read()
+    # Not executed, it is not expected to fail in this build
+    app = _Namespace(srcdir=src_dir, config=_Namespace(
+        sphinx_galleria_conf=dict(gallery_conf,
+                                  expected_failing_examples={'plot_b.py'})))
+    gen_gallery.sumarize_failing_examples(app, None)
+
+    # Without outputs, the rst is written without executing the example
+    gallery_conf['execution_budget_seconds'] = 0
+    _write_example(src_dir, 'plot_d.py', code.format('d'))
+    build('plot_a.py', 'plot_b.py', 'plot_c.py', 'plot_d.py')
+    assert open(runs).read().split() == ['a', 'b', 'c']
+    assert gallery_conf['over_budget_examples'][
+        os.path.join(src_dir, 'plot_d.py')] == 'placeholder'
+    assert os.path.isfile(os.path.join(target_dir, 'plot_d.rst'))
+
+    # Executed in the next build with enough time
+    gallery_conf['execution_budget_seconds'] = None
+    build('plot_a.py', 'plot_b.py', 'plot_c.py', 'plot_d.py')
+    assert sorted(open(runs).read().split()) == ['a', 'b', 'b2', 'c', 'd']
+
+
+@needs_py3
+def test_execution_budget_in_workers(gallery_conf, fakesphinxapp):
+    """The budget used up by an example run in a worker ends the build"""
+    src_dir = gallery_conf['examples_dir']
+    # The limit runs the example in a worker process
+    _write_example(src_dir, 'plot_slow.py',
+                   '# sphinx_galleria_example_timeout = 30\n'
+                   'import time\ntime.sleep(1)')
+    _write_example(src_dir, 'plot_next.py', 'print(1)')
+    gallery_conf.update(parallel=1, execution_budget_seconds=0.5)
+    tasks = [parallel.ExampleTask(fname, gallery_conf['gallery_dir'],
+                                  src_dir)
+             for fname in ['plot_slow.py', 'plot_next.py']]
+
+    results = dict(parallel.execute_examples(
+        tasks, gallery_conf, sg.generate_file_rst,
+        budget=gallery_conf['execution_budget_seconds']))
+    assert results[0][0] == 'plot_slow title'
+    assert results[1] is None
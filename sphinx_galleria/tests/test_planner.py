@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the dry-run build planner
+==============================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.manifest import GalleryManifest
+from sphinx_galleria.planner import (discover_examples, plan_cli,
+                                     plan_examples, simulate_schedule)
+
+
+def test_simulate_schedule():
+    assert simulate_schedule([], [], 2) == (0, [])
+    assert simulate_schedule([3, 2, 2], [0, 1, 2], 2) == (4, [True] * 3)
+    assert simulate_schedule([3, 2, 2], [0, 1, 2], 1) == (7, [True] * 3)
+    assert simulate_schedule([3, 2, 2], [0, 1, 2], 1, budget=4) == (
+        5, [True, True, False])
+
+
+@pytest.fixture
+def doc(tmpdir, monkeypatch):
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    examples.join('README.txt').write('Examples\n========\n')
+    examples.join('shared.py').write('VALUE = 1\n')
+    for name in ('a', 'b', 'c'):
+        examples.join('plot_%s.py' % name).write(
+            '"""Example {0}"""\n{1}open("runs.txt", "a").write("{0} ")\n'
+            .format(name, 'import shared\n' if name == 'c' else ''))
+    examples.join('other.py').write('"""Not executed"""\n')
+    doc.join('conf.py').write(
+        "sphinx_galleria_conf = {'examples_dirs': 'examples',\n"
+        "                        'gallery_dirs': 'auto_examples',\n"
+        "                        'filename_pattern': 'plot',\n"
+        "                        'ignore_pattern': 'shared'}\n")
+    monkeypatch.syspath_prepend(examples.strpath)
+    return doc
+
+
+def test_plan_examples(doc):
+    examples = doc.join('examples')
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, examples_dirs='examples',
+                        gallery_dirs='auto_examples', filename_pattern='plot',
+                        ignore_pattern='shared')
+    tasks = discover_examples(gallery_conf)
+    assert [task.fname for task in tasks] == [
+        'other.py', 'plot_a.py', 'plot_b.py', 'plot_c.py']
+
+    plans, _ = plan_examples(tasks, gallery_conf)
+    assert [(plan.status, plan.reason) for plan in plans] == [
+        ('not executed', 'does not match filename_pattern'),
+        ('executed', 'never built'), ('executed', 'never built'),
+        ('executed', 'never built')]
+
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    sg.run_examples(tasks, gallery_conf, 'plan ')
+    manifest = GalleryManifest(target_dir.strpath)
+    for fname, runtime in (('plot_a.py', 3.), ('plot_b.py', 1.),
+                           ('plot_c.py', 2.)):
+        manifest.update(fname, runtime=runtime)
+    manifest.save()
+    plans, wall_time = plan_examples(tasks, gallery_conf)
+    assert [plan.status for plan in plans] == [
+        'not executed', 'cached', 'cached', 'cached']
+    assert wall_time == 0
+
+    # Nothing is executed when planning
+    examples.join('plot_a.py').write(
+        '"""Example a"""\nopen("runs.txt", "a").write("a2 ")\n')
+    examples.join('shared.py').write('VALUE = 22\n')
+    runs = examples.join('runs.txt').read()
+    plans, wall_time = plan_examples(tasks, gallery_conf)
+    assert examples.join('runs.txt').read() == runs
+    assert [(plan.status, plan.reason, plan.estimate)
+            for plan in plans[1:]] == [
+        ('executed', 'example changed', 3.),
+        ('cached', 'unchanged since the last build', 0),
+        ('executed', 'dependency changed: shared.py', 2.)]
+    assert wall_time == 5
+    assert plan_examples(tasks, gallery_conf, n_jobs=2)[1] == 3
+
+    # The changed example starts first within the budget
+    gallery_conf['execution_budget_seconds'] = 1
+    plans, wall_time = plan_examples(tasks, gallery_conf, n_jobs=1)
+    assert [plan.status for plan in plans[1:]] == [
+        'executed', 'cached', 'over budget']
+    assert wall_time == 3
+
+
+def test_plan_cli(doc, capsys):
+    plan_cli([doc.strpath, '--jobs', '2'])
+    out = capsys.readouterr()[0]
+    assert 'executed     examples/plot_a.py: never built' in out
+    assert 'not executed examples/other.py' in out
+    assert '3 executed, 1 not executed' in out
+    assert 'with 2 jobs' in out
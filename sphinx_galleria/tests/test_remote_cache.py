@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the remote cache of example outputs
+========================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import os
+import threading
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.backreferences import scan_used_functions
+from sphinx_galleria.parallel import ExampleTask
+from sphinx_galleria.remote_cache import (DirectoryBackend, HTTPBackend,
+                                          get_remote_backend)
+
+# Try Python 3 first, otherwise load from Python 2
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+
+def _put_handler(root):
+    """Static file server accepting PUT requests, serving ``root``"""
+
+    class Handler(SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return os.path.join(root, *path.lstrip('/').split('/'))
+
+        def do_PUT(self):
+            fname = self.translate_path(self.path)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            length = int(self.headers['Content-Length'])
+            with open(fname, 'wb') as fid:
+                fid.write(self.rfile.read(length))
+            self.send_response(201)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def http_url(tmpdir):
+    server = HTTPServer(('127.0.0.1', 0),
+                        _put_handler(tmpdir.mkdir('http').strpath))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d/cache' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_remote_backend(tmpdir):
+    assert get_remote_backend({}) is None
+    backend = get_remote_backend({'remote_cache': 'http://host/cache/'})
+    assert isinstance(backend, HTTPBackend)
+    assert backend.url == 'http://host/cache/'
+    backend = get_remote_backend({'remote_cache': 'file://' + tmpdir.strpath})
+    assert isinstance(backend, DirectoryBackend)
+    assert backend.root == tmpdir.strpath
+
+
+def test_http_backend(http_url):
+    backend = HTTPBackend(http_url)
+    assert backend.get('entries/missing.zip') is None
+    backend.put('entries/abc.zip', b'\x00data')
+    assert backend.get('entries/abc.zip') == b'\x00data'
+
+
+def _checkout(tmpdir, name, remote_cache):
+    """A documentation tree with its own artifact store"""
+    doc = tmpdir.mkdir(name)
+    examples = doc.mkdir('examples')
+    examples.join('plot_remote.py').write(
+        '"""Title"""\n'
+        'import matplotlib.pyplot as plt\n'
+        'plt.plot([1, 2])\n'
+        'open("runs.txt", "a").write("x")\n')
+    target_dir = doc.mkdir('auto_examples')
+    target_dir.mkdir('images').mkdir('thumb')
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'],
+                        artifact_store=tmpdir.join(name + '_store').strpath,
+                        remote_cache=remote_cache)
+    task = ExampleTask('plot_remote.py', target_dir.strpath, examples.strpath)
+    return gallery_conf, task
+
+
+@pytest.mark.parametrize('remote', ['directory', 'http'])
+def test_shared_outputs(tmpdir, http_url, fakesphinxapp, remote):
+    """Outputs executed on a machine are reused on another one"""
+    remote_cache = (http_url if remote == 'http'
+                    else tmpdir.join('shared').strpath)
+    gallery_conf, task = _checkout(tmpdir, 'ci', remote_cache)
+    sg.run_examples([task], gallery_conf, 'test')
+    assert os.path.isfile(os.path.join(task.src_dir, 'runs.txt'))
+
+    gallery_conf, task = _checkout(tmpdir, 'laptop', remote_cache)
+    results = sg.run_examples([task], gallery_conf, 'test')
+    assert results == [('Title', 0)]
+    assert not os.path.exists(os.path.join(task.src_dir, 'runs.txt'))
+    for fname in ['plot_remote.rst', 'images/sphx_glr_plot_remote_001.png',
+                  'images/thumb/sphx_glr_plot_remote_thumb.png']:
+        assert os.path.isfile(os.path.join(task.target_dir, fname))
+    # Pickles are not shared, the names used are found again locally
+    codeobj = os.path.join(task.target_dir, 'plot_remote_codeobj.pickle')
+    assert not os.path.exists(codeobj)
+    scan_used_functions(os.path.join(task.target_dir, task.fname),
+                        gallery_conf)
+    assert os.path.isfile(codeobj)
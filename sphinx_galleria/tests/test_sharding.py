@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the sharded execution of examples
+======================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import json
+
+import pytest
+
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.gen_rst import example_is_unchanged
+from sphinx_galleria.hashing import file_stat
+from sphinx_galleria.parallel import ExampleTask
+from sphinx_galleria.manifest import GalleryManifest
+from sphinx_galleria.sharding import (
+    MERGE_ENV, SHARD_ENV, SHARD_INFO_FNAME, assign_shards, export_shard,
+    get_merge_dirs, get_shard, parse_shard, run_merged, run_shard,
+    shard_indices)
+
+
+def test_parse_shard(monkeypatch):
+    assert parse_shard(None) is None
+    assert parse_shard('') is None
+    assert parse_shard('2/4') == (2, 4)
+    assert parse_shard((1, 1)) == (1, 1)
+    for value in ('0/4', '5/4', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+    monkeypatch.delenv(SHARD_ENV, raising=False)
+    assert get_shard({'shard': '1/2'}) == (1, 2)
+    monkeypatch.setenv(SHARD_ENV, '2/3')
+    assert get_shard({'shard': '1/2'}) == (2, 3)
+
+
+def test_assign_shards():
+    estimates = [10., 1., 6., 4., 3., 3., 2., 1.]
+    shards = assign_shards(estimates, 3)
+    loads = [sum(estimate for estimate, shard in zip(estimates, shards)
+                 if shard == index) for index in (1, 2, 3)]
+    assert sorted(loads) == [10., 10., 10.]
+    assert assign_shards(estimates, 3) == shards
+    # Every task is in exactly one shard
+    assert assign_shards([1.], 3) == [1]
+
+
+def test_run_and_export_shard(tmpdir):
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    runtimes = {'plot_a.py': 4., 'plot_b.py': 3., 'plot_c.py': 2.,
+                'plot_d.py': 1.}
+    manifest = GalleryManifest(target_dir.strpath)
+    for fname, runtime in runtimes.items():
+        examples.join(fname).write(
+            '"""Example {0}"""\nopen("runs.txt", "a").write("{0} ")\n'
+            .format(fname[:-3]))
+        manifest.update(fname, runtime=runtime)
+    manifest.save()
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'])
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in sorted(runtimes)]
+
+    # The two shards run all the examples, with the same running time
+    indices = shard_indices(tasks, (1, 2))
+    assert indices == [0, 3]
+    assert shard_indices(tasks, (2, 2)) == [1, 2]
+
+    manifests = {}
+    results, indices = run_shard(tasks, (1, 2), gallery_conf, 'shard ',
+                                 manifests)
+    assert sorted(examples.join('runs.txt').read().split()) == [
+        'plot_a', 'plot_d']
+    # The other examples are in the gallery without being executed
+    assert [result[0] for result in results] == [
+        'Example plot_a', 'Example plot_b', 'Example plot_c',
+        'Example plot_d']
+    assert target_dir.join('plot_b.rst').check()
+    assert manifests[target_dir.strpath].get('plot_b.py') == {'runtime': 3.}
+    assert manifests[target_dir.strpath].get('plot_a.py')['status'] == 'ok'
+
+    shard_dir = tmpdir.join('shard')
+    export_shard(shard_dir.strpath, tasks, indices, results, gallery_conf,
+                 manifests, (1, 2))
+    info = json.loads(shard_dir.join(SHARD_INFO_FNAME).read())
+    assert info['shard'] == [1, 2]
+    assert [example['fname'] for example in info['examples']] == [
+        'plot_a.py', 'plot_d.py']
+    example = info['examples'][0]
+    assert example['gallery_dir'] == 'auto_examples'
+    assert example['src_file'] == 'examples/plot_a.py'
+    assert example['record']['md5']
+    assert example['failure'] is None
+    assert 'plot_a.rst' in example['files']
+    for name in example['files']:
+        assert shard_dir.join('auto_examples', name).check()
+    assert not shard_dir.join('auto_examples', 'plot_b.rst').check()
+
+
+def _make_doc(tmpdir, name):
+    """A documentation tree with a gallery of four examples"""
+    doc = tmpdir.mkdir(name)
+    examples = doc.mkdir('examples')
+    doc.join('auto_examples').ensure('images', 'thumb', dir=True)
+    for fname in ('plot_a', 'plot_b', 'plot_c'):
+        examples.join(fname + '.py').write(
+            '"""Example {0}"""\nopen("runs.txt", "a").write("{0} ")\n'
+            .format(fname))
+    examples.join('plot_fail.py').write('"""Failing"""\nraise ValueError\n')
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'], failing_examples={})
+    tasks = [ExampleTask(fname, doc.join('auto_examples').strpath,
+                         examples.strpath)
+             for fname in ('plot_a.py', 'plot_b.py', 'plot_c.py',
+                           'plot_fail.py')]
+    return doc, gallery_conf, tasks
+
+
+def test_merge_shards(tmpdir, monkeypatch):
+    monkeypatch.delenv(MERGE_ENV, raising=False)
+    for index in (1, 2):
+        doc, gallery_conf, tasks = _make_doc(tmpdir, 'node%d' % index)
+        manifests = {}
+        results, indices = run_shard(tasks, (index, 2), gallery_conf,
+                                     'shard ', manifests)
+        export_shard(tmpdir.join('shards', str(index)).strpath, tasks,
+                     indices, results, gallery_conf, manifests,
+                     (index, 2))
+
+    doc, gallery_conf, tasks = _make_doc(tmpdir, 'final')
+    # Changed since its shard executed it
+    doc.join('examples', 'plot_c.py').write(
+        '"""Example plot_c"""\nopen("runs.txt", "a").write("new ")\n')
+    gallery_conf['shard_merge'] = '../shards/*'
+    shard_dirs = get_merge_dirs(gallery_conf)
+    assert len(shard_dirs) == 2
+    monkeypatch.setenv(MERGE_ENV, tmpdir.join('shards', '1').strpath)
+    assert get_merge_dirs(gallery_conf) == [tmpdir.join('shards', '1')
+                                            .strpath]
+    monkeypatch.delenv(MERGE_ENV)
+
+    manifests = {}
+    results = run_merged(tasks, shard_dirs, gallery_conf, 'merge ',
+                         manifests)
+    assert [result[0] for result in results] == [
+        'Example plot_a', 'Example plot_b', 'Example plot_c', 'Failing']
+    # Only the changed example is executed
+    assert doc.join('examples', 'runs.txt').read() == 'new '
+    target_dir = doc.join('auto_examples')
+    for fname in ('plot_a', 'plot_b', 'plot_fail'):
+        assert target_dir.join(fname + '.rst').check()
+    assert target_dir.join('plot_a.py').check()
+    # The failure is reported by this build
+    src_file = doc.join('examples', 'plot_fail.py').strpath
+    assert 'ValueError' in gallery_conf['failing_examples'][src_file]
+    # The records are the ones of this build, the examples are unchanged
+    record = manifests[target_dir.strpath].get('plot_a.py')
+    assert record['stat'] == file_stat(doc.join('examples', 'plot_a.py')
+                                       .strpath)
+    assert record['status'] == 'ok'
+    assert example_is_unchanged(tasks[0].src_file,
+                                target_dir.join('plot_a.py').strpath,
+                                record, gallery_conf)
+
+
+class _Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_shard_expected_failing(tmpdir):
+    """Expected failures of other shards are not reported as passing"""
+    for index in (1, 2):
+        doc, gallery_conf, tasks = _make_doc(tmpdir, 'node%d' % index)
+        gallery_conf['expected_failing_examples'] = {'examples/plot_fail.py'}
+        results, indices = run_shard(tasks, (index, 2), gallery_conf,
+                                     'shard ', {})
+        app = _Namespace(srcdir=doc.strpath, config=_Namespace(
+            sphinx_galleria_conf=gallery_conf))
+        gen_gallery.sumarize_failing_examples(app, None)
+        src_file = doc.join('examples', 'plot_fail.py').strpath
+        executed = src_file in [tasks[i].src_file for i in indices]
+        assert (src_file in gallery_conf['failing_examples']) == executed
+        assert (src_file in gallery_conf['skipped_examples']) != executed
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the selection of examples changed on a git branch
+======================================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.parallel import ExampleTask
+from sphinx_galleria.vcs import (get_changed_files, git_changed_files,
+                                 is_changed_example)
+
+
+def _git(repo, *args):
+    subprocess.check_call(
+        ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.org']
+        + list(args), cwd=repo.strpath, stdout=subprocess.PIPE)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    try:
+        subprocess.check_call(['git', '--version'], stdout=subprocess.PIPE)
+    except OSError:
+        pytest.skip('git is not installed')
+    repo = tmpdir.mkdir('repo')
+    examples = repo.mkdir('doc').mkdir('examples')
+    examples.join('shared.py').write('VALUE = 1\n')
+    for name in ('a', 'b', 'c'):
+        examples.join('plot_%s.py' % name).write(
+            '"""Example {0}"""\n{1}open("runs.txt", "a").write("{0} ")\n'
+            .format(name, 'import shared\n' if name == 'c' else ''))
+    repo.join('.gitignore').write('runs.txt\nauto_examples\n')
+    _git(repo, 'init', '-q')
+    _git(repo, 'checkout', '-q', '-b', 'main')
+    _git(repo, 'add', '.')
+    _git(repo, 'commit', '-q', '-m', 'Examples')
+    _git(repo, 'checkout', '-q', '-b', 'feature')
+    return repo
+
+
+def test_git_changed_files(repo):
+    examples = repo.join('doc', 'examples')
+    assert git_changed_files('main', examples.strpath) == set()
+    examples.join('plot_a.py').write('"""Example a"""\n')
+    _git(repo, 'commit', '-q', '-am', 'Change a')
+    examples.join('plot_b.py').write('"""Example b"""\n')
+    examples.join('plot_new.py').write('"""New"""\n')
+    # Committed, modified and untracked files
+    assert git_changed_files('main', examples.strpath) == set(
+        os.path.realpath(examples.join(fname).strpath)
+        for fname in ('plot_a.py', 'plot_b.py', 'plot_new.py'))
+
+    # Relative to the source directory, for workers in other checkouts
+    gallery_conf = {'changed_since': 'main',
+                    'src_dir': repo.join('doc').strpath}
+    assert get_changed_files(gallery_conf) == set(
+        'examples/' + fname
+        for fname in ('plot_a.py', 'plot_b.py', 'plot_new.py'))
+    worker_repo = repo.dirpath().join('worker_repo')
+    shutil.copytree(repo.strpath, worker_repo.strpath)
+    worker_conf = dict(gallery_conf, src_dir=worker_repo.join('doc').strpath)
+    worker_examples = worker_repo.join('doc', 'examples')
+    assert is_changed_example(worker_examples.join('plot_a.py').strpath, [],
+                              worker_conf)
+    assert not is_changed_example(worker_examples.join('plot_c.py').strpath,
+                                  [], worker_conf)
+
+    gallery_conf = {'changed_since': 'unknown', 'src_dir': repo.strpath}
+    assert get_changed_files(gallery_conf) is None
+    assert get_changed_files({'src_dir': repo.strpath}) is None
+
+
+def test_changed_since(repo, monkeypatch):
+    doc = repo.join('doc')
+    examples = doc.join('examples')
+    monkeypatch.syspath_prepend(examples.strpath)
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'], changed_since='main',
+                        ignore_pattern='shared')
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in ('plot_a.py', 'plot_b.py', 'plot_c.py')]
+
+    # Nothing changed on the branch, the rst is written without running
+    sg.run_examples(tasks, gallery_conf, 'changed ')
+    assert not examples.join('runs.txt').check()
+    assert target_dir.join('plot_a.rst').check()
+
+    # A changed example and the examples importing a changed module
+    examples.join('plot_a.py').write(
+        '"""Example a"""\nopen("runs.txt", "a").write("a2 ")\n')
+    examples.join('shared.py').write('VALUE = 2\n')
+    gallery_conf['changed_files'] = None
+    sg.run_examples(tasks, gallery_conf, 'changed ')
+    assert sorted(examples.join('runs.txt').read().split()) == ['a2', 'c']
+
+    # Without it, every example is executed
+    gallery_conf['changed_since'] = None
+    sg.run_examples(tasks, gallery_conf, 'changed ')
+    assert sorted(examples.join('runs.txt').read().split()) == [
+        'a2', 'b', 'c']
+
+
+class _Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_changed_since_expected_failing(repo):
+    """Unchanged expected failures are not reported as passing"""
+    doc = repo.join('doc')
+    examples = doc.join('examples')
+    examples.join('plot_fail.py').write('"""Failing"""\nraise ValueError\n')
+    _git(repo, 'add', '.')
+    _git(repo, 'commit', '-q', '-m', 'Failing example')
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'], changed_since='HEAD',
+                        expected_failing_examples={'examples/plot_fail.py'})
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in ('plot_a.py', 'plot_fail.py')]
+
+    sg.run_examples(tasks, gallery_conf, 'changed ')
+    src_file = examples.join('plot_fail.py').strpath
+    assert gallery_conf['failing_examples'] == {}
+    assert gallery_conf['skipped_examples'] == {
+        examples.join('plot_a.py').strpath: 'unchanged since HEAD',
+        src_file: 'unchanged since HEAD'}
+    app = _Namespace(srcdir=doc.strpath, config=_Namespace(
+        sphinx_galleria_conf=gallery_conf))
+    gen_gallery.sumarize_failing_examples(app, None)
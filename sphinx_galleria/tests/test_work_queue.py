@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Test the distributed execution of examples
+==========================================
+"""
+
+from __future__ import division, absolute_import, print_function
+import copy
+import multiprocessing
+import shutil
+import socket
+import sys
+import time
+
+import pytest
+
+import sphinx_galleria.gen_rst as sg
+import sphinx_galleria.work_queue as wq
+from sphinx_galleria import gen_gallery
+from sphinx_galleria.manifest import GalleryManifest
+from sphinx_galleria.parallel import ExampleTask
+from sphinx_galleria.work_queue import (AUTHKEY_ENV, QueueClient,
+                                        QueueServer, SqliteQueue,
+                                        execute_distributed, run_worker)
+
+
+def test_sqlite_queue(tmpdir):
+    queue = SqliteQueue(tmpdir.join('queue.db').strpath)
+    assert queue.status() is None
+    assert queue.claim('worker') is None
+    queue.open({'plot_gallery': True}, lease=None)
+    assert queue.status() == 'open'
+    ids = queue.put(['slow', 'fast'])
+    task_id, task, conf = queue.claim('worker')
+    assert (task_id, task, conf) == (ids[0], 'slow', {'plot_gallery': True})
+    assert queue.claim('worker')[1] == 'fast'
+    assert queue.claim('worker') is None
+    queue.complete(ids[1], 'done fast')
+    assert queue.collect() == [(ids[1], 'done fast')]
+    assert queue.collect() == []
+
+    # Tasks of workers that do not push their result are given again
+    queue.open({}, lease=0)
+    ids = queue.put(['task'])
+    assert queue.claim('lost')[0] == ids[0]
+    time.sleep(0.01)
+    assert queue.claim('other')[0] == ids[0]
+    queue.close()
+    assert queue.status() == 'closed'
+
+
+def test_queue_server(tmpdir, monkeypatch):
+    queue = SqliteQueue(tmpdir.join('queue.db').strpath)
+    queue.open({}, lease=None)
+    # Without a shared secret, the service does not start
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+    with pytest.raises(RuntimeError, match=AUTHKEY_ENV):
+        QueueServer(queue, ('127.0.0.1', 0))
+
+    monkeypatch.setenv(AUTHKEY_ENV, 'secret')
+    server = QueueServer(queue, ('127.0.0.1', 0))
+    try:
+        client = QueueClient(server.address)
+        assert client.status() == 'open'
+        ids = queue.put([{'fname': 'plot_a.py'}])
+        assert client.claim('remote')[:2] == (ids[0], {'fname': 'plot_a.py'})
+        client.complete(ids[0], 'result')
+        assert queue.collect() == [(ids[0], 'result')]
+        client.close()
+    finally:
+        server.close()
+
+
+needs_py3 = pytest.mark.skipif(sys.version_info < (3, 4),
+                               reason='example limits need Python 3')
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _worker(address, src_dir):
+    run_worker(QueueClient(address), src_dir, poll_interval=0.1,
+               idle_timeout=60)
+
+
+@needs_py3
+def test_distributed_build(tmpdir, monkeypatch):
+    """Examples are executed by workers in another checkout"""
+    monkeypatch.setenv(AUTHKEY_ENV, 'secret')
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    for fname in ('plot_a', 'plot_b', 'plot_c'):
+        examples.join(fname + '.py').write(
+            '"""Example {0}"""\n'
+            'import matplotlib.pyplot as plt\n'
+            'open("runs.txt", "a").write("{0} ")\n'
+            'plt.plot([1, 2])\n'.format(fname))
+    examples.join('plot_fail.py').write('"""Failing"""\nraise ValueError\n')
+    # The limits of the examples apply on the workers too
+    examples.join('plot_slow.py').write(
+        '"""Slow"""\n# sphinx_galleria_example_timeout = 1\n'
+        'import time\ntime.sleep(60)\n')
+    # The checkout of the workers, e.g. on another machine
+    worker_doc = tmpdir.join('worker_doc')
+    shutil.copytree(doc.strpath, worker_doc.strpath)
+    target_dir = doc.join('auto_examples')
+    target_dir.ensure('images', 'thumb', dir=True)
+
+    address = ('127.0.0.1', _free_port())
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, filename_pattern='plot',
+                        gallery_dirs=['auto_examples'], failing_examples={},
+                        work_queue='tcp://%s:%d' % address)
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in ('plot_a.py', 'plot_b.py', 'plot_c.py',
+                           'plot_fail.py', 'plot_slow.py')]
+
+    # Started afresh as on other machines, forked workers would inherit the
+    # forkserver of this process
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=_worker, args=(address, worker_doc.strpath))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    try:
+        results = sg.run_examples(tasks, gallery_conf, 'distributed ')
+    finally:
+        for worker in workers:
+            worker.join(30)
+    assert [worker.exitcode for worker in workers] == [0, 0]
+
+    assert [intro for intro, _ in results] == [
+        'Example plot_a', 'Example plot_b', 'Example plot_c', 'Failing',
+        'Slow']
+    # Executed once, by the workers
+    assert not examples.join('runs.txt').check()
+    assert sorted(worker_doc.join('examples', 'runs.txt').read().split()) \
+        == ['plot_a', 'plot_b', 'plot_c']
+    for fname in ('plot_a.rst', 'plot_a.py', 'plot_fail.rst',
+                  'images/sphx_glr_plot_a_001.png',
+                  'images/thumb/sphx_glr_plot_a_thumb.png'):
+        assert target_dir.join(fname).check(), fname
+    assert 'ValueError' in gallery_conf['failing_examples'][
+        examples.join('plot_fail.py').strpath]
+    assert 'time limit of 1 seconds' in gallery_conf['failing_examples'][
+        examples.join('plot_slow.py').strpath]
+    # Recorded as executed by this build
+    manifest = GalleryManifest(target_dir.strpath)
+    assert manifest.get('plot_a.py')['status'] == 'ok'
+    assert manifest.get('plot_a.py')['md5']
+    assert manifest.get('plot_fail.py')['status'] == 'failed'
+
+
+def test_distributed_budget(tmpdir, monkeypatch):
+    """Without workers, the build ends with its budget and warns"""
+    warnings = []
+    monkeypatch.setattr(wq.logger, 'warning',
+                        lambda *args: warnings.append(args))
+    monkeypatch.setattr(wq, 'NO_WORKER_WARNING', 0)
+    doc = tmpdir.mkdir('doc')
+    examples = doc.mkdir('examples')
+    for fname in ('plot_a.py', 'plot_b.py'):
+        examples.join(fname).write('"""Example"""\n')
+    target_dir = doc.mkdir('auto_examples')
+    gallery_conf = copy.deepcopy(gen_gallery.DEFAULT_GALLERY_CONF)
+    gallery_conf.update(src_dir=doc.strpath, failing_examples={},
+                        work_queue='queue.db')
+    tasks = [ExampleTask(fname, target_dir.strpath, examples.strpath)
+             for fname in ('plot_a.py', 'plot_b.py')]
+
+    results = list(execute_distributed(tasks, gallery_conf, budget=0.2,
+                                       poll_interval=0.05))
+    assert sorted(results) == [(0, None), (1, None)]
+    assert len(warnings) == 1
+    # Nothing is left for late workers
+    queue = SqliteQueue(doc.join('queue.db').strpath)
+    assert queue.claim('late') is None
+    assert queue.status() == 'closed'
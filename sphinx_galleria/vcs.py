@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Changes under version control
+=============================
+
+Select the examples to execute from the changes of a git branch. With
+``changed_since`` set to a git revision, such as ``'origin/main'``, only the
+examples whose file or recorded dependencies differ from the point where the
+current branch forked from this revision are executed. The changes are the
+ones of the commits of the branch, of the working tree and the untracked
+files.
+"""
+
+from __future__ import division, absolute_import, print_function
+import os
+import subprocess
+
+from . import sphinx_compatibility
+
+logger = sphinx_compatibility.getLogger('sphinx-gallery')
+
+
+def _git(args, cwd):
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output(['git'] + args, cwd=cwd,
+                                         stderr=devnull)
+    return output.decode('utf-8')
+
+
+def git_changed_files(ref, cwd):
+    """Files changed since the merge base of a revision and HEAD
+
+    Parameters
+    ----------
+    ref : str
+        The git revision, e.g. ``'origin/main'``.
+    cwd : str
+        A directory of the git repository.
+
+    Returns
+    -------
+    changed : set of str
+        Real paths of the files changed, added, removed or untracked.
+    """
+    toplevel = _git(['rev-parse', '--show-toplevel'], cwd).strip()
+    base = _git(['merge-base', ref, 'HEAD'], toplevel).strip()
+    names = _git(['diff', '--name-only', '-z', base, '--'], toplevel)
+    names += _git(['ls-files', '--others', '--exclude-standard', '-z'],
+                  toplevel)
+    return set(os.path.realpath(os.path.join(toplevel, name))
+               for name in names.split('\0') if name)
+
+
+def _relpath(path, src_dir):
+    return os.path.relpath(os.path.realpath(path),
+                           os.path.realpath(src_dir)).replace(os.sep, '/')
+
+
+def get_changed_files(gallery_conf):
+    """Files changed since ``changed_since``, None to execute all examples
+
+    They are computed once per build and kept in gallery_conf, for the
+    workers, as ``'/'`` separated paths relative to the Sphinx source
+    directory: the workers of a work queue may use checkouts at other
+    paths. If git fails, e.g. the revision is unknown, all the examples are
+    executed.
+    """
+    ref = gallery_conf.get('changed_since')
+    if not ref:
+        return None
+    if gallery_conf.get('changed_files') is None:
+        try:
+            changed = set(_relpath(path, gallery_conf['src_dir'])
+                          for path in git_changed_files(
+                              ref, gallery_conf['src_dir']))
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.warning('Could not list the files changed since %s, all '
+                           'the examples are executed: %s', ref, exc)
+            changed = True
+        gallery_conf['changed_files'] = changed
+    changed = gallery_conf['changed_files']
+    return None if changed is True else changed
+
+
+def is_changed_example(src_file, dependencies, gallery_conf):
+    """Whether an example or one of its dependencies changed
+
+    Always True without ``changed_since``.
+    """
+    changed = get_changed_files(gallery_conf)
+    if changed is None:
+        return True
+    return any(_relpath(path, gallery_conf['src_dir']) in changed
+               for path in [src_file] + list(dependencies))
@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+# License: 3-clause BSD
+r"""
+Distributed execution
+=====================
+
+Execute the examples of a build with workers on any number of machines.
+With ``work_queue`` set, the build is the coordinator: it puts the examples
+to execute in a work queue, slowest first, and waits for their results.
+Workers started with ``sphx_glr_worker.py`` on each machine, in a checkout
+of the same documentation, pull the examples one at a time, generate them
+with ``generate_file_rst`` within their ``example_timeout`` and
+``example_memory_limit``, and push their outputs back. Fast machines and
+short examples simply pull more examples.
+
+The queue is a SQLite file, for machines sharing a file system, or a TCP
+service started by the coordinator with ``work_queue`` set to
+``'tcp://host:port'``. Messages of the TCP service are authenticated with
+the ``SPHINX_GALLERIA_QUEUE_KEY`` environment variable, which is required:
+they are unpickled, so anyone able to send them could run code.
+
+An example pulled by a worker that does not push its result within
+``work_queue_lease`` seconds, e.g. because the worker was killed, is given
+to another worker.
+"""
+
+from __future__ import division, absolute_import, print_function
+import argparse
+import os
+import pickle
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+from . import sphinx_compatibility
+from .artifact_store import example_output_files
+from .locking import atomic_path
+from .manifest import GalleryManifest, log_record
+from .parallel import (ExampleTask, _worker_conf, estimate_runtimes,
+                       execute_examples, lpt_order)
+
+AUTHKEY_ENV = 'SPHINX_GALLERIA_QUEUE_KEY'
+# Seconds after which the coordinator warns that no worker pulled anything
+NO_WORKER_WARNING = 60
+# Methods of the queue workers can call through the TCP service
+_WORKER_METHODS = ('claim', 'complete', 'status')
+
+logger = sphinx_compatibility.getLogger('sphinx-gallery')
+
+
+def _dumps(obj):
+    return sqlite3.Binary(pickle.dumps(obj, protocol=2))
+
+
+def _loads(data):
+    return pickle.loads(bytes(data))
+
+
+class SqliteQueue(object):
+    """Work queue stored in a SQLite file
+
+    Every operation opens its own connection, so that the queue can be
+    shared by threads, processes and machines sharing the file.
+
+    Parameters
+    ----------
+    fname : str
+        The SQLite file, created if needed.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def _connect(self):
+        # Autocommit mode, transactions are started explicitly
+        return sqlite3.connect(self.fname, timeout=60,
+                               isolation_level=None)
+
+    def open(self, conf, lease=None):
+        """Start a build, removing the tasks of previous builds
+
+        Parameters
+        ----------
+        conf : dict
+            The gallery configuration the workers run the examples with.
+        lease : float or None
+            Seconds after which a task pulled by a worker is given to
+            another worker, None to wait forever.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(key TEXT PRIMARY KEY, value BLOB)')
+            conn.execute('CREATE TABLE IF NOT EXISTS tasks '
+                         '(id INTEGER PRIMARY KEY, task BLOB, state TEXT, '
+                         'worker TEXT, claimed REAL, result BLOB)')
+            conn.execute('DELETE FROM tasks')
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             [('conf', _dumps(conf)),
+                              ('lease', _dumps(lease)),
+                              ('status', _dumps('open'))])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def put(self, tasks):
+        """Add tasks to the queue, in the order they are pulled
+
+        Returns
+        -------
+        ids : list of int
+            The identifier of each task.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            ids = [conn.execute('INSERT INTO tasks (task, state) '
+                                "VALUES (?, 'pending')",
+                                (_dumps(task),)).lastrowid
+                   for task in tasks]
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return ids
+
+    def claim(self, worker):
+        """Pull the next task for a worker
+
+        Returns
+        -------
+        claimed : tuple or None
+            The ``(task_id, task, conf)`` of the task, None if no task is
+            pending.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+            lease = _loads(meta['lease'])
+            expired = time.time() - lease if lease is not None else 0
+            row = conn.execute(
+                "SELECT id, task FROM tasks WHERE state = 'pending' OR "
+                "(state = 'running' AND claimed < ?) ORDER BY id LIMIT 1",
+                (expired,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE tasks SET state = 'running', "
+                             "worker = ?, claimed = ? WHERE id = ?",
+                             (worker, time.time(), row[0]))
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError:
+            # The queue was not opened yet
+            return None
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return row[0], _loads(row[1]), _loads(meta['conf'])
+
+    def complete(self, task_id, result):
+        """Push the result of a task"""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE tasks SET state = 'done', result = ? "
+                         "WHERE id = ? AND state != 'collected'",
+                         (_dumps(result), task_id))
+        finally:
+            conn.close()
+
+    def collect(self):
+        """Results pushed since the last call, as ``(task_id, result)``"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute("SELECT id, result FROM tasks "
+                                "WHERE state = 'done'").fetchall()
+            conn.executemany("UPDATE tasks SET state = 'collected', "
+                             "result = NULL WHERE id = ?",
+                             [(task_id,) for task_id, _ in rows])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return [(task_id, _loads(result)) for task_id, result in rows]
+
+    def withdraw(self):
+        """Remove the tasks no worker pulled yet
+
+        Returns
+        -------
+        ids : list of int
+            The identifiers of the tasks removed.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM tasks WHERE state = 'pending'")]
+            conn.execute("DELETE FROM tasks WHERE state = 'pending'")
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return ids
+
+    def counts(self):
+        """Number of tasks by state"""
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT state, COUNT(*) FROM tasks '
+                                     'GROUP BY state'))
+        finally:
+            conn.close()
+
+    def status(self):
+        """``'open'`` during a build, ``'closed'`` after, None before"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta "
+                               "WHERE key = 'status'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.close()
+        return None if row is None else _loads(row[0])
+
+    def close(self):
+        """End the build, idle workers exit"""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'status'",
+                         (_dumps('closed'),))
+        finally:
+            conn.close()
+
+
+def get_authkey():
+    """Key authenticating the messages of the TCP service
+
+    There is no default key, the messages are unpickled and a key known to
+    everyone would let anyone reaching the service run code.
+    """
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise RuntimeError(
+            'The TCP work queue requires a secret shared by the coordinator '
+            'and the workers in the {0} environment variable'
+            .format(AUTHKEY_ENV))
+    return authkey.encode('utf-8')
+
+
+def parse_address(spec):
+    """Convert ``'tcp://host:port'`` to ``(host, port)``"""
+    host, _, port = spec[len('tcp://'):].rpartition(':')
+    return host, int(port)
+
+
+class QueueServer(object):
+    """TCP service giving workers access to a queue
+
+    Parameters
+    ----------
+    queue : SqliteQueue
+        The queue served.
+    address : tuple
+        The ``(host, port)`` to listen on.
+    authkey : bytes, optional
+        Key the workers authenticate with, see ``get_authkey``.
+    """
+
+    def __init__(self, queue, address, authkey=None):
+        self.queue = queue
+        self._listener = Listener(address, authkey=authkey or get_authkey())
+        self.address = self._listener.address
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        listener = self._listener
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                # Closed, or a client that failed to authenticate
+                if self._listener is None:
+                    return
+                continue
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, conn):
+        try:
+            while True:
+                method, args = conn.recv()
+                if self._listener is None:
+                    # The build ended, the queue may be gone already
+                    break
+                if method not in _WORKER_METHODS:
+                    conn.send(('error', 'Unknown method %r' % (method,)))
+                    continue
+                try:
+                    conn.send(('ok', getattr(self.queue, method)(*args)))
+                except Exception:
+                    conn.send(('error', traceback.format_exc()))
+        except (IOError, OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        """Stop accepting workers"""
+        listener, self._listener = self._listener, None
+        listener.close()
+
+
+class QueueClient(object):
+    """Access to a queue served by a ``QueueServer``
+
+    Parameters
+    ----------
+    address : tuple
+        The ``(host, port)`` of the service.
+    authkey : bytes, optional
+        See ``get_authkey``.
+    connect_timeout : float
+        Seconds to wait for the service to be started.
+    """
+
+    def __init__(self, address, authkey=None, connect_timeout=60):
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                self._conn = Client(address, authkey=authkey or get_authkey())
+                break
+            except (IOError, OSError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args):
+        with self._lock:
+            self._conn.send((method, args))
+            state, value = self._conn.recv()
+        if state == 'error':
+            raise RuntimeError('Work queue error:\n%s' % value)
+        return value
+
+    def claim(self, worker):
+        try:
+            return self._call('claim', worker)
+        except (IOError, OSError, EOFError):
+            return None
+
+    def complete(self, task_id, result):
+        return self._call('complete', task_id, result)
+
+    def status(self):
+        try:
+            return self._call('status')
+        except (IOError, OSError, EOFError):
+            # The coordinator stopped the service at the end of the build
+            return 'closed'
+
+    def close(self):
+        self._conn.close()
+
+
+def get_worker_queue(spec, src_dir='.'):
+    """Queue a worker pulls from, a SQLite file or ``'tcp://host:port'``"""
+    if spec.startswith('tcp://'):
+        return QueueClient(parse_address(spec))
+    return SqliteQueue(os.path.join(src_dir, spec))
+
+
+def _relpath(path, start):
+    return os.path.relpath(path, start).replace(os.sep, '/')
+
+
+def _run_task(payload, conf, src_dir, run):
+    """Generate an example in a worker, return its outputs
+
+    The example is executed with ``execute_examples``, in a process of its
+    own if it has a time or memory limit.
+    """
+    conf = dict(conf, src_dir=src_dir, failing_examples={})
+    task = ExampleTask(
+        payload['fname'],
+        os.path.join(src_dir, *payload['target_dir'].split('/')),
+        os.path.join(src_dir, *payload['src_dir'].split('/')))
+    thumb_dir = os.path.join(task.target_dir, 'images', 'thumb')
+    if not os.path.exists(thumb_dir):
+        os.makedirs(thumb_dir)
+    # Logged again by generate_file_rst, as in run_examples
+    log_record(task.target_dir, task.fname, skipped=None)
+    try:
+        [(_, (intro, time_elapsed))] = list(execute_examples([task], conf,
+                                                              run))
+    except Exception:
+        return {'error': traceback.format_exc()}
+    files = {}
+    for name in [task.fname] + example_output_files(task.target_dir,
+                                                    task.fname):
+        with open(os.path.join(task.target_dir, *name.split('/')),
+                  'rb') as fid:
+            files[name] = fid.read()
+    failure = conf['failing_examples'].get(task.src_file)
+    manifest = GalleryManifest(task.target_dir)
+    record = manifest.get(task.fname)
+    manifest.save()
+    return {'intro': intro, 'time_elapsed': time_elapsed, 'files': files,
+            'failure': failure,
+            # The checksum of the example, logged by generate_file_rst, or
+            # why it was not executed
+            'record': {} if failure is not None else dict(
+                (key, record[key])
+                for key in ('md5', 'data_files', 'hashes', 'skipped')
+                if record.get(key) is not None)}
+
+
+def run_worker(queue, src_dir, name=None, poll_interval=1.,
+               idle_timeout=None):
+    """Pull examples from a queue and generate them until the build ends
+
+    Parameters
+    ----------
+    queue : SqliteQueue or QueueClient
+        The queue of the coordinator.
+    src_dir : str
+        The Sphinx source directory of the documentation on this machine.
+    name : str, optional
+        Name of the worker, the host name and process id by default.
+    poll_interval : float
+        Seconds between two attempts to pull an example.
+    idle_timeout : float or None
+        Exit after this many seconds without any example to run, even if
+        the build did not end.
+
+    Returns
+    -------
+    n_examples : int
+        Number of examples generated.
+    """
+    # Local import, gen_rst depends on this module
+    from .gen_rst import generate_file_rst
+    name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+    src_dir = os.path.abspath(src_dir)
+    n_examples = 0
+    seen_open = False
+    idle_since = time.time()
+    while True:
+        claimed = queue.claim(name)
+        if claimed is not None:
+            seen_open = True
+            task_id, payload, conf = claimed
+            logger.info('%s: generating %s', name, payload['fname'])
+            queue.complete(task_id, _run_task(payload, conf, src_dir,
+                                              generate_file_rst))
+            n_examples += 1
+            idle_since = time.time()
+            continue
+        status = queue.status()
+        if status == 'open':
+            seen_open = True
+        elif status == 'closed' and seen_open:
+            return n_examples
+        if idle_timeout is not None and \
+                time.time() - idle_since > idle_timeout:
+            return n_examples
+        time.sleep(poll_interval)
+
+
+def _apply_result(task, result, gallery_conf):
+    """Write the outputs pushed by a worker to the gallery directory"""
+    if 'error' in result:
+        raise RuntimeError('Error while generating {0}:\n{1}'
+                           .format(task.src_file, result['error']))
+    for name, content in result['files'].items():
+        fname = os.path.join(task.target_dir, *name.split('/'))
+        with atomic_path(fname) as tmp_fname:
+            with open(tmp_fname, 'wb') as fid:
+                fid.write(content)
+    if result['failure'] is not None:
+        gallery_conf['failing_examples'][task.src_file] = result['failure']
+    elif result['record']:
+        log_record(task.target_dir, task.fname, **result['record'])
+    return result['intro'], result['time_elapsed']
+
+
+def execute_distributed(tasks, gallery_conf, manifests=None, budget=None,
+                        poll_interval=0.2):
+    """Execute examples with the workers of a queue, yield their results
+
+    Takes the same arguments as ``parallel.execute_examples`` and yields the
+    same ``(index, result)`` pairs, as the workers push their results. Once
+    the budget is used up, the examples no worker pulled yet are removed
+    from the queue and their results are None.
+    """
+    start = time.time()
+    spec = gallery_conf['work_queue']
+    src_dir = gallery_conf['src_dir']
+    server = tmp_dir = None
+    if spec.startswith('tcp://'):
+        tmp_dir = tempfile.mkdtemp(prefix='sphx_glr_queue_')
+        queue = SqliteQueue(os.path.join(tmp_dir, 'queue.db'))
+    else:
+        queue = SqliteQueue(os.path.join(src_dir, spec))
+    try:
+        queue.open(_worker_conf(gallery_conf),
+                   gallery_conf.get('work_queue_lease'))
+        if tmp_dir is not None:
+            server = QueueServer(queue, parse_address(spec))
+            logger.info('work queue listening on %s:%d', *server.address)
+        # The slowest examples are pulled first, or in the order of tasks
+        # with a budget
+        order = (range(len(tasks)) if budget is not None else
+                 lpt_order(estimate_runtimes(tasks, manifests)))
+        ids = queue.put(
+            [{'fname': tasks[index].fname,
+              'target_dir': _relpath(tasks[index].target_dir, src_dir),
+              'src_dir': _relpath(tasks[index].src_dir, src_dir)}
+             for index in order])
+        indices = dict(zip(ids, order))
+        warned = False
+        while indices:
+            elapsed = time.time() - start
+            if budget is not None and elapsed >= budget:
+                for task_id in queue.withdraw():
+                    index = indices.pop(task_id, None)
+                    if index is not None:
+                        yield index, None
+            if not warned and elapsed >= NO_WORKER_WARNING and \
+                    set(queue.counts()) == set(['pending']):
+                warned = True
+                logger.warning(
+                    'No worker pulled any example from the work queue %s '
+                    'in %d seconds, start workers with sphx_glr_worker.py',
+                    spec, elapsed)
+            results = queue.collect()
+            for task_id, result in results:
+                index = indices.pop(task_id, None)
+                if index is not None:
+                    yield index, _apply_result(tasks[index], result,
+                                               gallery_conf)
+            if not results:
+                time.sleep(poll_interval)
+    finally:
+        queue.close()
+        if server is not None:
+            server.close()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+###############################################################################
+# Worker shell utility
+
+def worker_cli(args=None, namespace=None):
+    """Run a worker of a distributed build from the command line
+
+    Takes the same arguments as ArgumentParser.parse_args
+    """
+    parser = argparse.ArgumentParser(
+        description='Sphinx-Gallery distributed build worker')
+    parser.add_argument('queue',
+                        help='SQLite file of the queue, relative to the '
+                        'source directory, or tcp://host:port of the '
+                        'coordinator')
+    parser.add_argument('src_dir', nargs='?', default='.',
+                        help='Sphinx source directory of the documentation '
+                        '(the directory of conf.py)')
+    parser.add_argument('--poll-interval', type=float, default=1.,
+                        help='Seconds between two attempts to pull an '
+                        'example')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Exit after this many seconds without '
+                        'examples to run')
+    args = parser.parse_args(args, namespace)
+
+    queue = get_worker_queue(args.queue, args.src_dir)
+    n_examples = run_worker(queue, args.src_dir,
+                            poll_interval=args.poll_interval,
+                            idle_timeout=args.idle_timeout)
+    print('Generated {0} examples'.format(n_examples))